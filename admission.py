@@ -0,0 +1,247 @@
+# admission.py
+# 過載時的准入控制：活動上線時少數重度使用者灌爆 /api/check_compliance，
+# 每個 request 都直接開跑、搶 Gemini 配額，結果大家的 p99 一起爆掉。
+#
+# - 全域同時執行上限 ADMISSION_MAX_CONCURRENCY，其餘進有上限的等待佇列
+# - 每個 user_id：同時執行上限 + token bucket 速率限制
+# - 佇列依使用者做加權公平排程（start-time fair queuing：每放行一個，
+#   該使用者的 virtual finish 往後推 1/weight，每次挑 virtual start 最小的）
+# - 佇列滿、速率超過、或預估等待已經超過 deadline → 直接丟 Overloaded，
+#   main.py 轉成 429 + Retry-After
+#
+# 只在單一 event loop 裡使用，不需要 thread lock。
+
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from metrics import Counter, Gauge, Histogram, log_event
+
+load_dotenv()
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_PER_USER_CONCURRENCY = int(os.getenv("ADMISSION_PER_USER_CONCURRENCY", "4"))
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "5"))  # 每秒；0 = 不限速
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "20"))
+# 預估等待用的平均處理時間初始值（之後用 EWMA 更新）
+ADMISSION_INITIAL_SERVICE_SECONDS = float(os.getenv("ADMISSION_INITIAL_SERVICE_SECONDS", "3"))
+# "user-a:4,user-b:0.5"；沒列到的權重 1
+ADMISSION_USER_WEIGHTS = os.getenv("ADMISSION_USER_WEIGHTS", "")
+
+ADMISSION_QUEUE_DEPTH = Gauge("lawpatrol_admission_queue_depth", "Requests waiting for admission")
+ADMISSION_ACTIVE = Gauge("lawpatrol_admission_active", "Admitted requests currently running")
+ADMISSION_WAIT_SECONDS = Histogram(
+    "lawpatrol_admission_wait_seconds", "Time spent waiting for admission"
+)
+ADMISSION_SHED = Counter(
+    "lawpatrol_admission_shed_total", "Requests rejected with 429", ["reason"]
+)
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    for part in value.split(","):
+        if ":" not in part:
+            continue
+        user, weight = part.rsplit(":", 1)
+        try:
+            weights[user.strip()] = max(float(weight), 0.01)
+        except ValueError:
+            print(f"⚠️ ADMISSION_USER_WEIGHTS 格式錯誤：{part}")
+    return weights
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        per_user_concurrency: int = ADMISSION_PER_USER_CONCURRENCY,
+        user_rate: float = ADMISSION_USER_RATE,
+        user_burst: float = ADMISSION_USER_BURST,
+        weights: Optional[Dict[str, float]] = None,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.per_user_concurrency = max(1, per_user_concurrency)
+        self.user_rate = user_rate
+        self.user_burst = max(1.0, user_burst)
+        self.weights = weights if weights is not None else parse_weights(ADMISSION_USER_WEIGHTS)
+
+        self._active = 0
+        self._active_by_user: Dict[str, int] = {}
+        self._queues: Dict[str, Deque[asyncio.Future]] = {}
+        self._queued = 0
+        self._vtime = 0.0
+        self._finish: Dict[str, float] = {}
+        self._buckets: Dict[str, List[float]] = {}  # user -> [tokens, last_refill]
+        self._buckets_swept_at = time.monotonic()
+        self._service_seconds = ADMISSION_INITIAL_SERVICE_SECONDS
+
+    # ---------- 速率限制 ----------
+    def _take_token(self, user: str) -> Optional[float]:
+        """有 token 就扣掉回傳 None，沒有就回傳要等幾秒。"""
+        if self.user_rate <= 0:
+            return None
+        now = time.monotonic()
+        self._sweep_buckets(now)
+        bucket = self._buckets.setdefault(user, [self.user_burst, now])
+        bucket[0] = min(self.user_burst, bucket[0] + (now - bucket[1]) * self.user_rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return None
+        return (1 - bucket[0]) / self.user_rate
+
+    def _bucket_idle(self, user: str, now: float) -> bool:
+        """已經補滿、又沒有執行中或排隊中的 request：刪掉跟重新建一個滿的 bucket 沒有差別。"""
+        bucket = self._buckets.get(user)
+        return (
+            bucket is not None
+            and bucket[0] + (now - bucket[1]) * self.user_rate >= self.user_burst
+            and user not in self._active_by_user
+            and user not in self._queues
+        )
+
+    def _sweep_buckets(self, now: float) -> None:
+        # 每個 user key（包含 ip:）都有一個 bucket；補滿一次的時間掃一次，清掉閒置的
+        if now - self._buckets_swept_at < self.user_burst / self.user_rate:
+            return
+        self._buckets_swept_at = now
+        for user in [u for u in self._buckets if self._bucket_idle(u, now)]:
+            del self._buckets[user]
+
+    # ---------- 排程 ----------
+    @property
+    def busy(self) -> bool:
+        """已經有人在排隊，或執行中的數量到上限（給背景的加值工作判斷要不要先跳過）。"""
+        return self._queued > 0 or self._active >= self.max_concurrency
+
+    def estimated_wait(self, position: int) -> float:
+        return position / self.max_concurrency * self._service_seconds
+
+    def _can_run(self, user: str) -> bool:
+        return (
+            self._active < self.max_concurrency
+            and self._active_by_user.get(user, 0) < self.per_user_concurrency
+        )
+
+    def _start(self, user: str) -> None:
+        start = max(self._vtime, self._finish.get(user, 0.0))
+        self._vtime = start
+        self._finish[user] = start + 1.0 / self.weights.get(user, 1.0)
+        self._active += 1
+        self._active_by_user[user] = self._active_by_user.get(user, 0) + 1
+        ADMISSION_ACTIVE.set(self._active)
+
+    def _dispatch(self) -> None:
+        while self._active < self.max_concurrency:
+            candidates = [u for u, q in self._queues.items() if q and self._can_run(u)]
+            if not candidates:
+                return
+            user = min(candidates, key=lambda u: max(self._vtime, self._finish.get(u, 0.0)))
+            waiter = self._queues[user].popleft()
+            if not self._queues[user]:
+                del self._queues[user]
+            self._queued -= 1
+            ADMISSION_QUEUE_DEPTH.set(self._queued)
+            if waiter.done():
+                continue
+            self._start(user)
+            waiter.set_result(None)
+
+    def _release(self, user: str, started_at: float, record_service: bool = True) -> None:
+        """record_service=False：沒有真的跑完（剛放行就取消、中途失敗），不拿來更新平均處理時間。"""
+        self._active -= 1
+        remaining = self._active_by_user.get(user, 1) - 1
+        if remaining > 0:
+            self._active_by_user[user] = remaining
+        else:
+            self._active_by_user.pop(user, None)
+            # 閒置使用者的 finish tag 已經落後 vtime 就沒用了，清掉免得無限長大
+            if user not in self._queues and self._finish.get(user, 0.0) <= self._vtime:
+                self._finish.pop(user, None)
+            if self._bucket_idle(user, time.monotonic()):
+                self._buckets.pop(user, None)
+        ADMISSION_ACTIVE.set(self._active)
+
+        if record_service:
+            elapsed = time.monotonic() - started_at
+            self._service_seconds = 0.9 * self._service_seconds + 0.1 * elapsed
+        self._dispatch()
+
+    def _shed(self, reason: str, retry_after: float, user: str) -> Overloaded:
+        ADMISSION_SHED.inc(reason=reason)
+        log_event("admission_shed", reason=reason, user_id=user, retry_after=round(retry_after, 2))
+        return Overloaded(reason, retry_after)
+
+    # ---------- 入口 ----------
+    @asynccontextmanager
+    async def admit(self, user: str, deadline: Optional[float] = None):
+        wait = self._take_token(user)
+        if wait is not None:
+            raise self._shed("user_rate", wait, user)
+
+        queued_at = time.monotonic()
+        if self._can_run(user) and user not in self._queues:
+            self._start(user)
+        else:
+            if self._queued >= self.max_queue:
+                raise self._shed("queue_full", self.estimated_wait(self._queued), user)
+
+            estimate = self.estimated_wait(self._queued + 1)
+            if deadline is not None and queued_at + estimate > deadline:
+                raise self._shed("deadline", estimate, user)
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(user, deque()).append(waiter)
+            self._queued += 1
+            ADMISSION_QUEUE_DEPTH.set(self._queued)
+
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), timeout=timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.done() and not waiter.cancelled():
+                    # 剛好被放行又被取消：把位子還回去
+                    self._release(user, time.monotonic(), record_service=False)
+                else:
+                    self._queues[user].remove(waiter)
+                    if not self._queues[user]:
+                        del self._queues[user]
+                    self._queued -= 1
+                    ADMISSION_QUEUE_DEPTH.set(self._queued)
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self._shed("deadline", self.estimated_wait(self._queued), user)
+                raise
+
+        started_at = time.monotonic()
+        ADMISSION_WAIT_SECONDS.observe(started_at - queued_at)
+        completed = False
+        try:
+            yield
+            completed = True
+        finally:
+            self._release(user, started_at, record_service=completed)
+
+
+admission = AdmissionController()
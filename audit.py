@@ -0,0 +1,285 @@
+# audit.py
+# 每一次檢測的稽核紀錄（public.check_audit）：誰、哪段文字（只存 hash）、tags、risk、各階段耗時。
+#
+# 寫 DB 不能放在 request 路徑上（每個 request 多一趟 Postgres）：
+# - request 結束時 submit() 只把一筆 dict 丟進有上限的記憶體佇列
+# - 背景 thread 攢到 AUDIT_BATCH_SIZE 筆或等滿 AUDIT_FLUSH_INTERVAL_SECONDS 就用多列 INSERT 一次寫入
+# - 佇列滿了依 AUDIT_OVERFLOW 處理：
+#     drop_new     丟掉這筆（預設，request 完全不受影響）
+#     drop_oldest  丟掉最舊的一筆，留新的
+#     block        最多等 AUDIT_BLOCK_TIMEOUT_MS（會卡住 event loop，只適合寧可慢也不要漏的部署）
+# - 關機時（lifespan 結束）把佇列裡剩下的最多花 AUDIT_DRAIN_SECONDS 寫完
+# 寫入失敗的那批直接丟掉並計數，不重試，避免 DB 掛掉時越積越多。
+#
+# 各階段耗時來自 metrics.stage()：request 開頭 begin() 之後，同名 stage 的時間會加總進 stage_ms。
+
+import os
+import time
+import queue
+import hashlib
+import threading
+import contextvars
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from psycopg2.extras import Json, execute_values
+
+from database import get_db_connection, release_db_connection
+from metrics import Counter, Gauge, Histogram, log_event, request_id_var, stage_timings_var
+
+load_dotenv()
+
+AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "1") == "1"
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "1.0"))
+AUDIT_OVERFLOW = os.getenv("AUDIT_OVERFLOW", "drop_new")  # drop_new | drop_oldest | block
+AUDIT_BLOCK_TIMEOUT_MS = float(os.getenv("AUDIT_BLOCK_TIMEOUT_MS", "50"))
+AUDIT_DRAIN_SECONDS = float(os.getenv("AUDIT_DRAIN_SECONDS", "5"))
+
+AUDIT_RECORDS = Counter(
+    "lawpatrol_audit_records_total", "Audit records by outcome", ["result"]
+)
+AUDIT_QUEUE_DEPTH = Gauge("lawpatrol_audit_queue_depth", "Audit records waiting to be written")
+AUDIT_FLUSH_SECONDS = Histogram(
+    "lawpatrol_audit_flush_seconds", "Time to write one audit batch", ["result"]
+)
+
+AUDIT_DDL = """
+    CREATE TABLE IF NOT EXISTS public.check_audit (
+        id               BIGSERIAL PRIMARY KEY,
+        ts               TIMESTAMPTZ NOT NULL,
+        request_id       TEXT,
+        endpoint         TEXT NOT NULL,
+        status           TEXT NOT NULL,
+        user_id          TEXT,
+        user_key         TEXT,
+        text_sha256      TEXT NOT NULL,
+        text_length      INTEGER NOT NULL,
+        mode             TEXT,
+        category         TEXT,
+        risk             REAL,
+        tags             TEXT[],
+        highlights       INTEGER,
+        partial          BOOLEAN,
+        timed_out_stages TEXT[],
+        stage_ms         JSONB,
+        total_ms         REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS check_audit_ts_idx ON public.check_audit (ts);
+"""
+
+COLUMNS = [
+    "ts", "request_id", "endpoint", "status", "user_id", "user_key", "text_sha256", "text_length",
+    "mode", "category", "risk", "tags", "highlights", "partial", "timed_out_stages", "stage_ms", "total_ms",
+]
+
+# 目前這個 request 的紀錄（begin() 之後各處用 note() 補欄位）
+audit_var: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "audit_record", default=None
+)
+
+
+# ==========================================
+# 1. request 路徑：組紀錄（只動記憶體）
+# ==========================================
+def begin(endpoint: str) -> Dict[str, Any]:
+    """request 開頭呼叫；之後建立的 task / worker thread 都會寫進同一份 stage 耗時。"""
+    record: Dict[str, Any] = {
+        "endpoint": endpoint,
+        "started": time.perf_counter(),
+        "stage_seconds": {},
+    }
+    audit_var.set(record)
+    stage_timings_var.set(record["stage_seconds"])
+    return record
+
+
+def note(**fields) -> None:
+    record = audit_var.get()
+    if record is not None:
+        record.update(fields)
+
+
+def note_input(user_text: str, user_id: Optional[str], user_key: str, mode: str) -> None:
+    note(
+        user_id=user_id,
+        user_key=user_key,
+        text_sha256=hashlib.sha256(user_text.encode("utf-8")).hexdigest(),
+        text_length=len(user_text),
+        mode=mode,
+    )
+
+
+def finish(record: Dict[str, Any], status: str) -> None:
+    """request 結束時呼叫；沒走到檢測（例如 400）的 request 沒有 text_sha256，不記。"""
+    if not AUDIT_ENABLED or "text_sha256" not in record:
+        return
+    # 被放棄的檢索 worker（共用同一份 context）可能還在往 stage_seconds 加 key，先複製再走訪
+    stage_seconds = dict(record["stage_seconds"])
+    audit_log.submit({
+        "ts": time.time(),
+        "request_id": request_id_var.get(),
+        "endpoint": record["endpoint"],
+        "status": status,
+        "user_id": record.get("user_id"),
+        "user_key": record.get("user_key"),
+        "text_sha256": record["text_sha256"],
+        "text_length": record["text_length"],
+        "mode": record.get("mode"),
+        "category": record.get("category"),
+        "risk": record.get("risk"),
+        "tags": record.get("tags"),
+        "highlights": record.get("highlights"),
+        "partial": record.get("partial"),
+        "timed_out_stages": record.get("timed_out_stages"),
+        "stage_ms": {k: round(v * 1000, 2) for k, v in stage_seconds.items()},
+        "total_ms": round((time.perf_counter() - record["started"]) * 1000, 2),
+    })
+
+
+# ==========================================
+# 2. 背景寫入
+# ==========================================
+class AuditLog:
+    def __init__(
+        self,
+        maxsize: int = AUDIT_QUEUE_SIZE,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL_SECONDS,
+        overflow: str = AUDIT_OVERFLOW,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._drain_deadline: Optional[float] = None
+        self._schema_ready = False
+
+    # ---------- 生產端（request 路徑） ----------
+    def submit(self, record: Dict[str, Any]) -> bool:
+        if self._stop.is_set():
+            AUDIT_RECORDS.inc(result="dropped")
+            return False
+        self._ensure_started()
+        try:
+            if self.overflow == "block":
+                self._queue.put(record, timeout=AUDIT_BLOCK_TIMEOUT_MS / 1000)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow != "drop_oldest":
+                AUDIT_RECORDS.inc(result="dropped")
+                return False
+            try:
+                self._queue.get_nowait()
+                AUDIT_RECORDS.inc(result="dropped")
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                AUDIT_RECORDS.inc(result="dropped")
+                return False
+        AUDIT_RECORDS.inc(result="queued")
+        AUDIT_QUEUE_DEPTH.set(self._queue.qsize())
+        return True
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    # ---------- 消費端（背景 thread） ----------
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        """等到第一筆，再最多等 flush_interval 湊滿一批。"""
+        batch: List[Dict[str, Any]] = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        flush_at = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = flush_at - time.monotonic()
+            try:
+                # 時間到（或正在關機）就只拿已經在佇列裡的
+                if self._stop.is_set() or timeout <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            if self._stop.is_set() and (
+                self._queue.empty() or time.monotonic() > (self._drain_deadline or 0)
+            ):
+                break
+            batch = self._next_batch()
+            AUDIT_QUEUE_DEPTH.set(self._queue.qsize())
+            if batch:
+                self._write(batch)
+
+        left = self._queue.qsize()
+        if left:
+            AUDIT_RECORDS.inc(left, result="dropped")
+            print(f"⚠️ 稽核紀錄關機時還有 {left} 筆沒寫完，已丟棄")
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        started = time.perf_counter()
+        conn = get_db_connection()
+        if not conn:
+            AUDIT_RECORDS.inc(len(batch), result="failed")
+            AUDIT_FLUSH_SECONDS.observe(time.perf_counter() - started, result="db_unavailable")
+            return
+        try:
+            with conn.cursor() as cur:
+                if not self._schema_ready:
+                    cur.execute(AUDIT_DDL)
+                    self._schema_ready = True
+                execute_values(
+                    cur,
+                    f"INSERT INTO public.check_audit ({', '.join(COLUMNS)}) VALUES %s",
+                    [self._row(r) for r in batch],
+                    template="(to_timestamp(%s), " + ", ".join(["%s"] * (len(COLUMNS) - 1)) + ")",
+                    page_size=len(batch),
+                )
+            conn.commit()
+            AUDIT_RECORDS.inc(len(batch), result="written")
+            AUDIT_FLUSH_SECONDS.observe(time.perf_counter() - started, result="ok")
+        except Exception as e:
+            print(f"❌ 寫入稽核紀錄失敗（{len(batch)} 筆已丟棄）: {e}")
+            self._schema_ready = False
+            AUDIT_RECORDS.inc(len(batch), result="failed")
+            AUDIT_FLUSH_SECONDS.observe(time.perf_counter() - started, result="error")
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def _row(record: Dict[str, Any]) -> tuple:
+        return tuple(
+            Json(record[col]) if col == "stage_ms" else record.get(col)
+            for col in COLUMNS
+        )
+
+    # ---------- 關機 ----------
+    def close(self, drain_seconds: float = AUDIT_DRAIN_SECONDS) -> Dict[str, int]:
+        """停止收新紀錄，佇列裡的最多花 drain_seconds 寫完（lifespan 結束時呼叫）。"""
+        self._drain_deadline = time.monotonic() + drain_seconds
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=drain_seconds + self.flush_interval + 1)
+        stats = {"left": self._queue.qsize()}
+        log_event("audit_drained", **stats)
+        return stats
+
+
+audit_log = AuditLog()
@@ -10,6 +10,7 @@ import google.generativeai as genai
 
 from prompts import TAG_CATEGORIES, get_formatted_tags_prompt, STEP1_PROMPT_TEMPLATE
 from database import TAG_MAPPING  # 直接沿用你原本的 Tag 對照表
+from cache import invalidate_data_caches
 
 # ========= 1. 環境變數 & 模型設定 =========
 
@@ -22,14 +23,22 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
 API_KEY = os.getenv("GOOGLE_API_KEY")
-if not API_KEY:
-    raise RuntimeError("❌ 找不到 GOOGLE_API_KEY，請先在 .env 設定")
 
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel(
-    model_name="gemini-2.5-flash",
-    generation_config={"response_mime_type": "application/json"}
-)
+# 模型在第一次真的要標 Tag 時才建立，讓 API 的排程器可以 import 這個模組
+_model = None
+
+
+def get_model():
+    global _model
+    if _model is None:
+        if not API_KEY:
+            raise RuntimeError("❌ 找不到 GOOGLE_API_KEY，請先在 .env 設定")
+        genai.configure(api_key=API_KEY)
+        _model = genai.GenerativeModel(
+            model_name="gemini-2.5-flash",
+            generation_config={"response_mime_type": "application/json"}
+        )
+    return _model
 
 # 一次處理幾筆（可以自行調整）
 BATCH_SIZE = 50
@@ -67,6 +76,24 @@ def build_unlabeled_where_clause() -> str:
 UNLABELED_WHERE = build_unlabeled_where_clause()
 
 
+def fetch_unlabeled_batch(conn, last_seen_id: int, limit: int) -> list:
+    """
+    撈 id > last_seen_id 的一批未標註案件。
+    用 id 往後翻頁：標不出 Tag 的案件仍是「未標註」，不加這個會一直撈到同一批。
+    """
+    sql = f"""
+        SELECT id, product_name, case_explaination
+        FROM violation_cases
+        WHERE {UNLABELED_WHERE}
+          AND id > %s
+        ORDER BY id
+        LIMIT {int(limit)};
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(sql, (last_seen_id,))
+        return cur.fetchall()
+
+
 # ========= 4. 呼叫 LLM 做 Step1：辨識 Tag =========
 # （industry 有沒有都無所謂，我們只用 identified_tags）
 
@@ -76,7 +103,7 @@ def call_step1_llm(text: str):
         tags_context_str=tags_context,
         user_text=text
     )
-    resp = model.generate_content(prompt)
+    resp = get_model().generate_content(prompt)
     try:
         data = resp.json  # 新版 SDK，有可能存在
     except Exception:
@@ -122,37 +149,36 @@ def build_tag_update_fields(step1_result):
 
 # ========= 6. 主流程：批次撈資料 -> LLM 標 Tag -> 回寫 =========
 
-def auto_tag_loop():
+def auto_tag_loop(max_total: int = MAX_TOTAL, progress=None) -> list:
+    """
+    回傳這次有更新 Tag 的案件 id（已 commit 的），讓後續同步只處理這些。
+    中途失敗時照樣丟出例外，已 commit 的 id 放在例外的 updated_ids 屬性上。
+    progress(done, total, message)：給 API 的排程器回報進度用，可省略。
+    """
     print("🚀 auto_tag_cases 啟動（只更新 Tag，不修改 industry）")
+    get_model()
 
     conn = get_conn()
     conn.autocommit = False  # 用 transaction 批次 commit
 
     processed_total = 0  # ⭐ 已處理總筆數
+    updated_ids = []     # 已 commit 的案件 id
+    batch_ids = []       # 本批次還沒 commit 的
+    last_seen_id = 0
 
     try:
         while True:
             # ⭐ 如果已經處理到上限，就結束
-            if processed_total >= MAX_TOTAL:
-                print(f"✅ 已處理 {processed_total} 筆，達到上限 {MAX_TOTAL}，任務結束")
+            if processed_total >= max_total:
+                print(f"✅ 已處理 {processed_total} 筆，達到上限 {max_total}，任務結束")
                 break
 
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                print("🔍 準備撈一批尚未標 Tag 的資料...")
+            print("🔍 準備撈一批尚未標 Tag 的資料...")
 
-                # 計算這一批最多還能撈幾筆（避免超過 536）
-                remaining = MAX_TOTAL - processed_total
-                limit = min(BATCH_SIZE, remaining)
-
-                sql = f"""
-                    SELECT id, product_name, case_explaination
-                    FROM violation_cases
-                    WHERE {UNLABELED_WHERE}
-                    ORDER BY id
-                    LIMIT {limit};
-                """
-                cur.execute(sql)
-                rows = cur.fetchall()
+            # 計算這一批最多還能撈幾筆（避免超過 536）
+            remaining = max_total - processed_total
+            limit = min(BATCH_SIZE, remaining)
+            rows = fetch_unlabeled_batch(conn, last_seen_id, limit)
 
             if not rows:
                 print("✅ 找不到更多未標註的案件，任務結束")
@@ -162,6 +188,7 @@ def auto_tag_loop():
 
             for row in rows:
                 case_id = row["id"]
+                last_seen_id = case_id
                 product_name = row.get("product_name") or ""
                 text = row.get("case_explaination") or ""
 
@@ -205,21 +232,34 @@ def auto_tag_loop():
 
                 print(f"✅ 已更新 ID {case_id} 的 Tag 欄位：{list(update_fields.keys())}")
                 processed_total += 1  # ⭐ 累計總共處理幾筆
+                batch_ids.append(case_id)
+                if progress:
+                    progress(processed_total, max_total, f"tagged id={case_id}")
 
                 # 避免打太快被 API 限速，可依情況調整或拿掉
                 time.sleep(0.2)
 
             # 每一批 commit 一次
             conn.commit()
+            updated_ids.extend(batch_ids)
+            batch_ids = []
             print("💾 本批次已寫入資料庫並 commit\n")
 
     except Exception as e:
         conn.rollback()
         print(f"❌ 發生錯誤，已 rollback：{e}")
+        # 往上丟，排程器才會把這次 job 記成失敗；已 commit 的批次不受影響，
+        # id 掛在例外上，呼叫端（jobs.job_refresh）還是可以把它們同步進向量庫
+        e.updated_ids = list(updated_ids)
+        raise
     finally:
         conn.close()
+        # Tag 欄位變了 → 風險快照等資料快取要重算
+        invalidate_data_caches()
         print("🏁 auto_tag_cases 結束")
 
+    return updated_ids
+
 
 if __name__ == "__main__":
     auto_tag_loop()
@@ -0,0 +1,402 @@
+# benchmarks/fakes.py
+# 壓測用的本機替身：假 Gemini（可調延遲分佈 + 固定 JSON）、假 Pinecone index、
+# 以及用 SQLite 裝 violation_cases fixture 的假 Postgres 連線池。
+#
+# install_fakes() 會直接塞進 database.py / logic.py 的 lazy accessor 狀態，
+# 之後 import main 跑起來的 app 完全不會碰到外部 API。
+
+import os
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import hashlib
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from database import TAG_MAPPING
+
+EMBEDDING_DIM = 768
+
+ZH_INDUSTRIES = ["食物", "化妝品", "藥品", "醫療器材"]
+
+# Step 1 固定回傳：文案裡要真的有這些 trigger word，find_text_indices 才找得到位置
+DEFAULT_STEP1 = {
+    "industry": "Food",
+    "identified_tags": [
+        {"tag": "燃脂瘦身", "trigger_words": ["甩油"]},
+        {"tag": "保證承諾", "trigger_words": ["保證"]},
+        {"tag": "三高心血管", "trigger_words": ["降血壓"]},
+    ],
+}
+
+FAKE_SUGGESTION = "本產品含膳食纖維與多種營養成分，有助維持正常代謝與健康體態。"
+
+SAMPLE_TEXTS = [
+    "本產品採用獨家配方，保證三天甩油，還能幫助降血壓，第{n}代升級版。",
+    "每天一包，輕鬆甩油不復胖，保證有效，限量{n}組。",
+    "專家推薦！喝了就能甩油，降血壓不是夢，編號{n}。",
+]
+
+
+# ==========================================
+# 1. 延遲分佈
+# ==========================================
+@dataclass
+class LatencyModel:
+    """對數常態分佈：median 秒 + sigma；error_rate 機率丟出例外。"""
+
+    median: float
+    sigma: float = 0.3
+    error_rate: float = 0.0
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return random.lognormvariate(0.0, self.sigma) * self.median
+
+    def maybe_fail(self, what: str) -> None:
+        if self.error_rate and random.random() < self.error_rate:
+            raise RuntimeError(f"fake {what} error")
+
+
+# ==========================================
+# 2. violation_cases fixture
+# ==========================================
+def build_case_fixture(cases_per_tag: int = 3) -> List[Dict[str, Any]]:
+    """每個 tag 產生幾筆案例，產業輪流分配；第一筆固定是「食物」。"""
+    cases = []
+    case_id = 1
+    for tag, column in TAG_MAPPING.items():
+        for i in range(cases_per_tag):
+            cases.append({
+                "id": case_id,
+                "product_name": f"示範產品-{tag}-{i + 1}",
+                "case_explaination": f"廣告宣稱與「{tag}」相關之療效，違規案例 {case_id}。",
+                "violation_law": "食品安全衛生管理法第28條",
+                "case_date": f"2024-{(i % 12) + 1:02d}",
+                "source_link": f"https://example.com/cases/{case_id}",
+                "industry": ZH_INDUSTRIES[i % len(ZH_INDUSTRIES)],
+                "violation_type": "",
+                "tags": {column: 1},
+            })
+            case_id += 1
+    return cases
+
+
+def fake_embedding(text: str) -> List[float]:
+    """用 hash 產生穩定的假向量（同一段文字每次都一樣）。"""
+    seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16)
+    rng = random.Random(seed)
+    return [rng.uniform(-1.0, 1.0) for _ in range(EMBEDDING_DIM)]
+
+
+# ==========================================
+# 3. 假 Postgres：SQLite 檔 + 連線池介面
+# ==========================================
+class _CursorContext:
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+        return False
+
+    def execute(self, sql: str, params=None):
+        sql = sql.replace("public.", "").replace("%s", "?")
+        return self._cursor.execute(sql, params or ())
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+
+class FakePgConnection:
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self.closed = 0
+
+    def cursor(self, *args, **kwargs):
+        return _CursorContext(self._conn.cursor())
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+        self.closed = 1
+
+
+class FakePgPool:
+    """介面對齊 psycopg2 ThreadedConnectionPool 的 getconn / putconn。"""
+
+    def __init__(self, path: str, query_latency: Optional[LatencyModel] = None):
+        self.path = path
+        self.query_latency = query_latency
+        self._idle: List[FakePgConnection] = []
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        if self.query_latency:
+            time.sleep(self.query_latency.sample())
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return FakePgConnection(self.path)
+
+    def putconn(self, conn, close: bool = False):
+        if close:
+            conn.close()
+            return
+        with self._lock:
+            self._idle.append(conn)
+
+
+def create_sqlite_fixture(cases: List[Dict[str, Any]], path: Optional[str] = None) -> str:
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="lawpatrol_bench_", suffix=".sqlite3")
+        os.close(fd)
+
+    columns = list(TAG_MAPPING.values())
+    conn = sqlite3.connect(path)
+    conn.execute("DROP TABLE IF EXISTS violation_cases;")
+    conn.execute(
+        f"""
+        CREATE TABLE violation_cases (
+            id INTEGER PRIMARY KEY,
+            product_name TEXT,
+            case_explaination TEXT,
+            violation_law TEXT,
+            case_date TEXT,
+            source_link TEXT,
+            industry TEXT,
+            violation_type TEXT,
+            {", ".join(f"{c} INTEGER DEFAULT 0" for c in columns)}
+        );
+        """
+    )
+    for case in cases:
+        tag_values = [case["tags"].get(c, 0) for c in columns]
+        conn.execute(
+            f"""
+            INSERT INTO violation_cases (
+                id, product_name, case_explaination, violation_law, case_date,
+                source_link, industry, violation_type, {", ".join(columns)}
+            ) VALUES ({", ".join(["?"] * (8 + len(columns)))});
+            """,
+            [
+                case["id"], case["product_name"], case["case_explaination"],
+                case["violation_law"], case["case_date"], case["source_link"],
+                case["industry"], case["violation_type"], *tag_values,
+            ],
+        )
+    conn.commit()
+    conn.close()
+    return path
+
+
+# ==========================================
+# 4. 假 Pinecone index
+# ==========================================
+class FakeIndex:
+    def __init__(self, cases: List[Dict[str, Any]], latency: LatencyModel):
+        self.latency = latency
+        column_to_tag = {v: k for k, v in TAG_MAPPING.items()}
+        self.records = []
+        for case in cases:
+            tags = [column_to_tag[c] for c, v in case["tags"].items() if v == 1]
+            self.records.append({
+                "id": str(case["id"]),
+                "metadata": {
+                    "product_name": case["product_name"],
+                    "explanation": case["case_explaination"],
+                    "law": case["violation_law"],
+                    "date": case["case_date"],
+                    "link": case["source_link"],
+                    "industry": case["industry"],
+                    "tag_name": tags,
+                },
+            })
+
+    def _match(self, meta: Dict[str, Any], flt: Optional[Dict[str, Any]]) -> bool:
+        for key, cond in (flt or {}).items():
+            value = meta.get(key)
+            if isinstance(cond, dict) and "$in" in cond:
+                values = value if isinstance(value, list) else [value]
+                if not set(values) & set(cond["$in"]):
+                    return False
+            elif isinstance(value, list):
+                if cond not in value:
+                    return False
+            elif value != cond:
+                return False
+        return True
+
+    def query(self, vector=None, top_k=2, include_metadata=True, filter=None, **kwargs):
+        time.sleep(self.latency.sample())
+        self.latency.maybe_fail("pinecone")
+        hits = [r for r in self.records if self._match(r["metadata"], filter)][:top_k]
+        return {
+            "matches": [
+                {
+                    "id": r["id"],
+                    "score": round(0.9 - 0.05 * i, 3),
+                    "metadata": r["metadata"] if include_metadata else None,
+                }
+                for i, r in enumerate(hits)
+            ]
+        }
+
+
+# ==========================================
+# 5. 假 Gemini
+# ==========================================
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _FakeStream:
+    """stream=True 的回傳：async for 一段一段吐（每段之間平均分攤延遲）。"""
+
+    def __init__(self, text: str, latency: float, chunk_chars: int = 8):
+        self.chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+        self.delay = latency / len(self.chunks)
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield _FakeResponse(chunk)
+
+
+class FakeGenerativeModel:
+    """依 prompt 內容分辨 Step 1 / Step 3 / 整段改寫，回傳固定內容。"""
+
+    def __init__(
+        self,
+        step1: Dict[str, Any],
+        step3: Dict[str, Any],
+        step1_latency: LatencyModel,
+        step3_latency: LatencyModel,
+        suggestion_latency: Optional[LatencyModel] = None,
+    ):
+        self.step1_text = json.dumps(step1, ensure_ascii=False)
+        self.step3_text = json.dumps(step3, ensure_ascii=False)
+        self.step1_latency = step1_latency
+        self.step3_latency = step3_latency
+        self.suggestion_latency = suggestion_latency or step3_latency
+
+    async def generate_content_async(self, prompt: str, stream: bool = False, **kwargs):
+        if "違規主題列表" in prompt:
+            await asyncio.sleep(self.step1_latency.sample())
+            self.step1_latency.maybe_fail("step1")
+            return _FakeResponse(self.step1_text)
+
+        if "改寫任務" in prompt:
+            latency = self.suggestion_latency.sample()
+            self.suggestion_latency.maybe_fail("suggestion")
+            if stream:
+                return _FakeStream(FAKE_SUGGESTION, latency)
+            await asyncio.sleep(latency)
+            return _FakeResponse(FAKE_SUGGESTION)
+
+        await asyncio.sleep(self.step3_latency.sample())
+        self.step3_latency.maybe_fail("step3")
+        return _FakeResponse(self.step3_text)
+
+    def generate_content(self, prompt: str, **kwargs):
+        return asyncio.run(self.generate_content_async(prompt, **kwargs))
+
+
+class FakeGenAI:
+    """只實作 embed_content；GenerativeModel 由 FakeGenerativeModel 處理。"""
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+
+    def embed_content(self, model=None, content=None, task_type=None, **kwargs):
+        time.sleep(self.latency.sample())
+        self.latency.maybe_fail("embedding")
+        if isinstance(content, list):
+            return {"embedding": [fake_embedding(c) for c in content]}
+        return {"embedding": fake_embedding(content)}
+
+
+def build_step3_response(step1: Dict[str, Any], cases: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """讓 Step 3 的 reference_cases 對得上 FakeIndex 會回傳的案例（食物產業那一筆）。"""
+    results = []
+    for item in step1.get("identified_tags", []):
+        tag = item["tag"]
+        ref = next(
+            (c for c in cases if TAG_MAPPING[tag] in c["tags"] and c["industry"] == "食物"),
+            None,
+        )
+        for word in item.get("trigger_words", []):
+            results.append({
+                "trigger_word": word,
+                "tag": tag,
+                "reason": f"「{word}」涉及{tag}之誇大或醫療效能宣稱。",
+                "law": "食品安全衛生管理法第28條",
+                "reference_cases": (
+                    [{"product_name": ref["product_name"], "date": ref["case_date"]}] if ref else []
+                ),
+            })
+    return {"analysis_results": results}
+
+
+# ==========================================
+# 6. 安裝替身
+# ==========================================
+@dataclass
+class FakeConfig:
+    step1_latency: LatencyModel = field(default_factory=lambda: LatencyModel(0.8, 0.35))
+    step3_latency: LatencyModel = field(default_factory=lambda: LatencyModel(1.5, 0.35))
+    suggestion_latency: LatencyModel = field(default_factory=lambda: LatencyModel(1.0, 0.35))
+    embed_latency: LatencyModel = field(default_factory=lambda: LatencyModel(0.03, 0.3))
+    vector_latency: LatencyModel = field(default_factory=lambda: LatencyModel(0.04, 0.3))
+    db_latency: Optional[LatencyModel] = None
+    step1: Dict[str, Any] = field(default_factory=lambda: dict(DEFAULT_STEP1))
+    step3: Optional[Dict[str, Any]] = None
+    cases_per_tag: int = 3
+
+
+def install_fakes(config: FakeConfig) -> Dict[str, Any]:
+    """把 database / logic 的 lazy client 換成本機替身，回傳 fixture 資訊。"""
+    import database
+    import logic
+
+    cases = build_case_fixture(config.cases_per_tag)
+    sqlite_path = create_sqlite_fixture(cases)
+    step3 = config.step3 or build_step3_response(config.step1, cases)
+
+    # database.py：Gemini embedding / Pinecone / Postgres 連線池
+    fake_genai = FakeGenAI(config.embed_latency)
+    database.get_genai = lambda: fake_genai
+    database.index = FakeIndex(cases, config.vector_latency)
+    database._pinecone_tried = True
+    database._db_pool = FakePgPool(sqlite_path, config.db_latency)
+
+    # logic.py：GenerativeModel
+    logic._model = FakeGenerativeModel(
+        config.step1, step3, config.step1_latency, config.step3_latency, config.suggestion_latency
+    )
+    logic._model_tried = True
+
+    # audit.py：假的 Postgres 是 SQLite，寫不進 check_audit（JSONB / 陣列）；
+    # request 路徑上的 submit / 佇列照跑，只有背景寫入換成直接丟掉
+    import audit
+
+    audit.audit_log._write = lambda batch: None
+
+    return {"sqlite_path": sqlite_path, "cases": len(cases)}
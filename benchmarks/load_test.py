@@ -0,0 +1,260 @@
+# benchmarks/load_test.py
+# 端到端壓測：本機起 main:app（Gemini / Pinecone / Postgres 全部換成替身），
+# 用固定併發打 /api/check_compliance，輸出 p50/p95/p99、RPS、錯誤率並存成 JSON。
+#
+# 用法（在 repo 根目錄）：
+#   python -m benchmarks.load_test --requests 500 --concurrency 32
+#   python -m benchmarks.load_test --step1-ms 400 --step3-ms 900 --error-rate 0.01
+#   python -m benchmarks.load_test --compare benchmarks/results/20250101-120000.json
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import asyncio
+import argparse
+import threading
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from benchmarks.fakes import FakeConfig, LatencyModel, SAMPLE_TEXTS, install_fakes
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+# ==========================================
+# 1. 起 server（同一個 process，背景 thread）
+# ==========================================
+def start_server(host: str, port: int):
+    import uvicorn
+    import main
+
+    config = uvicorn.Config(main.app, host=host, port=port, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    deadline = time.time() + 15
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("uvicorn 啟動逾時")
+        time.sleep(0.05)
+    return server, thread
+
+
+# ==========================================
+# 2. 壓測主迴圈（closed-loop：每個 worker 打完一個再打下一個）
+# ==========================================
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+async def run_load(
+    url: str,
+    total_requests: int,
+    concurrency: int,
+    repeat_ratio: float,
+    timeout: float,
+    mode: str = "full",
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    counter = {"next": 0}
+
+    def next_payload() -> Optional[Dict[str, Any]]:
+        n = counter["next"]
+        if n >= total_requests:
+            return None
+        counter["next"] = n + 1
+        # repeat_ratio 比例的請求重複用同一段文字（模擬快取命中）
+        suffix = 0 if random.random() < repeat_ratio else n
+        text = random.choice(SAMPLE_TEXTS).format(n=suffix)
+        return {"selected_text": text, "user_id": f"bench-{n % concurrency}", "mode": mode}
+
+    async def worker(session: aiohttp.ClientSession):
+        while True:
+            payload = next_payload()
+            if payload is None:
+                return
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=payload) as resp:
+                    await resp.read()
+                    key = str(resp.status)
+            except Exception as e:
+                key = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[key] = statuses.get(key, 0) + 1
+
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    started = time.perf_counter()
+    async with aiohttp.ClientSession(timeout=client_timeout, connector=connector) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    errors = sum(v for k, v in statuses.items() if k != "200")
+    return {
+        "requests": len(latencies),
+        "wall_seconds": round(wall, 3),
+        "rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "error_rate": round(errors / len(latencies), 4) if latencies else 0.0,
+        "statuses": statuses,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+            "p50": round(percentile(ordered, 50) * 1000, 2),
+            "p95": round(percentile(ordered, 95) * 1000, 2),
+            "p99": round(percentile(ordered, 99) * 1000, 2),
+            "max": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        },
+    }
+
+
+# ==========================================
+# 3. 結果存檔 & 比較
+# ==========================================
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def save_result(result: Dict[str, Any], path: Optional[str]) -> str:
+    if not path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def compare(current: Dict[str, Any], baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    print(f"\n📊 與基準比較：{baseline_path} (rev {baseline.get('revision')})")
+    rows = [("rps", baseline["summary"]["rps"], current["summary"]["rps"])]
+    rows.append(("error_rate", baseline["summary"]["error_rate"], current["summary"]["error_rate"]))
+    for key in ("p50", "p95", "p99"):
+        rows.append((
+            f"{key}_ms",
+            baseline["summary"]["latency_ms"][key],
+            current["summary"]["latency_ms"][key],
+        ))
+
+    for name, old, new in rows:
+        delta = ((new - old) / old * 100) if old else 0.0
+        print(f"  {name:<12} {old:>10} → {new:>10}  ({delta:+.1f}%)")
+
+
+# ==========================================
+# 4. CLI
+# ==========================================
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="LawPatrol end-to-end load test (fake backends)")
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--warmup-requests", type=int, default=10)
+    p.add_argument("--repeat-ratio", type=float, default=0.0, help="重複文字比例（0~1）")
+    p.add_argument("--timeout", type=float, default=60.0)
+    p.add_argument("--mode", choices=["fast", "standard", "full"], default="full", help="CheckRequest.mode")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--step1-ms", type=float, default=800)
+    p.add_argument("--step3-ms", type=float, default=1500)
+    p.add_argument("--embed-ms", type=float, default=30)
+    p.add_argument("--vector-ms", type=float, default=40)
+    p.add_argument("--db-ms", type=float, default=0)
+    p.add_argument("--sigma", type=float, default=0.35, help="對數常態分佈的 sigma")
+    p.add_argument("--error-rate", type=float, default=0.0, help="假後端丟例外的機率")
+    p.add_argument("--canned-step1", help="Step 1 固定回傳 JSON 檔")
+    p.add_argument("--canned-step3", help="Step 3 固定回傳 JSON 檔")
+    p.add_argument("--output", help="結果存檔路徑（預設 benchmarks/results/<時間>.json）")
+    p.add_argument("--compare", help="要比較的基準結果 JSON")
+    return p.parse_args(argv)
+
+
+def build_fake_config(args) -> FakeConfig:
+    def lat(ms: float) -> LatencyModel:
+        return LatencyModel(ms / 1000.0, args.sigma, args.error_rate)
+
+    config = FakeConfig(
+        step1_latency=lat(args.step1_ms),
+        step3_latency=lat(args.step3_ms),
+        embed_latency=lat(args.embed_ms),
+        vector_latency=lat(args.vector_ms),
+        db_latency=LatencyModel(args.db_ms / 1000.0, args.sigma) if args.db_ms else None,
+    )
+    if args.canned_step1:
+        with open(args.canned_step1, encoding="utf-8") as f:
+            config.step1 = json.load(f)
+    if args.canned_step3:
+        with open(args.canned_step3, encoding="utf-8") as f:
+            config.step3 = json.load(f)
+    return config
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    # 壓測時不需要每個 stage 一行 JSON log
+    logging.getLogger("lawpatrol").setLevel(logging.WARNING)
+
+    fixture = install_fakes(build_fake_config(args))
+    print(f"🧪 已安裝假後端：{fixture}")
+
+    server, thread = start_server(args.host, args.port)
+    url = f"http://{args.host}:{args.port}/api/check_compliance"
+
+    try:
+        if args.warmup_requests:
+            asyncio.run(run_load(url, args.warmup_requests, min(4, args.concurrency), 0.0, args.timeout))
+
+        print(f"🚀 開始壓測：{args.requests} requests, concurrency={args.concurrency}")
+        summary = asyncio.run(
+            run_load(url, args.requests, args.concurrency, args.repeat_ratio, args.timeout, args.mode)
+        )
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        try:
+            os.remove(fixture["sqlite_path"])
+        except OSError:
+            pass
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "summary": summary,
+    }
+    path = save_result(result, args.output)
+
+    lat = summary["latency_ms"]
+    print(
+        f"\n✅ 完成：{summary['requests']} requests in {summary['wall_seconds']}s | "
+        f"RPS={summary['rps']} | error_rate={summary['error_rate']} | "
+        f"p50={lat['p50']}ms p95={lat['p95']}ms p99={lat['p99']}ms"
+    )
+    print(f"💾 結果已存到 {path}")
+
+    if args.compare:
+        compare(result, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
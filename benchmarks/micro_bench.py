@@ -0,0 +1,260 @@
+# benchmarks/micro_bench.py
+# CPU 熱點的 micro benchmark（不碰網路）：
+# - utils.find_text_indices
+# - main.assemble_highlights（位置搜尋 + product_name/date 線性比對 + HighlightItem 建構）
+# - CheckResponse 的 JSON 編碼（v1）與 v2 精簡格式的組裝 + 編碼
+# - logic 的 Step 1 / Step 3 prompt 組裝
+# - sync_data 的 row → metadata 轉換
+#
+# 參數：文字長度 × trigger word 數 × 每個 tag 的案例數
+#   python -m benchmarks.micro_bench
+#   python -m benchmarks.micro_bench --lengths 1000,10000,50000 --triggers 5,20 --cases 2,20
+#   python -m benchmarks.micro_bench --only assemble --output /tmp/micro.json
+
+import sys
+import json
+import time
+import random
+import timeit
+import logging
+import argparse
+import statistics
+from typing import Any, Callable, Dict, List
+
+from database import TAG_MAPPING
+from cache import get_cache
+
+TAGS = list(TAG_MAPPING.keys())
+FILLER = "本產品選用天然原料，每日一份，幫助維持健康體態與良好生活品質。"
+TRIGGER_POOL = [
+    "甩油", "保證", "降血壓", "根治", "第一", "永久", "奇蹟", "立即見效", "醫師推薦",
+    "抗老", "排毒", "豐胸", "長高", "助眠", "提升免疫", "消炎", "抗癌", "臨床證實",
+]
+
+
+# ==========================================
+# 1. 假資料
+# ==========================================
+def make_text(length: int, triggers: List[str], seed: int = 0) -> str:
+    """產生指定長度的文案，trigger word 平均撒在文字裡。"""
+    rng = random.Random(seed)
+    parts: List[str] = []
+    size = 0
+    while size < length:
+        chunk = FILLER if rng.random() > 0.3 else rng.choice(triggers)
+        parts.append(chunk)
+        size += len(chunk)
+    return "".join(parts)[:length]
+
+
+def make_triggers(n: int) -> List[str]:
+    words = list(TRIGGER_POOL)
+    i = 0
+    while len(words) < n:
+        words.append(f"{TRIGGER_POOL[i % len(TRIGGER_POOL)]}{i}")
+        i += 1
+    return words[:n]
+
+
+def make_pipeline_output(triggers: List[str], cases_per_tag: int) -> Dict[str, Any]:
+    analysis_results = []
+    vector_search_results = []
+    for i, word in enumerate(triggers):
+        tag = TAGS[i % len(TAGS)]
+        cases = [
+            {
+                "case_id": f"{i}-{j}",
+                "product_name": f"產品{i}-{j}",
+                "explanation": "違規情節說明。" * 20,
+                "law": "食品安全衛生管理法第28條",
+                "date": f"2024-{(j % 12) + 1:02d}",
+                "link": f"https://example.com/{i}/{j}",
+                "similarity_score": 0.8,
+            }
+            for j in range(cases_per_tag)
+        ]
+        vector_search_results.append({"tag": tag, "cases": cases})
+        # 引用最後兩筆 → 線性比對的最差情況
+        refs = [{"product_name": c["product_name"], "date": c["date"]} for c in cases[-2:]]
+        analysis_results.append({
+            "trigger_word": word,
+            "tag": tag,
+            "reason": "此用語涉及誇大或醫療效能宣稱，可能違反相關法規。" * 2,
+            "law": "食品安全衛生管理法第28條",
+            "reference_cases": refs,
+        })
+    return {
+        "step1_output": {
+            "industry": "Food",
+            "identified_tags": [
+                {"tag": a["tag"], "trigger_words": [a["trigger_word"]]} for a in analysis_results
+            ],
+        },
+        "vector_search_results": vector_search_results,
+        "final_analysis": {"analysis_results": analysis_results, "suggestion": FILLER},
+    }
+
+
+def make_row(tag_count: int) -> Dict[str, Any]:
+    from sync_postgres_pinecone import SQL_TO_TAG_MAP
+
+    row = {col: 0 for col in SQL_TO_TAG_MAP}
+    for col in list(SQL_TO_TAG_MAP)[:tag_count]:
+        row[col] = 1
+    row.update({
+        "id": 1,
+        "product_name": "示範產品",
+        "case_explanation": "違規情節說明。" * 40,
+        "violation_law": "食品安全衛生管理法第28條",
+        "case_date": "2024-01-01",
+        "source_link": "https://example.com/1",
+        "industry": "食物",
+        "violation_type": "誇大不實",
+    })
+    return row
+
+
+# ==========================================
+# 2. 量測
+# ==========================================
+def measure(func: Callable[[], Any], repeat: int = 5) -> Dict[str, float]:
+    """自動決定每輪次數（每輪至少 0.2 秒），回傳每次呼叫的 median / min（微秒）。"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    runs = timer.repeat(repeat=repeat, number=number)
+    per_call = [r / number * 1e6 for r in runs]
+    return {
+        "median_us": round(statistics.median(per_call), 2),
+        "min_us": round(min(per_call), 2),
+        "loops": number,
+    }
+
+
+def install_risk_snapshot() -> None:
+    """assemble_highlights 會查 tag 風險；先放一份快照進快取，避免碰 DB。"""
+    snapshot = {"total": 1000, "counts": {col: 50 for col in TAG_MAPPING.values()}}
+    get_cache().set("risk", "snapshot", snapshot)
+
+
+def bench_cases(lengths, trigger_counts, case_counts, only) -> List[Dict[str, Any]]:
+    import main
+    from utils import find_text_indices
+    from schemas import CheckResponse, ComplianceData
+    from prompts import STEP1_PROMPT_TEMPLATE, STEP3_PROMPT_TEMPLATE, get_formatted_tags_prompt
+    from sync_postgres_pinecone import build_tags_list, build_case_metadata
+    from response_encoding import dumps
+
+    install_risk_snapshot()
+    results: List[Dict[str, Any]] = []
+
+    def record(name: str, params: Dict[str, Any], func: Callable[[], Any]) -> None:
+        if only and name not in only:
+            return
+        stats = measure(func)
+        results.append({"bench": name, **params, **stats})
+        shown = " ".join(f"{k}={v}" for k, v in params.items())
+        print(f"  {name:<18} {shown:<40} median={stats['median_us']:>12.2f}µs")
+
+    for length in lengths:
+        for n_triggers in trigger_counts:
+            triggers = make_triggers(n_triggers)
+            text = make_text(length, triggers)
+
+            record(
+                "find_text_indices",
+                {"length": length, "triggers": n_triggers},
+                lambda: [find_text_indices(text, w) for w in triggers],
+            )
+
+            for n_cases in case_counts:
+                output = make_pipeline_output(triggers, n_cases)
+                params = {"length": length, "triggers": n_triggers, "cases": n_cases}
+                tag_to_cases = main.build_tag_to_cases(output["vector_search_results"])
+                analysis = output["final_analysis"]["analysis_results"]
+
+                record(
+                    "assemble",
+                    params,
+                    lambda: main.assemble_highlights(text, analysis, tag_to_cases),
+                )
+
+                highlights = main.assemble_highlights(text, analysis, tag_to_cases)
+                response = CheckResponse(
+                    status="success",
+                    data=ComplianceData(
+                        category="Food", risk=0.5, highlights=highlights, suggestion=FILLER
+                    ),
+                )
+                params = dict(params, highlights=len(highlights))
+                record("json_encode", params, lambda: response.model_dump_json())
+
+                groups = main.collect_highlight_groups(text, analysis, tag_to_cases)
+                record(
+                    "json_encode_v2",
+                    params,
+                    lambda: dumps(main.compact_from_groups(groups)),
+                )
+
+                step1_str = json.dumps(output["step1_output"], ensure_ascii=False)
+                record(
+                    "step3_prompt",
+                    params,
+                    lambda: STEP3_PROMPT_TEMPLATE.format(
+                        user_text=text,
+                        step1_result=step1_str,
+                        vector_results=json.dumps(output["vector_search_results"], ensure_ascii=False),
+                    ),
+                )
+
+        record(
+            "step1_prompt",
+            {"length": length},
+            lambda: STEP1_PROMPT_TEMPLATE.format(
+                tags_context_str=get_formatted_tags_prompt(), user_text=text
+            ),
+        )
+
+    for tag_count in (1, 5, len(TAG_MAPPING)):
+        row = make_row(tag_count)
+        record(
+            "sync_row_metadata",
+            {"tags": tag_count},
+            lambda: build_case_metadata(row, build_tags_list(row)),
+        )
+
+    return results
+
+
+# ==========================================
+# 3. CLI
+# ==========================================
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="LawPatrol CPU hot-path micro benchmarks")
+    p.add_argument("--lengths", type=_int_list, default=[1000, 10000, 50000])
+    p.add_argument("--triggers", type=_int_list, default=[5, 20, 50])
+    p.add_argument("--cases", type=_int_list, default=[2, 20])
+    p.add_argument("--only", default="", help="只跑這些 bench（逗號分隔）")
+    p.add_argument("--output", help="結果存成 JSON")
+    args = p.parse_args(argv)
+
+    logging.getLogger("lawpatrol").setLevel(logging.WARNING)
+    only = {name for name in args.only.split(",") if name}
+
+    print("⏱️ micro benchmark 開始")
+    started = time.perf_counter()
+    results = bench_cases(args.lengths, args.triggers, args.cases, only)
+    print(f"✅ 完成，共 {len(results)} 組，耗時 {time.perf_counter() - started:.1f}s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 結果已存到 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
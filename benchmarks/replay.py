@@ -0,0 +1,292 @@
+# benchmarks/replay.py
+# 重播錄下來的線上流量（capture.py 產生的 JSONL），比較不同 pipeline 變體：
+# 延遲分佈，以及輸出跟錄製當下（baseline）差多少 —— tag 集合、紅線位置、引用案例。
+#
+# 變體用「模組屬性覆寫」描述，格式 name:module.ATTR=value,module.ATTR=value：
+#   python -m benchmarks.replay /tmp/capture.jsonl \
+#       --variant "baseline:" \
+#       --variant "lite:logic.MODEL_NAME='gemini-2.5-flash-lite'" \
+#       --variant "classifier:logic.STEP1_CLASSIFIER_ENABLED=True" \
+#       --variant "top3:database.VECTOR_TOP_K=3"
+#
+# 加 --fake 就用 benchmarks.fakes 的替身跑（只驗證延遲 / 流程，輸出比對沒意義）。
+# 每個變體開跑前會清掉所有資料快取（retrieval / risk 等）與 step1 / embedding / knowledge 快取，
+# 並關掉語意快取，避免前一個變體的結果被直接拿來用（例如 top3 拿到 top2 的檢索結果）。
+
+import os
+import sys
+import ast
+import json
+import time
+import asyncio
+import logging
+import argparse
+import importlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from benchmarks.load_test import git_revision, percentile, save_result
+
+# model 換掉之後要讓 get_model() 重新建一次
+_RESET_AFTER_PATCH = {
+    ("logic", "MODEL_NAME"): {"_model": None, "_model_tried": False},
+}
+
+# 不在 DATA_NAMESPACES 裡、但結果會隨變體不同的快取
+_VARIANT_NAMESPACES = ("step1", "embedding", "knowledge")
+
+
+# ==========================================
+# 1. 讀錄製檔 / 解析變體
+# ==========================================
+def load_capture(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"⚠️ 略過壞掉的一行：{line[:60]}")
+            if limit and len(records) >= limit:
+                break
+    return records
+
+
+def parse_variant(spec: str) -> Tuple[str, Dict[str, Any]]:
+    name, _, body = spec.partition(":")
+    overrides: Dict[str, Any] = {}
+    for part in body.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        target, _, raw = part.partition("=")
+        if "." not in target or not raw:
+            raise ValueError(f"變體格式錯誤：{part}（要 module.ATTR=value）")
+        try:
+            value = ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            value = raw  # 沒加引號的字串
+        overrides[target.strip()] = value
+    return name.strip() or "baseline", overrides
+
+
+def apply_overrides(overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """套用覆寫，回傳原值（給 restore_overrides 用）。"""
+    saved: Dict[str, Any] = {}
+    for target, value in overrides.items():
+        module_name, attr = target.rsplit(".", 1)
+        module = importlib.import_module(module_name)
+        if not hasattr(module, attr):
+            raise AttributeError(f"{module_name} 沒有 {attr}")
+        saved[target] = getattr(module, attr)
+        setattr(module, attr, value)
+        for reset_attr, reset_value in _RESET_AFTER_PATCH.get((module_name, attr), {}).items():
+            saved.setdefault(f"{module_name}.{reset_attr}", getattr(module, reset_attr))
+            setattr(module, reset_attr, reset_value)
+    return saved
+
+
+def restore_overrides(saved: Dict[str, Any]) -> None:
+    for target, value in saved.items():
+        module_name, attr = target.rsplit(".", 1)
+        setattr(importlib.import_module(module_name), attr, value)
+
+
+# ==========================================
+# 2. 輸出比對
+# ==========================================
+def jaccard(a: Set[Any], b: Set[Any]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def tag_set(output: Dict[str, Any]) -> Set[str]:
+    return {t.get("tag") for t in output.get("step1_output", {}).get("identified_tags", []) or []}
+
+
+def span_positions(text: str, output: Dict[str, Any]) -> Set[int]:
+    """所有 trigger word 在原文覆蓋到的字元位置（前端紅線的範圍）。"""
+    from utils import find_text_indices
+
+    positions: Set[int] = set()
+    for item in output.get("step1_output", {}).get("identified_tags", []) or []:
+        for word in item.get("trigger_words", []) or []:
+            for idx in find_text_indices(text, word):
+                positions.update(range(idx["start"], idx["end"]))
+    return positions
+
+
+def case_ids(output: Dict[str, Any]) -> Set[str]:
+    return {str(cid) for ids in (output.get("cases") or {}).values() for cid in ids}
+
+
+def compare_outputs(text: str, baseline: Dict[str, Any], candidate: Dict[str, Any]) -> Dict[str, float]:
+    base_tags, cand_tags = tag_set(baseline), tag_set(candidate)
+    return {
+        "tag_exact": float(base_tags == cand_tags),
+        "tag_jaccard": jaccard(base_tags, cand_tags),
+        "span_jaccard": jaccard(span_positions(text, baseline), span_positions(text, candidate)),
+        "case_jaccard": jaccard(case_ids(baseline), case_ids(candidate)),
+    }
+
+
+# ==========================================
+# 3. 重播
+# ==========================================
+async def replay_records(records: List[Dict[str, Any]], concurrency: int, timeout: float) -> List[Dict[str, Any]]:
+    from capture import summarize_output
+    from chunking import chunked_compliance_check
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(record: Dict[str, Any]) -> Dict[str, Any]:
+        async with sem:
+            started = time.perf_counter()
+            try:
+                result = await chunked_compliance_check(record["text"], deadline=time.monotonic() + timeout)
+                output, error = summarize_output(result), None
+            except Exception as e:
+                output, error = None, type(e).__name__
+            return {"latency": time.perf_counter() - started, "output": output, "error": error}
+
+    return await asyncio.gather(*(one(r) for r in records))
+
+
+def run_variant(
+    name: str,
+    overrides: Dict[str, Any],
+    records: List[Dict[str, Any]],
+    concurrency: int,
+    timeout: float,
+    keep_caches: bool,
+) -> Dict[str, Any]:
+    import semantic_cache
+    from cache import get_cache, invalidate_data_caches
+
+    saved = apply_overrides(overrides)
+    if not keep_caches:
+        saved.setdefault("semantic_cache.SEMANTIC_CACHE_ENABLED", semantic_cache.SEMANTIC_CACHE_ENABLED)
+        semantic_cache.SEMANTIC_CACHE_ENABLED = False
+        invalidate_data_caches()
+        for namespace in _VARIANT_NAMESPACES:
+            get_cache().invalidate(namespace)
+
+    print(f"▶️ 變體 {name}：{overrides or '（不改）'}")
+    started = time.perf_counter()
+    try:
+        runs = asyncio.run(replay_records(records, concurrency, timeout))
+    finally:
+        restore_overrides(saved)
+    wall = time.perf_counter() - started
+
+    latencies = sorted(r["latency"] * 1000 for r in runs if r["error"] is None)
+    scores: Dict[str, List[float]] = {}
+    partial = 0
+    for record, run in zip(records, runs):
+        if run["output"] is None:
+            continue
+        partial += int(run["output"]["partial"])
+        for metric, value in compare_outputs(record["text"], record["output"], run["output"]).items():
+            scores.setdefault(metric, []).append(value)
+
+    errors = sum(1 for r in runs if r["error"] is not None)
+    return {
+        "overrides": {k: repr(v) for k, v in overrides.items()},
+        "requests": len(runs),
+        "errors": errors,
+        "partial": partial,
+        "wall_seconds": round(wall, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 1),
+            "p95": round(percentile(latencies, 95), 1),
+            "p99": round(percentile(latencies, 99), 1),
+            "max": round(latencies[-1], 1) if latencies else 0.0,
+        },
+        "agreement": {k: round(sum(v) / len(v), 4) for k, v in scores.items()},
+    }
+
+
+def recorded_latency(records: List[Dict[str, Any]]) -> Dict[str, float]:
+    values = sorted(r.get("latency_ms", 0.0) for r in records)
+    return {
+        "p50": round(percentile(values, 50), 1),
+        "p95": round(percentile(values, 95), 1),
+        "p99": round(percentile(values, 99), 1),
+    }
+
+
+# ==========================================
+# 4. CLI
+# ==========================================
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Replay captured traffic against pipeline variants")
+    p.add_argument("capture", help="capture.py 錄下來的 JSONL")
+    p.add_argument("--variant", action="append", default=[], help="name:module.ATTR=value,...（可多個）")
+    p.add_argument("--limit", type=int, help="只重播前 N 筆")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--timeout", type=float, default=30.0, help="每筆的 deadline（秒）")
+    p.add_argument("--keep-caches", action="store_true", help="變體之間不清快取、不關語意快取")
+    p.add_argument("--fake", action="store_true", help="用 benchmarks.fakes 的假後端")
+    p.add_argument("--output", help="結果存檔路徑（預設 benchmarks/results/<時間>.json）")
+    return p.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.getLogger("lawpatrol").setLevel(logging.WARNING)
+
+    records = [r for r in load_capture(args.capture, args.limit) if r.get("text") and r.get("output")]
+    if not records:
+        print("❌ 錄製檔裡沒有可重播的紀錄")
+        return 1
+
+    fixture = None
+    if args.fake:
+        from benchmarks.fakes import FakeConfig, install_fakes
+
+        fixture = install_fakes(FakeConfig())
+        print(f"🧪 已安裝假後端：{fixture}")
+        # 假 model 是直接塞進去的，重設之後 get_model() 會去建真的
+        _RESET_AFTER_PATCH.clear()
+
+    variants = [parse_variant(spec) for spec in (args.variant or ["baseline:"])]
+    results: Dict[str, Any] = {}
+    try:
+        for name, overrides in variants:
+            results[name] = run_variant(
+                name, overrides, records, args.concurrency, args.timeout, args.keep_caches
+            )
+    finally:
+        if fixture:
+            try:
+                os.remove(fixture["sqlite_path"])
+            except OSError:
+                pass
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "capture": args.capture,
+        "records": len(records),
+        "recorded_latency_ms": recorded_latency(records),
+        "variants": results,
+    }
+    path = save_result(result, args.output)
+
+    print(f"\n📼 錄製當下：{result['recorded_latency_ms']}")
+    for name, summary in results.items():
+        lat, agree = summary["latency_ms"], summary["agreement"]
+        print(
+            f"  {name:<16} p50={lat['p50']}ms p95={lat['p95']}ms p99={lat['p99']}ms "
+            f"errors={summary['errors']} | "
+            + " ".join(f"{k}={v}" for k, v in agree.items())
+        )
+    print(f"💾 結果已存到 {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
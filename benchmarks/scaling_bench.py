@@ -0,0 +1,205 @@
+# benchmarks/scaling_bench.py
+# 資料量 scaling benchmark：用 synthetic_cases 在本機 Postgres 依序灌 1 萬 / 10 萬 / 100 萬筆，
+# 每個規模量一次會隨資料量變慢的 DB 路徑（不碰 Gemini / Pinecone）：
+#
+#   risk_snapshot          database.load_risk_snapshot（全表 COUNT FILTER）
+#   auto_tag_first_page    auto_tag_cases.fetch_unlabeled_batch 第一頁（31 個 tag 欄位 = 0 的掃描）
+#   auto_tag_deep_page     同上，從 90% 的 id 之後開始翻（id 翻頁到後面的成本）
+#   sync_query_full        sync_data 的全量查詢（LIMIT 242）
+#   sync_query_ids         sync_data 的增量查詢（--sync-ids 筆隨機 id）
+#   sync_embedding_reuse   case_embeddings.embed_cases 全部命中時的查表成本（要 --embeddings）
+#   case_store_rebuild     rebuild_case_store：有 Tag 的案件整表 fetchall + 寫 JSON
+#
+# 每一項另外記下 EXPLAIN 的最上層 node 與估計成本，方便看到哪個規模開始換執行計畫。
+#
+# 用法（DB_* 指向本機測試用資料庫；會重建 public.violation_cases，見 synthetic_cases.py）：
+#   python -m benchmarks.scaling_bench
+#   python -m benchmarks.scaling_bench --rows 10000,100000,1000000 --embeddings --output /tmp/scaling.json
+#   python -m benchmarks.scaling_bench --skip-generate --only risk_snapshot,auto_tag_first_page
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import statistics
+from typing import Any, Callable, Dict, List, Optional
+
+# 本機 Postgres 通常沒開 SSL；case store 也不要蓋到 API 在用的那份
+os.environ.setdefault("DB_SSLMODE", "prefer")
+os.environ.setdefault("CASE_STORE_PATH", os.path.join(tempfile.gettempdir(), "lawpatrol_scaling_case_store.json"))
+
+from cache import invalidate_data_caches
+from benchmarks.synthetic_cases import add_config_arguments, build_fixture, config_from_args, connect
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+# ==========================================
+# 1. 量測
+# ==========================================
+def measure(func: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """DB 查詢一次就是幾十毫秒到幾秒，不用 timeit 自動調次數；第一次當暖機不計。"""
+    func()
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        runs.append((time.perf_counter() - started) * 1000)
+    return {
+        "median_ms": round(statistics.median(runs), 2),
+        "min_ms": round(min(runs), 2),
+        "max_ms": round(max(runs), 2),
+        "repeat": repeat,
+    }
+
+
+def explain(conn, sql: str, params=None) -> Dict[str, Any]:
+    with conn.cursor() as cur:
+        cur.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cur.fetchone()[0][0]["Plan"]
+    conn.rollback()
+    nodes = []
+    node: Optional[Dict[str, Any]] = plan
+    while node is not None and len(nodes) < 4:
+        nodes.append(node["Node Type"])
+        children = node.get("Plans") or []
+        node = children[0] if children else None
+    return {"plan": " > ".join(nodes), "cost": plan.get("Total Cost")}
+
+
+# ==========================================
+# 2. 各條路徑
+# ==========================================
+def bench_size(conn, rows: int, repeat: int, sync_ids: int, only: set, embeddings: bool) -> List[Dict[str, Any]]:
+    import database
+    import case_embeddings
+    from sync_postgres_pinecone import build_sync_query, has_tag_sql, rebuild_case_store
+
+    results: List[Dict[str, Any]] = []
+
+    def record(name: str, func: Callable[[], Any], sql: Optional[str] = None, params=None, **extra) -> None:
+        if only and name not in only:
+            return
+        stats = measure(func, repeat)
+        if sql is not None:
+            stats.update(explain(conn, sql, params))
+        results.append({"bench": name, "rows": rows, **extra, **stats})
+        print(f"  {name:<22} rows={rows:<9} median={stats['median_ms']:>10.2f}ms  {stats.get('plan', '')}")
+
+    # --- 風險快照 ---
+    columns = list(database.TAG_MAPPING.values())
+    risk_sql = "SELECT COUNT(*) AS total, " + ", ".join(
+        f"COUNT(*) FILTER (WHERE {col} = 1) AS {col}" for col in columns
+    ) + " FROM public.violation_cases"
+    record("risk_snapshot", database.load_risk_snapshot, risk_sql)
+
+    # --- auto_tag 未標註掃描 ---
+    try:
+        from auto_tag_cases import BATCH_SIZE, UNLABELED_WHERE, fetch_unlabeled_batch
+    except ImportError as e:
+        print(f"  ⚠️ 略過 auto_tag（{e}）")
+    else:
+        scan_sql = f"""
+            SELECT id, product_name, case_explaination FROM violation_cases
+            WHERE {UNLABELED_WHERE} AND id > %s ORDER BY id LIMIT {BATCH_SIZE}
+        """
+        deep_id = int(rows * 0.9)
+        record("auto_tag_first_page", lambda: fetch_unlabeled_batch(conn, 0, BATCH_SIZE), scan_sql, (0,))
+        record(
+            "auto_tag_deep_page",
+            lambda: fetch_unlabeled_batch(conn, deep_id, BATCH_SIZE),
+            scan_sql,
+            (deep_id,),
+        )
+
+    # --- sync 查詢 ---
+    def run_query(sql: str, params=None) -> int:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return len(cur.fetchall())
+
+    full_sql = build_sync_query(None)
+    record("sync_query_full", lambda: run_query(full_sql), full_sql)
+
+    sample = sorted(random.Random(0).sample(range(1, rows + 1), min(sync_ids, rows)))
+    ids_sql = build_sync_query(sample)
+    record("sync_query_ids", lambda: run_query(ids_sql, (sample,)), ids_sql, (sample,), ids=len(sample))
+
+    # --- 向量重用（case_embeddings 有資料時）---
+    if embeddings:
+        with conn.cursor() as cur:
+            cur.execute(ids_sql, (sample,))
+            cases = [(str(r[0]), r[2]) for r in cur.fetchall()]
+
+        def no_genai():
+            raise RuntimeError("synthetic fixture 應該全部命中 case_embeddings")
+
+        record(
+            "sync_embedding_reuse",
+            lambda: case_embeddings.embed_cases(conn, no_genai, cases, database.EMBEDDING_MODEL),
+            ids=len(cases),
+        )
+
+    # --- case store 整表重建 ---
+    store_sql = f"SELECT id FROM public.violation_cases v WHERE ({has_tag_sql()})"
+    record("case_store_rebuild", lambda: rebuild_case_store(conn), store_sql)
+    if results and results[-1]["bench"] == "case_store_rebuild":
+        results[-1]["file_bytes"] = os.path.getsize(os.environ["CASE_STORE_PATH"])
+
+    return results
+
+
+# ==========================================
+# 3. CLI
+# ==========================================
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="LawPatrol DB scaling benchmarks on synthetic violation_cases")
+    p.add_argument("--rows", type=_int_list, default=[10000, 100000, 1000000])
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--sync-ids", type=int, default=1000, help="增量 sync 查詢一次帶幾個 id")
+    p.add_argument("--skip-generate", action="store_true", help="直接量現有的資料表（只看 --rows 的第一個值當標籤）")
+    p.add_argument("--only", default="", help="只跑這些 bench（逗號分隔）")
+    p.add_argument("--output", help="結果存成 JSON")
+    add_config_arguments(p)
+    args = p.parse_args(argv)
+
+    logging.getLogger("lawpatrol").setLevel(logging.WARNING)
+    only = {name for name in args.only.split(",") if name}
+    sizes = args.rows[:1] if args.skip_generate else args.rows
+
+    conn = connect(args.allow_remote)
+    results: List[Dict[str, Any]] = []
+    started = time.perf_counter()
+    try:
+        for rows in sizes:
+            if args.skip_generate:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT COUNT(*) FROM public.violation_cases")
+                    rows = cur.fetchone()[0]
+                print(f"\n📏 現有資料表：{rows} 筆")
+            else:
+                print(f"\n📏 產生 {rows} 筆...")
+                fixture = build_fixture(conn, config_from_args(args, rows), progress=False)
+                print(f"  🧪 fixture：{fixture}")
+            # 風險快照在共用快取裡，換規模後要重算
+            invalidate_data_caches()
+            results.extend(bench_size(conn, rows, args.repeat, args.sync_ids, only, args.embeddings))
+    finally:
+        conn.close()
+
+    print(f"\n✅ 完成，共 {len(results)} 組，耗時 {time.perf_counter() - started:.1f}s")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, default=str)
+        print(f"💾 結果已存到 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+# benchmarks/synthetic_cases.py
+# 在本機 Postgres 灌一份大型、分佈接近真實的假 violation_cases（給 scaling_bench 用）。
+#
+# 正式資料只有幾百筆，風險快照的 COUNT、auto_tag 的「31 個 tag 欄位都 = 0」掃描、
+# sync_data / case store 的整表 fetchall 到 100 萬筆時會長什麼樣子，現在測不到。
+#
+# 可調：
+# - 筆數、尚未標 Tag 的比例（auto_tag 的待處理量）
+# - 每筆幾個 tag（幾何分佈的平均）、tag 熱門程度（Zipf skew）、同大類 tag 一起出現的機率
+# - 產業比例、explanation 長度（對數常態）
+# - --embeddings：同時寫 case_embeddings 假向量（同 tag 的案件向量相近），
+#   model / content_hash 跟 sync_data 算的一樣，sync 會直接重用，不會打 Gemini
+#
+# 用法（在 repo 根目錄，DB_* 環境變數指向本機測試用資料庫）：
+#   python -m benchmarks.synthetic_cases --rows 1000000
+#   python -m benchmarks.synthetic_cases --rows 100000 --unlabeled-ratio 0.5 --mean-tags 2.5 --embeddings
+#
+# ⚠️ 會 DROP 後重建 public.violation_cases。只有資料表不存在、或是之前由本工具產生的
+# （有 synthetic_fixture 紀錄）才會動手；DB_HOST 不是本機時拒絕執行（--allow-remote 可略過）。
+
+import io
+import os
+import csv
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import datetime
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import psycopg2
+from dotenv import load_dotenv
+
+from case_embeddings import content_hash
+from database import EMBEDDING_MODEL, TAG_MAPPING
+from pgvector_store import EMBEDDING_DIM
+from prompts import TAG_CATEGORIES
+
+load_dotenv()
+
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1", ""}
+
+DEFAULT_INDUSTRIES = {"食物": 0.55, "化妝品": 0.25, "藥品": 0.1, "醫療器材": 0.1}
+INDUSTRY_LAWS = {
+    "食物": "食品安全衛生管理法第28條",
+    "化妝品": "化粧品衛生安全管理法第10條",
+    "藥品": "藥事法第69條",
+    "醫療器材": "醫療器材管理法第6條",
+}
+VIOLATION_TYPES = ["誇大不實", "涉及醫療效能", "易生誤解", None]
+
+PRODUCT_PREFIXES = ["極致", "天然", "御品", "纖活", "美研", "康健", "晶亮", "漢方", "益生", "植萃"]
+PRODUCT_NOUNS = ["膠囊", "錠", "飲", "精華液", "乳霜", "粉包", "茶包", "貼布", "噴霧", "凍"]
+FILLER_SENTENCES = [
+    "業者於網路購物平台刊登廣告。",
+    "經民眾檢舉後由衛生局查處。",
+    "廣告內容與核准事項不符。",
+    "業者表示係委託廣告商製作。",
+    "該廣告於社群媒體持續刊播。",
+    "已依法處以罰鍰並限期改正。",
+]
+
+START_DATE = datetime.date(2015, 1, 1)
+DATE_SPAN_DAYS = (datetime.date(2025, 12, 31) - START_DATE).days
+
+TAG_COLUMNS = list(TAG_MAPPING.values())
+COLUMN_TO_TAG = {col: tag for tag, col in TAG_MAPPING.items()}
+
+
+@dataclass
+class SyntheticConfig:
+    rows: int = 100000
+    seed: int = 0
+    unlabeled_ratio: float = 0.2
+    mean_tags: float = 1.8
+    tag_skew: float = 1.1
+    co_occur: float = 0.6
+    industries: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_INDUSTRIES))
+    explain_median: int = 180
+    explain_sigma: float = 0.6
+    embeddings: bool = False
+    embedding_dim: int = EMBEDDING_DIM
+    embedding_noise: float = 0.35
+    batch_size: int = 20000
+
+
+# ==========================================
+# 1. 產生資料（純 CPU，不碰 DB）
+# ==========================================
+class CaseGenerator:
+    def __init__(self, config: SyntheticConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+
+        # tag 熱門程度：隨機排名後套 Zipf
+        ranked = list(TAG_COLUMNS)
+        random.Random(config.seed + 1).shuffle(ranked)
+        self.tag_weights = {col: 1.0 / (rank + 1) ** config.tag_skew for rank, col in enumerate(ranked)}
+
+        # 同一大類的 tag（TAG_CATEGORIES）比較常一起出現
+        self.category_of: Dict[str, List[str]] = {}
+        for tags in TAG_CATEGORIES.values():
+            columns = [TAG_MAPPING[t] for t in tags if t in TAG_MAPPING]
+            for col in columns:
+                self.category_of[col] = columns
+
+        self.industries = list(config.industries)
+        self.industry_weights = [config.industries[i] for i in self.industries]
+        self._centroids: Dict[str, List[float]] = {}
+
+    def _pick_tag(self, candidates: List[str], exclude: set) -> Optional[str]:
+        pool = [c for c in candidates if c not in exclude]
+        if not pool:
+            return None
+        return self.rng.choices(pool, weights=[self.tag_weights[c] for c in pool])[0]
+
+    def pick_tags(self) -> List[str]:
+        if self.rng.random() < self.config.unlabeled_ratio:
+            return []
+        # 幾何分佈，平均 mean_tags 個（至少 1 個）
+        p = 1.0 / max(self.config.mean_tags, 1.0)
+        count = 1
+        while self.rng.random() > p and count < len(TAG_COLUMNS):
+            count += 1
+
+        chosen: List[str] = [self._pick_tag(TAG_COLUMNS, set())]
+        while len(chosen) < count:
+            same_category = self.category_of.get(chosen[0], TAG_COLUMNS)
+            candidates = same_category if self.rng.random() < self.config.co_occur else TAG_COLUMNS
+            tag = self._pick_tag(candidates, set(chosen)) or self._pick_tag(TAG_COLUMNS, set(chosen))
+            if tag is None:
+                break
+            chosen.append(tag)
+        return chosen
+
+    def explanation(self, product_name: str, tags: List[str]) -> str:
+        target = int(self.rng.lognormvariate(math.log(self.config.explain_median), self.config.explain_sigma))
+        target = min(max(target, 20), 5000)
+        parts = [f"{product_name}廣告"]
+        for col in tags:
+            parts.append(f"宣稱「{COLUMN_TO_TAG[col]}」相關效果，")
+        size = sum(len(p) for p in parts)
+        while size < target:
+            sentence = self.rng.choice(FILLER_SENTENCES)
+            parts.append(sentence)
+            size += len(sentence)
+        return "".join(parts)[:target]
+
+    def row(self, case_id: int) -> Dict[str, Any]:
+        tags = self.pick_tags()
+        industry = self.rng.choices(self.industries, weights=self.industry_weights)[0]
+        product_name = f"{self.rng.choice(PRODUCT_PREFIXES)}{self.rng.choice(PRODUCT_NOUNS)}{case_id}"
+        row: Dict[str, Any] = {col: 0 for col in TAG_COLUMNS}
+        for col in tags:
+            row[col] = 1
+        row.update({
+            "id": case_id,
+            "product_name": product_name,
+            "case_explaination": self.explanation(product_name, tags),
+            "violation_law": INDUSTRY_LAWS.get(industry, ""),
+            "case_date": START_DATE + datetime.timedelta(days=self.rng.randrange(DATE_SPAN_DAYS)),
+            "source_link": f"https://example.com/cases/{case_id}",
+            "industry": industry,
+            "violation_type": self.rng.choice(VIOLATION_TYPES) if tags else None,
+        })
+        return row
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        for case_id in range(1, self.config.rows + 1):
+            yield self.row(case_id)
+
+    # ---------- 假向量 ----------
+    def _centroid(self, key: str) -> List[float]:
+        if key not in self._centroids:
+            rng = random.Random(f"{self.config.seed}:{key}")
+            self._centroids[key] = [rng.gauss(0.0, 1.0) for _ in range(self.config.embedding_dim)]
+        return self._centroids[key]
+
+    def embedding(self, row: Dict[str, Any]) -> List[float]:
+        """同 tag / 同產業的案件彼此相近，相似度搜尋才有意義。"""
+        dim = self.config.embedding_dim
+        keys = [col for col in TAG_COLUMNS if row[col] == 1] + [f"industry:{row['industry']}"]
+        vector = [0.0] * dim
+        for key in keys:
+            centroid = self._centroid(key)
+            for i in range(dim):
+                vector[i] += centroid[i]
+        noise = self.config.embedding_noise * math.sqrt(len(keys))
+        vector = [v + self.rng.gauss(0.0, noise) for v in vector]
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [round(v / norm, 6) for v in vector]
+
+
+# ==========================================
+# 2. 寫進 Postgres（COPY）
+# ==========================================
+VIOLATION_CASES_DDL = f"""
+    CREATE TABLE public.violation_cases (
+        id                 BIGINT PRIMARY KEY,
+        product_name       TEXT,
+        case_explaination  TEXT,
+        violation_law      TEXT,
+        case_date          DATE,
+        source_link        TEXT,
+        industry           TEXT,
+        violation_type     TEXT,
+        {", ".join(f"{col} SMALLINT NOT NULL DEFAULT 0" for col in TAG_COLUMNS)}
+    );
+"""
+
+FIXTURE_MARKER_DDL = """
+    CREATE TABLE IF NOT EXISTS public.synthetic_fixture (
+        built_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+        config    JSONB NOT NULL,
+        seconds   REAL NOT NULL
+    );
+"""
+
+CASE_FIELDS = [
+    "id", "product_name", "case_explaination", "violation_law", "case_date",
+    "source_link", "industry", "violation_type",
+] + TAG_COLUMNS
+
+
+def connect(allow_remote: bool = False):
+    """跟 sync_postgres_pinecone 一樣讀 DB_* 環境變數，但預設只接受本機。"""
+    host = os.getenv("DB_HOST", "localhost")
+    if host not in LOCAL_HOSTS and not allow_remote:
+        raise SystemExit(f"❌ DB_HOST={host} 不是本機，拒絕灌假資料（確定的話加 --allow-remote）")
+    return psycopg2.connect(
+        host=host,
+        database=os.getenv("DB_NAME", "postgres"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "password"),
+        port=os.getenv("DB_PORT", "5432"),
+        options="-c statement_timeout=0",
+    )
+
+
+def _table_exists(cur, name: str) -> bool:
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f"public.{name}",))
+    return bool(cur.fetchone()[0])
+
+
+def reset_tables(conn) -> None:
+    """只重建本工具產生過的表；看起來像正式資料就停下來。"""
+    with conn.cursor() as cur:
+        if _table_exists(cur, "violation_cases") and not _table_exists(cur, "synthetic_fixture"):
+            raise SystemExit("❌ public.violation_cases 已存在且不是本工具產生的，拒絕覆蓋")
+        cur.execute("DROP TABLE IF EXISTS public.violation_cases")
+        cur.execute("DROP TABLE IF EXISTS public.synthetic_fixture")
+        cur.execute(VIOLATION_CASES_DDL)
+        cur.execute(FIXTURE_MARKER_DDL)
+        # 前一份 fixture 的衍生資料（向量 / namespace 紀錄）一起清掉
+        for derived in ("case_embeddings", "case_vectors", "case_vector_namespaces"):
+            if _table_exists(cur, derived):
+                cur.execute(f"TRUNCATE public.{derived}")
+    conn.commit()
+
+
+def _copy(conn, table: str, columns: List[str], records: List[Tuple]) -> None:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for record in records:
+        writer.writerow(["" if v is None else v for v in record])
+    buf.seek(0)
+    with conn.cursor() as cur:
+        cur.copy_expert(
+            f"COPY public.{table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '')",
+            buf,
+        )
+
+
+def build_fixture(conn, config: SyntheticConfig, progress: bool = True) -> Dict[str, Any]:
+    """回傳 {"rows", "labeled", "embedded", "seconds"}。"""
+    import case_embeddings
+
+    started = time.perf_counter()
+    reset_tables(conn)
+    if config.embeddings:
+        case_embeddings.ensure_schema(conn)
+
+    generator = CaseGenerator(config)
+    stats = {"rows": 0, "labeled": 0, "embedded": 0}
+    case_batch: List[Tuple] = []
+    embedding_batch: List[Tuple] = []
+
+    def flush() -> None:
+        _copy(conn, "violation_cases", CASE_FIELDS, case_batch)
+        if embedding_batch:
+            _copy(
+                conn, "case_embeddings",
+                ["case_id", "model", "content_hash", "dim", "embedding"],
+                embedding_batch,
+            )
+        conn.commit()
+        case_batch.clear()
+        embedding_batch.clear()
+        if progress:
+            print(f"  📥 {stats['rows']}/{config.rows} 筆（{time.perf_counter() - started:.1f}s）")
+
+    for row in generator.rows():
+        case_batch.append(tuple(row[f] for f in CASE_FIELDS))
+        stats["rows"] += 1
+        labeled = any(row[col] == 1 for col in TAG_COLUMNS)
+        if labeled:
+            stats["labeled"] += 1
+            if config.embeddings:
+                vector = generator.embedding(row)
+                embedding_batch.append((
+                    str(row["id"]),
+                    EMBEDDING_MODEL,
+                    content_hash(row["case_explaination"]),
+                    len(vector),
+                    "{" + ",".join(map(str, vector)) + "}",
+                ))
+                stats["embedded"] += 1
+        if len(case_batch) >= config.batch_size:
+            flush()
+    if case_batch:
+        flush()
+
+    seconds = round(time.perf_counter() - started, 2)
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE public.violation_cases")
+        cur.execute(
+            "INSERT INTO public.synthetic_fixture (config, seconds) VALUES (%s, %s)",
+            (json.dumps(asdict(config), ensure_ascii=False), seconds),
+        )
+    conn.commit()
+    return dict(stats, seconds=seconds)
+
+
+# ==========================================
+# 3. CLI
+# ==========================================
+def parse_industries(value: str) -> Dict[str, float]:
+    """「食物=0.5,化妝品=0.3,藥品=0.2」"""
+    weights = {}
+    for part in value.split(","):
+        if part:
+            name, _, weight = part.partition("=")
+            weights[name.strip()] = float(weight)
+    return weights
+
+
+def add_config_arguments(p: argparse.ArgumentParser) -> None:
+    defaults = SyntheticConfig()
+    p.add_argument("--seed", type=int, default=defaults.seed)
+    p.add_argument("--unlabeled-ratio", type=float, default=defaults.unlabeled_ratio, help="所有 tag 都 = 0 的比例")
+    p.add_argument("--mean-tags", type=float, default=defaults.mean_tags, help="有 Tag 的案件平均幾個 tag")
+    p.add_argument("--tag-skew", type=float, default=defaults.tag_skew, help="tag 熱門程度的 Zipf 指數")
+    p.add_argument("--co-occur", type=float, default=defaults.co_occur, help="第二個以後的 tag 來自同大類的機率")
+    p.add_argument("--industries", type=parse_industries, default=defaults.industries)
+    p.add_argument("--explain-median", type=int, default=defaults.explain_median, help="explanation 長度中位數（字）")
+    p.add_argument("--explain-sigma", type=float, default=defaults.explain_sigma)
+    p.add_argument("--embeddings", action="store_true", help="同時寫 case_embeddings 假向量")
+    p.add_argument("--embedding-dim", type=int, default=defaults.embedding_dim)
+    p.add_argument("--batch-size", type=int, default=defaults.batch_size)
+    p.add_argument("--allow-remote", action="store_true")
+
+
+def config_from_args(args, rows: int) -> SyntheticConfig:
+    return SyntheticConfig(
+        rows=rows,
+        seed=args.seed,
+        unlabeled_ratio=args.unlabeled_ratio,
+        mean_tags=args.mean_tags,
+        tag_skew=args.tag_skew,
+        co_occur=args.co_occur,
+        industries=args.industries,
+        explain_median=args.explain_median,
+        explain_sigma=args.explain_sigma,
+        embeddings=args.embeddings,
+        embedding_dim=args.embedding_dim,
+        batch_size=args.batch_size,
+    )
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Fill a local Postgres with synthetic violation_cases")
+    p.add_argument("--rows", type=int, default=SyntheticConfig.rows)
+    add_config_arguments(p)
+    args = p.parse_args(argv)
+
+    config = config_from_args(args, args.rows)
+    print(f"🧪 產生 {config.rows} 筆假 violation_cases（embeddings={config.embeddings}）")
+    conn = connect(args.allow_remote)
+    try:
+        stats = build_fixture(conn, config)
+    finally:
+        conn.close()
+    print(f"✅ 完成：{stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+# cache.py
+# 可插拔的快取後端：
+# - memory：單一 process 內的 LRU（預設）
+# - sqlite：同一台主機上多個 uvicorn / gunicorn worker 共用的本機檔案快取
+#
+# 用法：
+#   from cache import get_cache
+#   cache = get_cache()
+#   cache.get("risk", "snapshot")
+#   cache.set("risk", "snapshot", {...}, ttl=300)
+#   cache.invalidate("risk")            # 清掉整個 namespace（sqlite 模式下所有 worker 都看得到）
+#
+# 資料變動後 invalidate_data_caches() 會改寫 DATA_VERSION_PATH 的版本戳記；
+# 每個 worker 讀資料 namespace 前會檢查它（最多每 DATA_VERSION_CHECK_SECONDS 一次），
+# 戳記換了就清掉自己 process 內的資料快取並跑 invalidation hook。
+# 所以 memory 後端、或由 CLI 腳本（sync / auto_tag）更新資料時，其他 worker 也不會一直拿舊資料。
+
+import os
+import json
+import time
+import sqlite3
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from metrics import record_cache
+
+load_dotenv()
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "/tmp/lawpatrol_cache.sqlite3")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "20000"))
+DATA_VERSION_PATH = os.getenv("DATA_VERSION_PATH", "/tmp/lawpatrol_data_version")
+DATA_VERSION_CHECK_SECONDS = float(os.getenv("DATA_VERSION_CHECK_SECONDS", "1"))
+
+# 資料（violation_cases / Pinecone）變動後需要一起清掉的 namespace
+# 其他模組在 import 時用 register_data_namespace() 登記
+DATA_NAMESPACES = {"risk"}
+
+
+# 不在快取後端裡、但同樣依賴案例資料的東西（例如語意快取的索引），資料變動時一起清
+_INVALIDATION_HOOKS: List[Callable[[], None]] = []
+
+
+def register_data_namespace(namespace: str) -> None:
+    DATA_NAMESPACES.add(namespace)
+
+
+def register_invalidation_hook(hook: Callable[[], None]) -> None:
+    _INVALIDATION_HOOKS.append(hook)
+
+
+def make_key(*parts: Any) -> str:
+    """把任意參數組成穩定的快取 key（sha256）。"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ==========================================
+# 1. 介面
+# ==========================================
+class CacheBackend:
+    """
+    所有快取後端共用的介面。value 必須能被 JSON 序列化。
+    memory 後端回傳的是同一個物件，呼叫端要改內容請先複製。
+    """
+
+    name = "base"
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        if namespace in DATA_NAMESPACES:
+            data_version()
+        value = self._get(namespace, key)
+        record_cache(namespace, value is not None)
+        return value
+
+    def _get(self, namespace: str, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str) -> None:
+        raise NotImplementedError
+
+    def invalidate(self, namespace: str) -> None:
+        raise NotImplementedError
+
+
+# ==========================================
+# 2. 單一 process 內的 LRU
+# ==========================================
+class InProcessCache(CacheBackend):
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Tuple[str, str], Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get((namespace, key))
+            if item is None:
+                return None
+
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._data[(namespace, key)]
+                return None
+
+            self._data.move_to_end((namespace, key))
+            return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[(namespace, key)] = (value, expires_at)
+            self._data.move_to_end((namespace, key))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+    def invalidate(self, namespace: str) -> None:
+        with self._lock:
+            for k in [k for k in self._data if k[0] == namespace]:
+                del self._data[k]
+
+
+# ==========================================
+# 3. 多 worker 共用的 SQLite 檔案快取
+# ==========================================
+class SQLiteCache(CacheBackend):
+    """
+    同一台主機上的 worker 共用一個 SQLite 檔（WAL 模式，讀不擋寫）。
+    一個 worker 預熱的結果其他 worker 直接讀得到；invalidate 也會立即對所有 worker 生效。
+    """
+
+    name = "sqlite"
+    _TRIM_EVERY = 256
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            );
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cache_entries_updated ON cache_entries (updated_at);"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, namespace: str, key: str) -> Optional[Any]:
+        try:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?;",
+                (namespace, key),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ 快取讀取失敗 ({namespace}): {e}")
+            return None
+
+        if row is None:
+            return None
+
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(namespace, key)
+            return None
+        return json.loads(value)
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        try:
+            self._conn().execute(
+                """
+                INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, updated_at)
+                VALUES (?, ?, ?, ?, ?);
+                """,
+                (namespace, key, json.dumps(value, ensure_ascii=False), expires_at, now),
+            )
+        except sqlite3.Error as e:
+            print(f"⚠️ 快取寫入失敗 ({namespace}): {e}")
+            return
+
+        self._writes += 1
+        if self._writes % self._TRIM_EVERY == 0:
+            self._trim()
+
+    def delete(self, namespace: str, key: str) -> None:
+        try:
+            self._conn().execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?;", (namespace, key)
+            )
+        except sqlite3.Error as e:
+            print(f"⚠️ 快取刪除失敗 ({namespace}): {e}")
+
+    def invalidate(self, namespace: str) -> None:
+        try:
+            self._conn().execute("DELETE FROM cache_entries WHERE namespace = ?;", (namespace,))
+        except sqlite3.Error as e:
+            print(f"⚠️ 快取清除失敗 ({namespace}): {e}")
+
+    def _trim(self) -> None:
+        """清掉過期資料，並把總筆數壓回 max_entries（先刪最舊的）。"""
+        conn = self._conn()
+        try:
+            conn.execute("DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at < ?;", (time.time(),))
+            conn.execute(
+                """
+                DELETE FROM cache_entries WHERE rowid IN (
+                    SELECT rowid FROM cache_entries ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+                );
+                """,
+                (self.max_entries,),
+            )
+        except sqlite3.Error as e:
+            print(f"⚠️ 快取整理失敗: {e}")
+
+
+# ==========================================
+# 4. 取得全域快取 & 資料變動後的失效
+# ==========================================
+_cache: Optional[CacheBackend] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> CacheBackend:
+    global _cache
+
+    if _cache is not None:
+        return _cache
+
+    with _cache_lock:
+        if _cache is None:
+            if CACHE_BACKEND == "sqlite":
+                try:
+                    _cache = SQLiteCache()
+                except sqlite3.Error as e:
+                    print(f"⚠️ SQLite 快取初始化失敗，改用 memory：{e}")
+                    _cache = InProcessCache()
+            else:
+                _cache = InProcessCache()
+    return _cache
+
+
+_data_version: Optional[str] = None
+_data_version_checked_at = 0.0
+_data_version_lock = threading.Lock()
+
+
+def _read_data_version() -> Optional[str]:
+    try:
+        with open(DATA_VERSION_PATH, encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_data_version() -> Optional[str]:
+    """寫暫存檔再 os.replace，讀的人不會看到寫一半的戳記。"""
+    version = uuid.uuid4().hex
+    tmp_path = f"{DATA_VERSION_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_path, DATA_VERSION_PATH)
+    except OSError as e:
+        print(f"⚠️ 寫入資料版本戳記失敗，其他 worker 要等 TTL 才會更新：{e}")
+        return None
+    return version
+
+
+def _clear_local(cache: CacheBackend) -> None:
+    # sqlite 的共用資料已經由寫戳記的那個 process 清過，這裡只清 process 內的東西
+    if cache.name == "memory":
+        for namespace in sorted(DATA_NAMESPACES):
+            cache.invalidate(namespace)
+    for hook in _INVALIDATION_HOOKS:
+        try:
+            hook()
+        except Exception as e:
+            print(f"⚠️ 快取失效 hook 執行失敗: {e}")
+
+
+def data_version() -> Optional[str]:
+    """
+    目前的資料版本戳記（沒有戳記檔時為 None）。
+    跟上次看到的不一樣，代表別的 process 更新過資料：先清掉本 process 的資料快取再回傳。
+    """
+    global _data_version, _data_version_checked_at
+
+    now = time.monotonic()
+    if now - _data_version_checked_at < DATA_VERSION_CHECK_SECONDS:
+        return _data_version
+    with _data_version_lock:
+        if now - _data_version_checked_at < DATA_VERSION_CHECK_SECONDS:
+            return _data_version
+        # 第一次檢查只記下目前的戳記，之後換了才清
+        first_check = _data_version_checked_at == 0.0
+        _data_version_checked_at = now
+        version = _read_data_version()
+        if version == _data_version:
+            return version
+        _data_version = version
+    if not first_check:
+        _clear_local(get_cache())
+    return version
+
+
+def invalidate_data_caches() -> Dict[str, Any]:
+    """
+    violation_cases / Pinecone 內容更新後呼叫（sync_data、auto_tag_loop 結束時）。
+    sqlite 模式下共用的資料直接清掉；再換一個新的資料版本戳記，
+    其他 worker（包括 memory 後端、以及 CLI 腳本更新資料時的 API worker）下次讀資料時自己清。
+    """
+    global _data_version, _data_version_checked_at
+
+    cache = get_cache()
+    for namespace in sorted(DATA_NAMESPACES):
+        cache.invalidate(namespace)
+    for hook in _INVALIDATION_HOOKS:
+        try:
+            hook()
+        except Exception as e:
+            print(f"⚠️ 快取失效 hook 執行失敗: {e}")
+
+    version = _write_data_version()
+    with _data_version_lock:
+        _data_version, _data_version_checked_at = version, time.monotonic()
+    print(f"🧹 已清除資料相關快取：{sorted(DATA_NAMESPACES)} (backend={cache.name}, data_version={version})")
+    return {"backend": cache.name, "namespaces": sorted(DATA_NAMESPACES), "data_version": version}
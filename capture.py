@@ -0,0 +1,128 @@
+# capture.py
+# 流量錄製（opt-in）：把 /api/check_compliance 的輸入與主流程輸出寫成 JSONL，
+# 給 benchmarks/replay.py 重播、比較不同 pipeline 變體的延遲與輸出差異。
+#
+# - TRAFFIC_CAPTURE_PATH 有設才會錄；TRAFFIC_CAPTURE_RATE 控制抽樣比例
+# - user_id 只留加鹽雜湊；文字裡的 email / 電話 / 網址先遮掉
+# - 寫檔在背景 thread，不影響 request 延遲；佇列滿了就丟掉（只記一筆指標）
+
+import os
+import re
+import json
+import time
+import queue
+import random
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from metrics import Counter
+
+load_dotenv()
+
+TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "")
+TRAFFIC_CAPTURE_RATE = float(os.getenv("TRAFFIC_CAPTURE_RATE", "1.0"))
+TRAFFIC_CAPTURE_SALT = os.getenv("TRAFFIC_CAPTURE_SALT", "lawpatrol")
+TRAFFIC_CAPTURE_QUEUE = int(os.getenv("TRAFFIC_CAPTURE_QUEUE", "1000"))
+
+CAPTURED = Counter("lawpatrol_traffic_captured_total", "Captured requests by result", ["result"])
+
+_PII_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"https?://\S+|www\.\S+"), "<url>"),
+    (re.compile(r"(?:\+?886[-\s]?|0)9\d{2}[-\s]?\d{3}[-\s]?\d{3}"), "<phone>"),
+    (re.compile(r"\(?0\d{1,2}\)?[-\s]?\d{3,4}[-\s]?\d{4}"), "<phone>"),
+]
+
+
+def anonymize_text(text: str) -> str:
+    for pattern, placeholder in _PII_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+def hash_user(user_key: Optional[str]) -> Optional[str]:
+    if not user_key:
+        return None
+    return hashlib.sha256(f"{TRAFFIC_CAPTURE_SALT}:{user_key}".encode("utf-8")).hexdigest()[:16]
+
+
+def summarize_output(logic_result: Dict[str, Any]) -> Dict[str, Any]:
+    """只留比較輸出差異需要的欄位（案例內文、整段改寫都不存）。"""
+    final_analysis = logic_result.get("final_analysis", {}) or {}
+    return {
+        "step1_output": logic_result.get("step1_output", {}) or {},
+        "cases": {
+            item.get("tag"): [c.get("case_id") for c in item.get("cases", []) or []]
+            for item in logic_result.get("vector_search_results", []) or []
+        },
+        "analysis": [
+            {"tag": a.get("tag"), "trigger_word": a.get("trigger_word"), "law": a.get("law", "")}
+            for a in final_analysis.get("analysis_results", []) or []
+        ],
+        "suggestion_length": len(final_analysis.get("suggestion", "") or ""),
+        "partial": bool(logic_result.get("partial")),
+    }
+
+
+class TrafficRecorder:
+    def __init__(self, path: str, rate: float = TRAFFIC_CAPTURE_RATE):
+        self.path = path
+        self.rate = rate
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=TRAFFIC_CAPTURE_QUEUE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        user_key: Optional[str],
+        text: str,
+        logic_result: Dict[str, Any],
+        latency_seconds: float,
+        request_id: Optional[str] = None,
+    ) -> None:
+        if self.rate < 1.0 and random.random() >= self.rate:
+            return
+        entry = {
+            "ts": round(time.time(), 3),
+            "request_id": request_id,
+            "user": hash_user(user_key),
+            "text": anonymize_text(text),
+            "latency_ms": round(latency_seconds * 1000, 1),
+            "output": summarize_output(logic_result),
+        }
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            CAPTURED.inc(result="dropped")
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_loop, name="traffic-capture", daemon=True)
+                self._thread.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            entries = [self._queue.get()]
+            while True:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                CAPTURED.inc(len(entries), result="written")
+            except OSError as e:
+                print(f"⚠️ 寫入流量錄製檔失敗：{e}")
+                CAPTURED.inc(len(entries), result="error")
+
+
+recorder: Optional[TrafficRecorder] = TrafficRecorder(TRAFFIC_CAPTURE_PATH) if TRAFFIC_CAPTURE_PATH else None
@@ -0,0 +1,134 @@
+# case_embeddings.py
+# 案件 embedding 存在 Postgres（public.case_embeddings），跟 violation_cases 放在一起。
+#
+# 原本 sync_data 上傳完 Pinecone 就把向量丟掉，之後只要重建索引、換 namespace layout、
+# 或換檢索後端（pgvector），整批案件都要重新打一次 Gemini。
+# 現在每筆存 (model, content_hash, embedding)：內容沒變、model 沒換就直接拿來用，
+# 重建索引變成單純的搬資料。
+
+import hashlib
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import execute_values
+
+EMBED_DOC_BATCH_SIZE = 32
+
+CASE_EMBEDDINGS_DDL = """
+    CREATE TABLE IF NOT EXISTS public.case_embeddings (
+        case_id      TEXT PRIMARY KEY,
+        model        TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        dim          INTEGER NOT NULL,
+        embedding    REAL[] NOT NULL,
+        updated_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+
+def ensure_schema(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(CASE_EMBEDDINGS_DDL)
+    conn.commit()
+
+
+def load_embeddings(conn, case_ids: Sequence[str]) -> Dict[str, Tuple[str, str, List[float]]]:
+    """case_id -> (model, content_hash, embedding)"""
+    if not case_ids:
+        return {}
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT case_id, model, content_hash, embedding FROM public.case_embeddings WHERE case_id = ANY(%s)",
+            (list(case_ids),),
+        )
+        return {case_id: (model, digest, list(vec)) for case_id, model, digest, vec in cur.fetchall()}
+
+
+def save_embeddings(conn, items: Sequence[Tuple[str, str, str, List[float]]]) -> None:
+    """items: [(case_id, model, content_hash, embedding), ...]"""
+    if not items:
+        return
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO public.case_embeddings (case_id, model, content_hash, dim, embedding)
+            VALUES %s
+            ON CONFLICT (case_id) DO UPDATE
+               SET model = EXCLUDED.model,
+                   content_hash = EXCLUDED.content_hash,
+                   dim = EXCLUDED.dim,
+                   embedding = EXCLUDED.embedding,
+                   updated_at = now()
+            """,
+            [(cid, model, digest, len(vec), list(vec)) for cid, model, digest, vec in items],
+        )
+    conn.commit()
+
+
+def embed_cases(
+    conn,
+    get_genai: Callable[[], object],
+    cases: Sequence[Tuple[str, str]],
+    model: str,
+    progress: Optional[Callable[[int, int, str], None]] = None,
+) -> Tuple[Dict[str, List[float]], Dict[str, int]]:
+    """
+    cases: [(case_id, 要 embed 的文字), ...]
+    回傳 ({case_id: embedding}, {"reused", "embedded", "failed"})。
+    存過而且 model / 內容都沒變的直接用；其餘分批呼叫 Gemini 並寫回資料表。
+    get_genai 只在真的有要 embed 的時候才呼叫（全部命中就不用 API key）。
+    """
+    stored = load_embeddings(conn, [cid for cid, _ in cases])
+    vectors: Dict[str, List[float]] = {}
+    missing: List[Tuple[str, str, str]] = []
+    for case_id, text in cases:
+        digest = content_hash(text)
+        hit = stored.get(case_id)
+        if hit is not None and hit[0] == model and hit[1] == digest:
+            vectors[case_id] = hit[2]
+        else:
+            missing.append((case_id, text, digest))
+
+    stats = {"reused": len(vectors), "embedded": 0, "failed": 0}
+    if not missing:
+        return vectors, stats
+
+    genai = get_genai()
+    for start in range(0, len(missing), EMBED_DOC_BATCH_SIZE):
+        batch = missing[start:start + EMBED_DOC_BATCH_SIZE]
+        try:
+            resp = genai.embed_content(
+                model=model,
+                content=[text for _, text, _ in batch],
+                task_type="retrieval_document",
+            )
+            embeddings = resp["embedding"]
+        except Exception as e:
+            print(f"❌ 批次向量化失敗（{len(batch)} 筆），改成逐筆重試：{e}")
+            embeddings = []
+            for case_id, text, _ in batch:
+                try:
+                    one = genai.embed_content(model=model, content=text, task_type="retrieval_document")
+                    embeddings.append(one["embedding"])
+                except Exception as e_one:
+                    print(f"❌ ID {case_id} 向量化失敗：{e_one}")
+                    embeddings.append(None)
+
+        fresh = []
+        for (case_id, _, digest), vec in zip(batch, embeddings):
+            if vec is None:
+                stats["failed"] += 1
+                continue
+            vectors[case_id] = vec
+            fresh.append((case_id, model, digest, vec))
+        save_embeddings(conn, fresh)
+        stats["embedded"] += len(fresh)
+
+        if progress:
+            progress(start + len(batch), len(missing), f"embedded {stats['embedded']}/{len(missing)}")
+
+    return vectors, stats
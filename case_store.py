@@ -0,0 +1,158 @@
+# case_store.py
+# 本機案件資料（product_name / explanation / law / date / link / industry），
+# 讓向量檢索只需要回傳 id + score。
+#
+# 原本 Pinecone 每個向量都帶整段 explanation 當 metadata，每次 query(include_metadata=True)
+# 全部再傳回來：回應變大、變慢，長的 explanation 還會撞到 metadata 大小上限。
+# VECTOR_PAYLOAD=ids 時：
+# - sync_data 寫進 Pinecone 的 metadata 只剩篩選要用的 industry / tag_name
+# - 查詢不帶 metadata，案件內容從這裡補（database.search_vector_cases）
+# - main.py 組 FinalCase 時，檢索結果裡對不到的 product_name + date 也從這裡查
+#
+# 檔案由 sync_data（或 case_store 工作）從 violation_cases 整批重建，寫暫存檔再 os.replace，
+# 所以讀的人不會看到寫一半的檔案。version 是內容的 hash。
+# 每個 worker 載入到記憶體，每 CASE_STORE_CHECK_SECONDS 檢查一次檔案有沒有換新。
+
+import os
+import json
+import time
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from cache import make_key, register_invalidation_hook
+
+load_dotenv()
+
+VECTOR_PAYLOAD = os.getenv("VECTOR_PAYLOAD", "full")  # full | ids
+CASE_STORE_PATH = os.getenv("CASE_STORE_PATH", "/tmp/lawpatrol_case_store.json")
+CASE_STORE_CHECK_SECONDS = float(os.getenv("CASE_STORE_CHECK_SECONDS", "5"))
+
+# violation_cases → 案件內容要撈的欄位（sync_data 重建、database 補查共用）
+CASE_COLUMNS_SQL = """
+    id,
+    product_name,
+    case_explaination AS case_explanation,
+    violation_law,
+    case_date,
+    source_link,
+    industry
+"""
+
+# 篩選用的 metadata：VECTOR_PAYLOAD=ids 時 Pinecone 只存這些
+FILTER_FIELDS = ("industry", "tag_name")
+
+
+def entry_from_row(row: Dict[str, Any]) -> Dict[str, str]:
+    """格式跟 sync_postgres_pinecone.build_case_metadata 一致（少了 tag_name）。"""
+    return {
+        "product_name": row.get("product_name") or "未知產品",
+        "explanation": row.get("case_explanation") or "",
+        "law": row.get("violation_law") or "",
+        "date": str(row.get("case_date") or ""),
+        "link": row.get("source_link") or "",
+        "industry": row.get("industry") or "Food",
+    }
+
+
+def write_store(cases: Dict[str, Dict[str, str]], path: str = CASE_STORE_PATH) -> Dict[str, Any]:
+    """整批寫入，回傳 {"version", "count", "path"}。"""
+    version = make_key(cases)[:16]
+    payload = {"version": version, "built_at": time.time(), "cases": cases}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    get_case_store().reload()
+    return {"version": version, "count": len(cases), "path": path}
+
+
+class CaseStore:
+    def __init__(self, path: str = CASE_STORE_PATH):
+        self.path = path
+        self.version: Optional[str] = None
+        self._cases: Dict[str, Dict[str, str]] = {}
+        self._by_name: Dict[Tuple[str, str], str] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def reload(self) -> None:
+        """下次讀取時重新檢查檔案（資料變動後的 invalidation hook）。"""
+        self._checked_at = 0.0
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < CASE_STORE_CHECK_SECONDS:
+            return
+        with self._lock:
+            if now - self._checked_at < CASE_STORE_CHECK_SECONDS:
+                return
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    payload = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ 讀取案件資料檔失敗，沿用舊資料：{e}")
+                return
+
+            cases = payload.get("cases") or {}
+            by_name: Dict[Tuple[str, str], str] = {}
+            for case_id, entry in cases.items():
+                by_name.setdefault((entry.get("product_name") or "", entry.get("date") or ""), case_id)
+                by_name.setdefault((entry.get("product_name") or "", ""), case_id)
+            self._cases, self._by_name = cases, by_name
+            self.version, self._mtime = payload.get("version"), mtime
+            print(f"📚 案件資料已載入：{len(cases)} 筆（version={self.version}）")
+
+    def load(self) -> Optional[str]:
+        """暖機用：回傳目前的 version，檔案不存在時回傳 None。"""
+        self._refresh()
+        return self.version
+
+    def get_many(self, case_ids: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        self._refresh()
+        return {cid: self._cases[cid] for cid in case_ids if cid in self._cases}
+
+    def find(self, product_name: str, date: str = "") -> Optional[Tuple[str, Dict[str, str]]]:
+        """用 product_name（+ date）找案件，回傳 (case_id, entry)。"""
+        self._refresh()
+        case_id = self._by_name.get((product_name or "", date or ""))
+        if case_id is None:
+            return None
+        return case_id, self._cases[case_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"version": self.version, "count": len(self._cases), "path": self.path}
+
+
+_store: Optional[CaseStore] = None
+_store_lock = threading.Lock()
+
+
+def get_case_store() -> CaseStore:
+    global _store
+
+    if _store is not None:
+        return _store
+    with _store_lock:
+        if _store is None:
+            _store = CaseStore()
+    return _store
+
+
+def strip_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """VECTOR_PAYLOAD=ids：寫進向量庫的 metadata 只留篩選欄位。"""
+    if VECTOR_PAYLOAD != "ids":
+        return metadata
+    return {k: metadata[k] for k in FILTER_FIELDS if k in metadata}
+
+
+register_invalidation_hook(lambda: get_case_store().reload())
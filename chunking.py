@@ -0,0 +1,242 @@
+# chunking.py
+# 長文切塊：依中文句子 / 段落邊界切成有上限的 chunk（前後帶一點重疊），
+# 各 chunk 平行跑完整流程，最後合併成一份結果給 main.py。
+#
+# 位置（start / end）是 main.py 用 find_text_indices 在「完整原文」上找的，
+# 所以合併時只要把 (tag, trigger_word) 去重，不需要另外換算 offset。
+
+import os
+import asyncio
+from collections import Counter as CounterDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from metrics import stage, log_event
+from semantic_cache import cached_compliance_check
+
+load_dotenv()
+
+# 超過這個長度才切塊
+CHUNK_THRESHOLD_CHARS = int(os.getenv("CHUNK_THRESHOLD_CHARS", "1500"))
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "1000"))
+CHUNK_OVERLAP_CHARS = int(os.getenv("CHUNK_OVERLAP_CHARS", "80"))
+CHUNK_MAX_CONCURRENCY = int(os.getenv("CHUNK_MAX_CONCURRENCY", "4"))
+
+SENTENCE_ENDINGS = set("。！？!?；;…")
+CLOSING_MARKS = set("」』”’）)】")
+
+
+# ==========================================
+# 1. 切句 / 切塊
+# ==========================================
+def split_sentences(text: str) -> List[Tuple[int, int, bool]]:
+    """
+    回傳 [(start, end, ends_paragraph), ...]，所有區間首尾相接、涵蓋整段文字。
+    句尾標點後面的引號 / 括號算在同一句。
+    """
+    spans: List[Tuple[int, int, bool]] = []
+    start = 0
+    i = 0
+    n = len(text)
+
+    while i < n:
+        ch = text[i]
+        if ch == "\n":
+            end = i + 1
+            while end < n and text[end] == "\n":
+                end += 1
+            spans.append((start, end, True))
+            start = i = end
+            continue
+
+        if ch in SENTENCE_ENDINGS:
+            end = i + 1
+            while end < n and (text[end] in SENTENCE_ENDINGS or text[end] in CLOSING_MARKS):
+                end += 1
+            spans.append((start, end, False))
+            start = i = end
+            continue
+
+        i += 1
+
+    if start < n:
+        spans.append((start, n, True))
+    return spans
+
+
+def _hard_split(start: int, end: int, max_chars: int, overlap_chars: int) -> List[Tuple[int, int, bool]]:
+    """單一句子就超過上限時，只好硬切（片段之間照樣留重疊，避免把詞切斷）。"""
+    step = max(1, max_chars - overlap_chars)
+    return [
+        (s, min(s + max_chars, end), False)
+        for s in range(start, end - overlap_chars if end - start > max_chars else end, step)
+    ]
+
+
+def chunk_text(
+    text: str,
+    max_chars: int = CHUNK_MAX_CHARS,
+    overlap_chars: int = CHUNK_OVERLAP_CHARS,
+) -> List[Dict[str, Any]]:
+    """
+    把句子依序塞進 chunk，超過 max_chars 就開新的；
+    塞到一半以上又剛好遇到段落結尾，也在這裡切（保持段落完整）。
+    新 chunk 開頭帶上前一個 chunk 結尾不超過 overlap_chars 的完整句子。
+    回傳 [{"start", "end", "text"}, ...]，start / end 是在原文中的位置。
+    """
+    sentences: List[Tuple[int, int, bool]] = []
+    for s, e, para in split_sentences(text):
+        if e - s > max_chars:
+            sentences.extend(_hard_split(s, e, max_chars, overlap_chars))
+        else:
+            sentences.append((s, e, para))
+
+    chunks: List[Dict[str, Any]] = []
+    current: List[Tuple[int, int, bool]] = []
+
+    def flush():
+        if current:
+            start, end = current[0][0], current[-1][1]
+            chunks.append({"start": start, "end": end, "text": text[start:end]})
+
+    for sentence in sentences:
+        s, e, para = sentence
+        if current and e - current[0][0] > max_chars:
+            flush()
+            # 重疊：從上一塊尾巴往回拿完整句子
+            overlap: List[Tuple[int, int, bool]] = []
+            size = 0
+            for prev in reversed(current):
+                length = prev[1] - prev[0]
+                if size + length > overlap_chars or length + (e - s) > max_chars:
+                    break
+                overlap.insert(0, prev)
+                size += length
+            current = overlap
+
+        current.append(sentence)
+
+        if para and current[-1][1] - current[0][0] >= max_chars // 2:
+            flush()
+            current = []
+
+    flush()
+    return chunks
+
+
+# ==========================================
+# 2. 合併各 chunk 的結果
+# ==========================================
+def _merge_step1(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    industries = CounterDict(
+        (r.get("step1_output", {}) or {}).get("industry") or "Unknown" for r in results
+    )
+    known = [(k, v) for k, v in industries.most_common() if k != "Unknown"]
+    industry = known[0][0] if known else "Unknown"
+
+    tags: Dict[str, List[str]] = {}
+    for r in results:
+        for item in (r.get("step1_output", {}) or {}).get("identified_tags", []) or []:
+            tag = item.get("tag")
+            if not tag:
+                continue
+            words = tags.setdefault(tag, [])
+            for word in item.get("trigger_words", []) or []:
+                if word not in words:
+                    words.append(word)
+
+    return {
+        "industry": industry,
+        "identified_tags": [{"tag": t, "trigger_words": w} for t, w in tags.items()],
+    }
+
+
+def _merge_vector_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    by_tag: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for r in results:
+        for item in r.get("vector_search_results", []) or []:
+            tag = item.get("tag")
+            if not tag:
+                continue
+            cases = by_tag.setdefault(tag, {})
+            for case in item.get("cases", []) or []:
+                key = str(case.get("case_id") or (case.get("product_name"), case.get("date")))
+                if key not in cases or case.get("similarity_score", 0) > cases[key].get("similarity_score", 0):
+                    cases[key] = case
+
+    return [
+        {
+            "tag": tag,
+            "cases": sorted(cases.values(), key=lambda c: c.get("similarity_score", 0), reverse=True),
+        }
+        for tag, cases in by_tag.items()
+    ]
+
+
+def _merge_analysis(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for r in results:
+        for analysis in (r.get("final_analysis", {}) or {}).get("analysis_results", []) or []:
+            key = (analysis.get("tag"), analysis.get("trigger_word"))
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = {**analysis, "reference_cases": list(analysis.get("reference_cases", []) or [])}
+                continue
+
+            # 重疊區的同一個詞：保留有 reason 的版本，案例取聯集
+            if not existing.get("reason") and analysis.get("reason"):
+                existing["reason"] = analysis["reason"]
+                existing["law"] = analysis.get("law", "")
+            seen = {(c.get("product_name"), c.get("date")) for c in existing["reference_cases"]}
+            for c in analysis.get("reference_cases", []) or []:
+                if (c.get("product_name"), c.get("date")) not in seen:
+                    existing["reference_cases"].append(c)
+                    seen.add((c.get("product_name"), c.get("date")))
+
+    # 整段改寫不在 Step 3 裡了（見 suggestion.py），這裡只合併逐詞分析
+    return {"analysis_results": list(merged.values())}
+
+
+def merge_chunk_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    timed_out: List[str] = []
+    for r in results:
+        for s in r.get("timed_out_stages", []) or []:
+            if s not in timed_out:
+                timed_out.append(s)
+
+    return {
+        "step1_output": _merge_step1(results),
+        "vector_search_results": _merge_vector_results(results),
+        "final_analysis": _merge_analysis(results),
+        "partial": any(r.get("partial") for r in results),
+        "timed_out_stages": timed_out,
+    }
+
+
+# ==========================================
+# 3. 入口
+# ==========================================
+async def chunked_compliance_check(
+    user_text: str,
+    deadline: Optional[float] = None,
+    mode: str = "full",
+) -> Dict[str, Any]:
+    """短文直接跑；長文切塊平行跑（每塊仍經過語意快取），再合併。"""
+    if len(user_text) <= CHUNK_THRESHOLD_CHARS:
+        return await cached_compliance_check(user_text, deadline=deadline, mode=mode)
+
+    chunks = chunk_text(user_text)
+    log_event("chunked", text_length=len(user_text), chunks=len(chunks))
+    print(f"✂️ 長文切成 {len(chunks)} 塊平行處理")
+
+    semaphore = asyncio.Semaphore(CHUNK_MAX_CONCURRENCY)
+
+    async def run_chunk(chunk: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            return await cached_compliance_check(chunk["text"], deadline=deadline, mode=mode)
+
+    results = await asyncio.gather(*(run_chunk(c) for c in chunks))
+
+    with stage("chunk_merge", chunks=len(chunks)):
+        return merge_chunk_results(list(results))
@@ -1,13 +1,22 @@
 # database.py
 import os
-import psycopg2
+import time
+import threading
+from psycopg2 import pool as pg_pool
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
-from typing import List
+from typing import List, Dict, Any, Optional
 
-# --- New: Pinecone + Gemini ---
-import google.generativeai as genai
-from pinecone import Pinecone
+from cache import get_cache, make_key
+from metrics import stage, record_fallback
+from embedding_batcher import EmbeddingBatcher, EmbeddingBatchTimeout, EMBED_BATCH_ENABLED
+from partitions import query_target, to_zh_industry
+import pgvector_store
+from case_store import CASE_COLUMNS_SQL, VECTOR_PAYLOAD, entry_from_row, get_case_store
+from pgvector_store import VECTOR_BACKEND
+
+# Pinecone / Gemini 改成在第一次使用時才 import + 初始化（見第 2 節），
+# 讓 `import main` 不必等 SDK 載入與連線，冷啟動更快
 
 # ======================================================
 # 0. 載入環境變數
@@ -19,10 +28,36 @@ DB_NAME = os.getenv("DB_NAME", "postgres")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_PORT = os.getenv("DB_PORT", "5432")
+# Supabase 必須 require；本機壓測用的 Postgres 可設成 disable / prefer
+DB_SSLMODE = os.getenv("DB_SSLMODE", "require")
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "ad-compliance")
+# keep-alive 連線池大小；跟 retrieval_client 的 worker 數對齊，避免連線不夠用又重連
+PINECONE_POOL_SIZE = int(os.getenv("PINECONE_POOL_SIZE", os.getenv("RETRIEVAL_MAX_WORKERS", "16")))
+
+# 連線池大小 & 風險快照的快取秒數
+# pgvector 後端時每個檢索 worker 各借一條連線，再留 DB_POOL_HEADROOM 條給風險查詢、案件補查、稽核寫入；
+# 沒設 DB_POOL_MAX 就照這個算，設了但太小 check_db_pool_size() 會擋下啟動
+RETRIEVAL_MAX_WORKERS = int(os.getenv("RETRIEVAL_MAX_WORKERS", "16"))
+DB_POOL_HEADROOM = int(os.getenv("DB_POOL_HEADROOM", "4"))
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv(
+    "DB_POOL_MAX",
+    str(RETRIEVAL_MAX_WORKERS + DB_POOL_HEADROOM) if VECTOR_BACKEND == "pgvector" else "10",
+))
+# 建立連線最多等幾秒（libpq connect_timeout，整數秒），DB 掛掉時別讓 worker 一直卡著
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+# 連線池全借光時最多排隊等幾秒（ThreadedConnectionPool 本身不會等，直接丟 PoolError）
+DB_POOL_WAIT_TIMEOUT = float(os.getenv("DB_POOL_WAIT_TIMEOUT", "2"))
+RISK_SNAPSHOT_TTL = float(os.getenv("RISK_SNAPSHOT_TTL", "300"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+EMBEDDING_MODEL = "models/text-embedding-004"
+# 批次逾時後，剩下的時間少於這個秒數就不再自己送一次（結果回來時檢索早就放棄了）
+EMBED_DIRECT_MIN_SECONDS = float(os.getenv("EMBED_DIRECT_MIN_SECONDS", "1"))
+# 每個 tag 取幾筆相似案例
+VECTOR_TOP_K = int(os.getenv("VECTOR_TOP_K", "2"))
 
 # ======================================================
 # 1. Tag 對照表（中文 → SQL 欄位名稱）
@@ -69,74 +104,247 @@ TAG_MAPPING = {
 }
 
 # ======================================================
-# 2. 初始化 Gemini（Embedding）與 Pinecone
+# 2. 初始化 Gemini（Embedding）與 Pinecone（lazy，只做一次）
 # ======================================================
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
-else:
-    print("⚠️ WARNING: GOOGLE_API_KEY 未設定，無法產生向量")
-
+# 每個 client 各用一把鎖：Postgres 連不上時不會卡住 Gemini / Pinecone 的初始化
+_genai_lock = threading.Lock()
+_pinecone_lock = threading.Lock()
+_db_pool_lock = threading.Lock()
+_genai_configured = False
+_pinecone_tried = False
 pc = None
 index = None
-if PINECONE_API_KEY:
-    try:
-        pc = Pinecone(api_key=PINECONE_API_KEY)
-        index = pc.Index(PINECONE_INDEX_NAME)
-    except Exception as e:
-        print(f"⚠️ 初始化 Pinecone 失敗：{e}")
-else:
-    print("⚠️ WARNING: PINECONE_API_KEY 未設定，無法進行向量搜尋")
+
+
+def get_genai():
+    """
+    回傳已 configure 過的 google.generativeai 模組；沒有 API key 時回傳 None。
+    第一次呼叫才 import SDK，之後直接用同一份。
+    """
+    global _genai_configured
+
+    if not GOOGLE_API_KEY:
+        return None
+
+    import google.generativeai as genai
+
+    if not _genai_configured:
+        with _genai_lock:
+            if not _genai_configured:
+                genai.configure(api_key=GOOGLE_API_KEY)
+                _genai_configured = True
+    return genai
+
+
+def get_pinecone_index():
+    """
+    取得 Pinecone index（第一次呼叫時才建立 client）。
+    初始化失敗只印警告並回傳 None，不會讓 import 整個掛掉。
+    """
+    global pc, index, _pinecone_tried
+
+    if _pinecone_tried:
+        return index
+
+    with _pinecone_lock:
+        if _pinecone_tried:
+            return index
+
+        if not PINECONE_API_KEY:
+            print("⚠️ WARNING: PINECONE_API_KEY 未設定，無法進行向量搜尋")
+        else:
+            try:
+                from pinecone import Pinecone
+
+                pc = Pinecone(api_key=PINECONE_API_KEY, pool_threads=PINECONE_POOL_SIZE)
+                try:
+                    index = pc.Index(
+                        PINECONE_INDEX_NAME,
+                        pool_threads=PINECONE_POOL_SIZE,
+                        connection_pool_maxsize=PINECONE_POOL_SIZE,
+                    )
+                except TypeError:
+                    # 舊版 SDK 沒有 connection_pool_maxsize
+                    index = pc.Index(PINECONE_INDEX_NAME, pool_threads=PINECONE_POOL_SIZE)
+            except Exception as e:
+                print(f"⚠️ 初始化 Pinecone 失敗：{e}")
+                pc = None
+                index = None
+        _pinecone_tried = True
+
+    return index
+
+
+if not GOOGLE_API_KEY:
+    print("⚠️ WARNING: GOOGLE_API_KEY 未設定，無法產生向量")
 
 
 # ======================================================
-# 3. Postgres 連線
+# 3. Postgres 連線（連線池）
 # ======================================================
+_db_pool: Optional[pg_pool.ThreadedConnectionPool] = None
+# 一個名額對應一條借出去的連線；借不到時在這裡等，而不是讓 getconn() 直接失敗
+_db_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+
+def _get_db_pool() -> Optional[pg_pool.ThreadedConnectionPool]:
+    global _db_pool
+
+    if _db_pool is not None:
+        return _db_pool
+
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = pg_pool.ThreadedConnectionPool(
+                DB_POOL_MIN,
+                DB_POOL_MAX,
+                host=DB_HOST,
+                database=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD,
+                port=DB_PORT,
+                sslmode=DB_SSLMODE,
+                connect_timeout=DB_CONNECT_TIMEOUT,
+            )
+    return _db_pool
+
+
+def check_db_pool_size() -> None:
+    """pgvector 後端時連線池至少要 RETRIEVAL_MAX_WORKERS + DB_POOL_HEADROOM，不夠就丟 RuntimeError。"""
+    if VECTOR_BACKEND != "pgvector":
+        return
+    required = RETRIEVAL_MAX_WORKERS + DB_POOL_HEADROOM
+    if DB_POOL_MAX < required:
+        raise RuntimeError(
+            f"DB_POOL_MAX={DB_POOL_MAX} 太小：VECTOR_BACKEND=pgvector 需要至少 "
+            f"RETRIEVAL_MAX_WORKERS({RETRIEVAL_MAX_WORKERS}) + DB_POOL_HEADROOM({DB_POOL_HEADROOM}) = {required}"
+        )
+
+
 def get_db_connection():
+    """
+    從連線池借一條連線，用完請呼叫 release_db_connection()。
+    連線池借光時最多等 DB_POOL_WAIT_TIMEOUT 秒，還是借不到就回傳 None。
+    """
+    if not _db_slots.acquire(timeout=DB_POOL_WAIT_TIMEOUT):
+        print("⚠️ 資料庫連線池已滿，等待逾時")
+        record_fallback("db_pool", "timeout")
+        return None
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            port=DB_PORT,
-            sslmode="require"  # Supabase 必須加
-        )
+        db_pool = _get_db_pool()
+        conn = db_pool.getconn()
+        if conn.closed:
+            # 閒置太久被 server 斷掉的連線：丟掉換一條新的
+            db_pool.putconn(conn, close=True)
+            conn = db_pool.getconn()
         return conn
     except Exception as e:
+        _db_slots.release()
         print(f"❌ 資料庫連線失敗: {e}")
         return None
 
 
-# ======================================================
-# 4. 風險查詢
-# ======================================================
-def get_risk_info(tag_name: str) -> float:
-    sql_column = TAG_MAPPING.get(tag_name)
-    if not sql_column:
-        return 0.0
+def release_db_connection(conn) -> None:
+    """把連線還回連線池（連線池不存在時直接關掉）。"""
+    if conn is None:
+        return
+    try:
+        if _db_pool is not None:
+            if not conn.closed:
+                conn.rollback()  # 清掉未結束的 transaction，下一位借用者才乾淨
+            _db_pool.putconn(conn)
+        else:
+            conn.close()
+    except Exception as e:
+        print(f"⚠️ 歸還資料庫連線失敗: {e}")
+    finally:
+        _db_slots.release()
 
+
+def warm_db_pool() -> bool:
+    """啟動時先建好連線池並跑一次 SELECT 1，回傳是否成功。"""
     conn = get_db_connection()
     if not conn:
-        return 0.5  # fallback
-
+        return False
     try:
         with conn.cursor() as cursor:
-            cursor.execute("SELECT COUNT(*) FROM public.violation_cases;")
-            total = cursor.fetchone()[0]
+            cursor.execute("SELECT 1;")
+            cursor.fetchone()
+        return True
+    finally:
+        release_db_connection(conn)
 
-            if total == 0:
-                return 0.0
 
-            cursor.execute(f"SELECT COUNT(*) FROM public.violation_cases WHERE {sql_column} = 1;")
-            cnt = cursor.fetchone()[0]
+# ======================================================
+# 4. 風險查詢
+# ======================================================
+def load_risk_snapshot() -> Optional[Dict[str, Any]]:
+    """
+    一次 SQL 算出總筆數 + 每個 tag 欄位 = 1 的筆數：
+    {"total": 536, "counts": {"tag_treatment": 12, ...}}
+    DB 連不上時回傳 None。
+    """
+    conn = get_db_connection()
+    if not conn:
+        record_fallback("risk_sql", "db_unavailable")
+        return None
 
-            return round(cnt / total, 3)
+    columns = list(TAG_MAPPING.values())
+    count_sql = ", ".join(
+        f"COUNT(*) FILTER (WHERE {col} = 1) AS {col}" for col in columns
+    )
 
+    try:
+        with stage("risk_sql"), conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) AS total, {count_sql} FROM public.violation_cases;"
+            )
+            row = cursor.fetchone()
+
+        return {
+            "total": row[0] or 0,
+            "counts": {col: (row[i + 1] or 0) for i, col in enumerate(columns)},
+        }
     except Exception as e:
         print(f"❌ risk SQL 錯誤: {e}")
-        return 0.0
+        record_fallback("risk_sql", "sql_error")
+        return {"total": 0, "counts": {}, "error": str(e)}
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+
+def get_risk_snapshot(force: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    帶 TTL 的風險快照，放在共用快取（namespace="risk"），多個 worker 共用同一份。
+    失敗結果不快取，下一次呼叫會重查。
+    """
+    cache = get_cache()
+    if not force:
+        cached = cache.get("risk", "snapshot")
+        if cached is not None:
+            return cached
+
+    snapshot = load_risk_snapshot()
+    if snapshot is not None and "error" not in snapshot:
+        cache.set("risk", "snapshot", snapshot, ttl=RISK_SNAPSHOT_TTL)
+    return snapshot
+
+
+def get_risk_info(tag_name: str) -> float:
+    sql_column = TAG_MAPPING.get(tag_name)
+    if not sql_column:
+        return 0.0
+
+    snapshot = get_risk_snapshot()
+    if snapshot is None:
+        return 0.5  # fallback
+
+    total = snapshot["total"]
+    if total == 0:
+        return 0.0
+
+    cnt = snapshot["counts"].get(sql_column, 0)
+    return round(cnt / total, 3)
 
 
 def calculate_combined_risk(tags: List[str]) -> float:
@@ -147,7 +355,7 @@ def calculate_combined_risk(tags: List[str]) -> float:
     if not tags:
         return 0.0
 
-    probabilities = [get_risk_info(tag) for tag in tags if get_risk_info(tag) > 0]
+    probabilities = [p for p in (get_risk_info(tag) for tag in tags) if p > 0]
 
     if not probabilities:
         return 0.0
@@ -166,23 +374,81 @@ def calculate_combined_risk(tags: List[str]) -> float:
 # ======================================================
 # 5. 向量查詢
 # ======================================================
-def embed_text(text: str):
-    if not GOOGLE_API_KEY:
-        return None
-
-    try:
+def _embed_many(texts: List[str]) -> List[List[float]]:
+    """一次送多筆文字；給 EmbeddingBatcher 用。"""
+    genai = get_genai()
+    if genai is None:
+        raise RuntimeError("GOOGLE_API_KEY 未設定")
+    with stage("embedding_batch"):
         resp = genai.embed_content(
-            model="models/text-embedding-004",
-            content=text,
+            model=EMBEDDING_MODEL,
+            content=texts,
             task_type="retrieval_query",
         )
-        return resp["embedding"]
+    return resp["embedding"]
+
+
+# 併發 request 的 embed_text 合併成一次多筆呼叫（EMBED_BATCH_ENABLED=0 可關閉）
+_embedding_batcher = EmbeddingBatcher(_embed_many)
+
+
+def embed_text(text: str, timeout: float | None = None):
+    """
+    timeout：呼叫端（向量檢索）總共願意等幾秒；批次逾時後剩下的時間不夠
+    EMBED_DIRECT_MIN_SECONDS 就直接回傳 None，不再多打一次 API。
+    """
+    started = time.monotonic()
+    genai = get_genai()
+    if genai is None:
+        record_fallback("embedding", "no_api_key")
+        return None
+
+    cache = get_cache()
+    cache_key = make_key(EMBEDDING_MODEL, "retrieval_query", text)
+    cached = cache.get("embedding", cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        with stage("embedding"):
+            embedding = None
+            if EMBED_BATCH_ENABLED:
+                try:
+                    embedding = _embedding_batcher.embed(text)
+                except EmbeddingBatchTimeout:
+                    # 批次卡住不要拖住檢索 worker：時間還夠就自己送一次，不夠就放棄
+                    record_fallback("embedding", "batch_timeout")
+                    if timeout is not None and timeout - (time.monotonic() - started) < EMBED_DIRECT_MIN_SECONDS:
+                        return None
+            if embedding is None:
+                request_kwargs = {}
+                if timeout is not None:
+                    request_kwargs["request_options"] = {
+                        "timeout": max(timeout - (time.monotonic() - started), EMBED_DIRECT_MIN_SECONDS)
+                    }
+                resp = genai.embed_content(
+                    model=EMBEDDING_MODEL,
+                    content=text,
+                    task_type="retrieval_query",
+                    **request_kwargs,
+                )
+                embedding = resp["embedding"]
     except Exception as e:
         print(f"❌ 產生 embedding 失敗: {e}")
+        record_fallback("embedding", "api_error")
         return None
 
+    cache.set("embedding", cache_key, embedding, ttl=EMBEDDING_CACHE_TTL)
+    return embedding
+
 
-def search_vector_cases(user_text: str, tag: str, industry: str | None = None, top_k: int = 2):
+def search_vector_cases(
+    user_text: str,
+    tag: str,
+    industry: str | None = None,
+    top_k: int | None = None,
+    timeout: float | None = None,
+):
     """
     產出：
     [
@@ -197,49 +463,55 @@ def search_vector_cases(user_text: str, tag: str, industry: str | None = None, t
         }
     ]
     """
+    top_k = top_k or VECTOR_TOP_K
+    if VECTOR_BACKEND == "pgvector":
+        return _search_pgvector(user_text, tag, industry, top_k, timeout)
+
+    index = get_pinecone_index()
     if index is None:
         print("⚠️ Pinecone 尚未初始化")
+        record_fallback("pinecone", "index_unavailable")
         return []
 
-    embedding = embed_text(user_text)
+    embedding = embed_text(user_text, timeout=timeout)
     if embedding is None:
+        record_fallback("pinecone", "no_embedding", tag=tag)
         return []
 
-    # --- 🔧 這裡開始改 ---
-    filter_dict = {
-        "tag_name": {"$in": [tag]}
-    }
-
-    # LLM 給的是英文 (Food/Cosmetic/Medicine/Device)
-    # DB / Pinecone 存的是中文 (食物/化妝品/藥品/醫療器材)
-    EN_TO_ZH_INDUSTRY = {
-        "Food": "食物",
-        "Cosmetic": "化妝品",
-        "Medicine": "藥品",
-        "Device": "醫療器材",
-    }
-
-    if industry:
-        mapped = EN_TO_ZH_INDUSTRY.get(industry, industry)
-        filter_dict["industry"] = mapped
-    # --- 🔧 改到這裡為止 ---
+    # flat：metadata filter 限定 tag / 產業；分區 layout：直接查對應的 namespace
+    namespace, filter_dict = query_target(tag, industry, TAG_MAPPING)
 
     try:
-        result = index.query(
-            vector=embedding,
-            top_k=top_k,
-            include_metadata=True,
-            filter=filter_dict,
-        )
+        with stage("pinecone", tag=tag):
+            query_kwargs = {"_request_timeout": timeout} if timeout else {}
+            if namespace:
+                query_kwargs["namespace"] = namespace
+            if filter_dict:
+                query_kwargs["filter"] = filter_dict
+            # ids 模式只拿 id + score，案件內容從本機 case store 補
+            result = index.query(
+                vector=embedding,
+                top_k=top_k,
+                include_metadata=VECTOR_PAYLOAD != "ids",
+                **query_kwargs,
+            )
     except Exception as e:
         print(f"❌ Pinecone 查詢錯誤: {e}")
+        record_fallback("pinecone", "query_error", tag=tag)
         return []
 
     matches = result.get("matches", []) or []
+    if VECTOR_PAYLOAD == "ids":
+        hydrated = hydrate_cases([str(m.get("id")) for m in matches])
     output = []
 
     for m in matches:
-        meta = m.get("metadata", {}) or {}
+        if VECTOR_PAYLOAD == "ids":
+            meta = hydrated.get(str(m.get("id")))
+            if meta is None:
+                continue
+        else:
+            meta = m.get("metadata", {}) or {}
         output.append({
             "case_id": m.get("id"),
             "product_name": meta.get("product_name", ""),
@@ -253,6 +525,98 @@ def search_vector_cases(user_text: str, tag: str, industry: str | None = None, t
     return output
 
 
+def fetch_case_entries(case_ids: List[str]) -> Dict[str, Dict[str, str]]:
+    """直接從 violation_cases 撈案件內容（case store 還沒建 / 還沒同步到的新案件）。"""
+    conn = get_db_connection()
+    if not conn:
+        return {}
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                f"SELECT {CASE_COLUMNS_SQL} FROM public.violation_cases WHERE id::text = ANY(%s)",
+                (list(case_ids),),
+            )
+            return {str(row["id"]): entry_from_row(row) for row in cursor.fetchall()}
+    except Exception as e:
+        print(f"❌ 查詢案件內容失敗: {e}")
+        return {}
+    finally:
+        release_db_connection(conn)
+
+
+def hydrate_cases(case_ids: List[str]) -> Dict[str, Dict[str, str]]:
+    """case_id -> 案件內容；先查 case store，沒有的再查 DB，都沒有的不回傳。"""
+    if not case_ids:
+        return {}
+    found = get_case_store().get_many(case_ids)
+    missing = [cid for cid in case_ids if cid not in found]
+    if missing:
+        record_fallback("case_store", "miss")
+        with stage("case_hydrate_sql"):
+            found.update(fetch_case_entries(missing))
+    return found
+
+
+def _search_pgvector(
+    user_text: str,
+    tag: str,
+    industry: str | None,
+    top_k: int,
+    timeout: float | None,
+):
+    """VECTOR_BACKEND=pgvector：同一台 Postgres 上查 case_vectors，輸出格式跟 Pinecone 一樣。"""
+    embedding = embed_text(user_text, timeout=timeout)
+    if embedding is None:
+        record_fallback("pgvector", "no_embedding", tag=tag)
+        return []
+
+    conn = get_db_connection()
+    if not conn:
+        record_fallback("pgvector", "db_unavailable", tag=tag)
+        return []
+
+    try:
+        with stage("pgvector", tag=tag):
+            rows = pgvector_store.search(
+                conn, embedding, tag, to_zh_industry(industry), top_k, timeout=timeout
+            )
+    except Exception as e:
+        print(f"❌ pgvector 查詢錯誤: {e}")
+        record_fallback("pgvector", "query_error", tag=tag)
+        return []
+    finally:
+        release_db_connection(conn)
+
+    return [
+        {
+            "case_id": row["case_id"],
+            "product_name": row.get("product_name") or "",
+            "explanation": row.get("explanation") or "",
+            "law": row.get("law") or "",
+            "date": row.get("case_date") or "",
+            "link": row.get("link") or "",
+            "similarity_score": float(row.get("score") or 0.0),
+        }
+        for row in rows
+    ]
+
+
+def warm_vector_backend() -> bool:
+    """啟動暖機：依 VECTOR_BACKEND 檢查 Pinecone index 或 case_vectors 資料表。"""
+    if VECTOR_BACKEND != "pgvector":
+        if VECTOR_PAYLOAD == "ids" and get_case_store().load() is None:
+            print("⚠️ VECTOR_PAYLOAD=ids 但案件資料檔不存在，檢索會改查 DB（請先跑 case_store 或 sync 工作）")
+        return get_pinecone_index() is not None
+
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        return pgvector_store.check_ready(conn)
+    finally:
+        release_db_connection(conn)
+
+
 
 
 # ======================================================
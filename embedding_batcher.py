@@ -0,0 +1,159 @@
+# embedding_batcher.py
+# 跨 request 的 embedding micro-batching：
+# 併發的 embed_text 呼叫（各自在 to_thread worker 上）先丟進同一個佇列，
+# 收集 EMBED_BATCH_WINDOW_MS 毫秒或滿 EMBED_BATCH_MAX_SIZE 筆就合成一次
+# 多筆的 embed_content 呼叫，再把向量分發回各個等待中的呼叫者。
+#
+# 這個模組不 import database；實際打 API 的函式由 database.py 傳進來。
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from metrics import Gauge, Histogram, log_event
+
+load_dotenv()
+
+EMBED_BATCH_ENABLED = os.getenv("EMBED_BATCH_ENABLED", "1") == "1"
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+# 同時在飛的批次數（收集不會因為上一批還沒回來而停下）
+EMBED_BATCH_WORKERS = int(os.getenv("EMBED_BATCH_WORKERS", "4"))
+# 等批次結果的上限（預設向量檢索逾時的一半）；超過就丟 EmbeddingBatchTimeout，
+# 呼叫端剩下的時間還夠才改走單筆呼叫（見 database.embed_text）
+EMBED_BATCH_TIMEOUT_SECONDS = float(
+    os.getenv(
+        "EMBED_BATCH_TIMEOUT_SECONDS",
+        str(float(os.getenv("RETRIEVAL_TIMEOUT_SECONDS", "3")) / 2),
+    )
+)
+
+EMBED_BATCH_SIZE = Histogram(
+    "lawpatrol_embedding_batch_size",
+    "Texts per batched embedding request",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+EMBED_QUEUE_SECONDS = Histogram(
+    "lawpatrol_embedding_batch_queue_seconds",
+    "Time a text waited in the batcher before its batch was sent",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+EMBED_BATCH_WINDOW = Gauge(
+    "lawpatrol_embedding_batch_window_seconds", "Configured embedding batch window"
+)
+EMBED_QUEUE_DEPTH = Gauge(
+    "lawpatrol_embedding_batch_queue_depth", "Texts waiting to be batched"
+)
+
+_Item = Tuple[str, Future, float]
+
+
+class EmbeddingBatchTimeout(Exception):
+    """批次在 timeout 內沒有回來（API 慢，或收集 thread 出問題）。"""
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        embed_many: Callable[[List[str]], List[List[float]]],
+        window_ms: float = EMBED_BATCH_WINDOW_MS,
+        max_size: int = EMBED_BATCH_MAX_SIZE,
+        workers: int = EMBED_BATCH_WORKERS,
+        timeout: float = EMBED_BATCH_TIMEOUT_SECONDS,
+    ):
+        self.embed_many = embed_many
+        self.window = window_ms / 1000.0
+        self.max_size = max(1, max_size)
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self._queue: "queue.Queue[_Item]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._start_lock = threading.Lock()
+        EMBED_BATCH_WINDOW.set(self.window)
+
+    def embed(self, text: str) -> List[float]:
+        """
+        阻塞直到這段文字的向量回來（最多 self.timeout 秒）；API 錯誤會原樣丟回給呼叫者，
+        逾時丟 EmbeddingBatchTimeout。逾時的那筆之後若還是算出來，結果就沒人拿，直接丟掉。
+        """
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        EMBED_QUEUE_DEPTH.set(self._queue.qsize())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            log_event("embedding_batch_timeout", timeout=self.timeout)
+            raise EmbeddingBatchTimeout(f"embedding 批次 {self.timeout}s 內沒有回來") from None
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            # 收集 thread 死掉的話重開一個（佇列裡還在等的項目會被新的 thread 接手）
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="embed-batch"
+                )
+            self._thread = threading.Thread(
+                target=self._collect, name="embed-batcher", daemon=True
+            )
+            self._thread.start()
+
+    # ---------- 收集 ----------
+    def _collect(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            window_ends = time.monotonic() + self.window
+            while len(batch) < self.max_size:
+                remaining = window_ends - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            EMBED_QUEUE_DEPTH.set(self._queue.qsize())
+            try:
+                self._executor.submit(self._flush, batch)
+            except Exception as e:
+                # 送不出去就讓這批直接失敗，呼叫端不用等到逾時
+                log_event("embedding_batch_failed", size=len(batch), error=str(e))
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+    # ---------- 送出 & 分發 ----------
+    def _flush(self, batch: List[_Item]) -> None:
+        sent_at = time.perf_counter()
+        for _, _, queued_at in batch:
+            EMBED_QUEUE_SECONDS.observe(sent_at - queued_at)
+
+        # 同一批裡重複的文字只送一次
+        unique: Dict[str, List[Future]] = {}
+        for text, future, _ in batch:
+            unique.setdefault(text, []).append(future)
+        texts = list(unique)
+        EMBED_BATCH_SIZE.observe(len(texts))
+
+        try:
+            vectors = self.embed_many(texts)
+            if len(vectors) != len(texts):
+                raise ValueError(f"embedding 數量不符：送 {len(texts)} 筆，回 {len(vectors)} 筆")
+        except Exception as e:
+            log_event("embedding_batch_failed", size=len(texts), error=str(e))
+            for futures in unique.values():
+                for future in futures:
+                    future.set_exception(e)
+            return
+
+        for text, vector in zip(texts, vectors):
+            for future in unique[text]:
+                future.set_result(vector)
@@ -0,0 +1,233 @@
+# jobs.py
+# API process 內的背景工作：auto_tag（標 Tag）與 sync（Postgres → Pinecone）。
+# - 手動觸發：main.py 的 /api/admin/jobs/{name}
+# - 定期執行：JOBS_INTERVAL_SECONDS > 0 時，lifespan 會起一個排程 loop
+# - 同一時間只跑一個工作：process 內用 threading.Lock，多個 worker 之間用檔案鎖
+# - 跑完一律清資料快取（invalidate_data_caches）並重建風險快照，不需要重啟 API；
+#   其他 worker 靠 cache.py 的資料版本戳記得知資料換了，下次讀資料快取前自己清掉
+
+import os
+import time
+import uuid
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from cache import get_cache, invalidate_data_caches
+from database import get_risk_snapshot
+from metrics import Counter, Gauge, log_event
+
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台只有 process 內的鎖
+    fcntl = None
+
+load_dotenv()
+
+JOBS_INTERVAL_SECONDS = float(os.getenv("JOBS_INTERVAL_SECONDS", "0"))  # 0 = 不排程
+JOBS_SCHEDULED_JOB = os.getenv("JOBS_SCHEDULED_JOB", "refresh")
+JOBS_LOCK_PATH = os.getenv("JOBS_LOCK_PATH", "/tmp/lawpatrol_jobs.lock")
+JOBS_HISTORY_SIZE = int(os.getenv("JOBS_HISTORY_SIZE", "20"))
+AUTO_TAG_MAX_PER_RUN = int(os.getenv("AUTO_TAG_MAX_PER_RUN", "536"))
+
+JOB_RUNS = Counter("lawpatrol_job_runs_total", "Background job runs by result", ["job", "result"])
+JOB_RUNNING = Gauge("lawpatrol_job_running", "1 while a background job is running", ["job"])
+
+ProgressFn = Callable[[int, int, str], None]
+
+
+class JobAlreadyRunning(Exception):
+    pass
+
+
+# ==========================================
+# 1. 工作內容（腳本本身在執行時才 import，避免拖慢 API 啟動）
+# ==========================================
+def job_auto_tag(progress: ProgressFn) -> Dict[str, Any]:
+    from auto_tag_cases import auto_tag_loop
+
+    ids = auto_tag_loop(max_total=AUTO_TAG_MAX_PER_RUN, progress=progress)
+    return {"tagged": len(ids), "ids": ids}
+
+
+def job_sync(progress: ProgressFn) -> Dict[str, Any]:
+    from sync_postgres_pinecone import sync_data
+
+    return sync_data(progress=progress)
+
+
+def job_case_store(progress: ProgressFn) -> Dict[str, Any]:
+    """只重建本機 case store（不碰向量庫），例如新 worker 主機第一次部署時。"""
+    from sync_postgres_pinecone import rebuild_case_store
+
+    return rebuild_case_store()
+
+
+def job_refresh(progress: ProgressFn) -> Dict[str, Any]:
+    """
+    增量更新：先標新案件，再只同步這次被標到的案件。
+    auto_tag 中途失敗時，已 commit 的案件也要先同步再把這次記成失敗：
+    它們已經不是「未標註」，下一次 refresh 不會再撈到，只有手動全量 sync 才補得回來。
+    """
+    from auto_tag_cases import auto_tag_loop
+    from sync_postgres_pinecone import sync_data
+
+    ids: List[Any] = []
+    try:
+        ids = auto_tag_loop(
+            max_total=AUTO_TAG_MAX_PER_RUN,
+            progress=lambda done, total, msg: progress(done, total, f"auto_tag: {msg}"),
+        )
+    except Exception as e:
+        ids = getattr(e, "updated_ids", [])
+        raise
+    finally:
+        synced = sync_data(
+            ids=ids,
+            progress=lambda done, total, msg: progress(done, total, f"sync: {msg}"),
+        )
+    return {"tagged": len(ids), "sync": synced}
+
+
+# ==========================================
+# 2. 排程器
+# ==========================================
+class JobScheduler:
+    def __init__(self, lock_path: str = JOBS_LOCK_PATH):
+        self.lock_path = lock_path
+        self._jobs: Dict[str, Callable[[ProgressFn], Any]] = {}
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._current: Optional[Dict[str, Any]] = None
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=JOBS_HISTORY_SIZE)
+        self._tasks: set = set()
+
+    def register(self, name: str, func: Callable[[ProgressFn], Any]) -> None:
+        self._jobs[name] = func
+
+    @property
+    def job_names(self) -> List[str]:
+        return list(self._jobs)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "jobs": self.job_names,
+            "running": dict(self._current) if self._current else None,
+            "history": [dict(run) for run in reversed(self._history)],
+            "interval_seconds": JOBS_INTERVAL_SECONDS,
+        }
+
+    # ---------- 鎖 ----------
+    def _acquire(self) -> bool:
+        if not self._lock.acquire(blocking=False):
+            return False
+        if fcntl is None:
+            return True
+        try:
+            self._lock_file = open(self.lock_path, "a")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            # 別的 worker 正在跑
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+            self._lock.release()
+            return False
+
+    def _release(self) -> None:
+        if self._lock_file is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            finally:
+                self._lock_file.close()
+                self._lock_file = None
+        self._lock.release()
+
+    # ---------- 觸發 ----------
+    def trigger(self, name: str, trigger: str = "manual") -> Dict[str, Any]:
+        """開始一個工作並立刻回傳它的狀態；要在 event loop 裡呼叫。"""
+        if name not in self._jobs:
+            raise KeyError(name)
+        if not self._acquire():
+            raise JobAlreadyRunning(name)
+
+        run = {
+            "id": uuid.uuid4().hex[:12],
+            "job": name,
+            "trigger": trigger,
+            "state": "running",
+            "started_at": time.time(),
+            "finished_at": None,
+            "progress": {"done": 0, "total": 0, "message": ""},
+            "result": None,
+            "error": None,
+        }
+        self._current = run
+        task = asyncio.create_task(asyncio.to_thread(self._execute, run))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return dict(run)
+
+    def _execute(self, run: Dict[str, Any]) -> None:
+        name = run["job"]
+
+        def progress(done: int, total: int, message: str) -> None:
+            run["progress"] = {"done": done, "total": total, "message": message}
+
+        JOB_RUNNING.set(1, job=name)
+        log_event("job_started", job=name, run_id=run["id"], trigger=run["trigger"])
+        try:
+            run["result"] = self._jobs[name](progress)
+            run["state"] = "succeeded"
+        except Exception as e:
+            run["state"] = "failed"
+            run["error"] = str(e)
+            print(f"❌ 背景工作 {name} 失敗：{e}")
+        finally:
+            # 資料可能只改了一半，不管成功失敗都讓快取重來
+            try:
+                invalidate_data_caches()
+                get_risk_snapshot(force=True)
+            except Exception as e:
+                print(f"⚠️ 背景工作結束後重建快取失敗：{e}")
+
+            run["finished_at"] = time.time()
+            get_cache().set("jobs", f"last_finished:{name}", run["finished_at"])
+            self._history.append(dict(run))
+            self._current = None
+            JOB_RUNNING.set(0, job=name)
+            JOB_RUNS.inc(job=name, result=run["state"])
+            log_event(
+                "job_finished",
+                job=name,
+                run_id=run["id"],
+                state=run["state"],
+                seconds=round(run["finished_at"] - run["started_at"], 1),
+            )
+            self._release()
+
+    # ---------- 定期執行 ----------
+    async def run_forever(self, name: str = JOBS_SCHEDULED_JOB, interval: float = JOBS_INTERVAL_SECONDS) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            # 多個 worker 各有一個 loop；別的 worker 剛跑完就不重跑（需要共用快取後端）
+            last = get_cache().get("jobs", f"last_finished:{name}")
+            if last is not None and time.time() - last < interval * 0.5:
+                continue
+            try:
+                self.trigger(name, trigger="schedule")
+            except JobAlreadyRunning:
+                log_event("job_skipped", job=name, reason="already_running")
+            except Exception as e:
+                print(f"⚠️ 排程觸發 {name} 失敗：{e}")
+
+
+scheduler = JobScheduler()
+scheduler.register("auto_tag", job_auto_tag)
+scheduler.register("sync", job_sync)
+scheduler.register("refresh", job_refresh)
+scheduler.register("case_store", job_case_store)
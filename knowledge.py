@@ -0,0 +1,121 @@
+# knowledge.py
+# reason / law 知識快取：同一個 tag + trigger word + 產業，Step 3 每次產生的
+# reason / law 幾乎一樣（「甩油 / 燃脂瘦身 / Food → 食品安全衛生管理法第28條」）。
+#
+# - Step 3 成功回來、通過檢查的 (tag, trigger word) 才存；key 含正規化後的 trigger word 與產業
+# - 下次 Step 3 只問快取裡沒有的組合，prompt / 輸出都變短；全部都有就完全不呼叫
+# - 快取命中的組合，reference_cases 直接用這次檢索到的第一筆案例
+# - KNOWLEDGE_VERSION 或 Step 3 prompt / model 一改，舊資料自動失效；另有 KNOWLEDGE_TTL 到期
+
+import os
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from cache import get_cache, make_key
+from metrics import Counter
+
+load_dotenv()
+
+KNOWLEDGE_CACHE_ENABLED = os.getenv("KNOWLEDGE_CACHE_ENABLED", "1") == "1"
+KNOWLEDGE_VERSION = os.getenv("KNOWLEDGE_VERSION", "1")
+KNOWLEDGE_TTL = float(os.getenv("KNOWLEDGE_TTL", str(7 * 86400)))
+KNOWLEDGE_MAX_REASON_CHARS = int(os.getenv("KNOWLEDGE_MAX_REASON_CHARS", "400"))
+
+KNOWLEDGE_STORES = Counter(
+    "lawpatrol_knowledge_stores_total", "Step 3 reason/law entries offered to the knowledge cache", ["result"]
+)
+
+Pair = Tuple[str, str]
+
+
+def normalize_trigger(word: str) -> str:
+    """全形 / 半形、大小寫、前後空白都視為同一個詞。"""
+    return unicodedata.normalize("NFKC", word or "").strip().lower()
+
+
+def knowledge_key(version: str, tag: str, word: str, industry: Optional[str]) -> str:
+    return make_key(version, tag, normalize_trigger(word), industry or "Unknown")
+
+
+def is_valid_entry(item: Dict[str, Any]) -> bool:
+    reason = (item.get("reason") or "").strip()
+    law = (item.get("law") or "").strip()
+    return bool(reason and law) and len(reason) <= KNOWLEDGE_MAX_REASON_CHARS
+
+
+# ==========================================
+# 查詢 / 寫入
+# ==========================================
+def lookup(
+    version: str,
+    pairs: List[Pair],
+    industry: Optional[str],
+) -> Dict[Pair, Dict[str, str]]:
+    """回傳快取裡有的 (tag, trigger word) → {reason, law}。"""
+    if not KNOWLEDGE_CACHE_ENABLED:
+        return {}
+    cache = get_cache()
+    known: Dict[Pair, Dict[str, str]] = {}
+    for tag, word in pairs:
+        entry = cache.get("knowledge", knowledge_key(version, tag, word, industry))
+        if entry is not None:
+            known[(tag, word)] = entry
+    return known
+
+
+def store(
+    version: str,
+    analysis_results: List[Dict[str, Any]],
+    asked: List[Pair],
+    industry: Optional[str],
+) -> int:
+    """只存這次有問到的組合（LLM 自己多生出來的不算），回傳存了幾筆。"""
+    if not KNOWLEDGE_CACHE_ENABLED:
+        return 0
+    asked_set = {(tag, normalize_trigger(word)) for tag, word in asked}
+    cache = get_cache()
+    stored = 0
+    for item in analysis_results:
+        tag, word = item.get("tag") or "", item.get("trigger_word") or ""
+        if (tag, normalize_trigger(word)) not in asked_set:
+            KNOWLEDGE_STORES.inc(result="unrequested")
+            continue
+        if not is_valid_entry(item):
+            KNOWLEDGE_STORES.inc(result="invalid")
+            continue
+        cache.set(
+            "knowledge",
+            knowledge_key(version, tag, word, industry),
+            {"reason": item["reason"].strip(), "law": item["law"].strip()},
+            ttl=KNOWLEDGE_TTL,
+        )
+        KNOWLEDGE_STORES.inc(result="stored")
+        stored += 1
+    return stored
+
+
+def known_analysis(
+    known: Dict[Pair, Dict[str, str]],
+    vector_results: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """快取命中的組合組成 analysis_results（格式跟 Step 3 回傳一樣）。"""
+    top_case = {
+        item.get("tag"): (item.get("cases") or [None])[0]
+        for item in vector_results
+    }
+    results = []
+    for (tag, word), entry in known.items():
+        case = top_case.get(tag)
+        results.append({
+            "trigger_word": word,
+            "tag": tag,
+            "reason": entry["reason"],
+            "law": entry["law"],
+            "reference_cases": (
+                [{"product_name": case.get("product_name"), "date": case.get("date", "")}]
+                if case else []
+            ),
+        })
+    return results
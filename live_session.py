@@ -0,0 +1,319 @@
+# live_session.py
+# WebSocket 即時檢查（/ws/live_check）：Google Docs 側邊欄原本每次改字就 POST 一次全文，
+# 每個 request 都重付 CORS / 握手，而且舊文字的檢測在新文字到了之後還會繼續跑完。
+#
+# 一條連線一個 LiveSession：
+# - client 送整段文字（text）或局部修改（edit），server 端維護目前的文件內容
+# - 停止輸入 LIVE_DEBOUNCE_MS 之後才開始檢測；新的修改一到，還在跑的舊檢測直接取消
+# - 文件切成段落，每段的結果在 session 內快取，只重跑有改動的段落（各階段另有全域快取）
+# - 准入控制一次檢測只排一次（不是每段一次），開一份幾十段的文件不會把使用者的 token 一次用光
+# - 檢測完只推送跟上次相比新增 / 消失的 highlight
+#
+# 協定（JSON）：
+#   client → server
+#     {"type": "hello", "user_id": "...", "mode": "fast"}       （可省略；mode 預設 fast）
+#     {"type": "text", "seq": 1, "text": "全文"}
+#     {"type": "edit", "seq": 2, "start": 10, "end": 12, "text": "替換內容"}
+#     {"type": "mode", "mode": "full"}                            （之後的檢測改用這個模式）
+#   server → client
+#     {"type": "update", "seq": 2, "category", "risk", "partial", "timed_out_stages", "mode",
+#      "suggestions": [{"start", "end", "suggestion_id"}], "added": [highlight...], "removed": [id...]}
+#     {"type": "resync", "seq": 2, "detail": "..."}   edit 範圍對不上，請 client 重送整段 text
+#     {"type": "error", "seq": 2, "status": 429, "detail": "...", "retry_after": 3}
+
+import os
+import re
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from admission import Overloaded
+from database import calculate_combined_risk
+from metrics import Counter, Gauge, log_event
+
+load_dotenv()
+
+LIVE_DEBOUNCE_MS = float(os.getenv("LIVE_DEBOUNCE_MS", "400"))
+LIVE_MAX_TEXT_CHARS = int(os.getenv("LIVE_MAX_TEXT_CHARS", "20000"))
+LIVE_SESSION_CACHE_SIZE = int(os.getenv("LIVE_SESSION_CACHE_SIZE", "128"))
+LIVE_MAX_PARALLEL = int(os.getenv("LIVE_MAX_PARALLEL", "4"))
+LIVE_DEFAULT_MODE = os.getenv("LIVE_DEFAULT_MODE", "fast")
+
+LIVE_SESSIONS = Gauge("lawpatrol_live_sessions", "Open live-check WebSocket sessions")
+LIVE_RUNS = Counter("lawpatrol_live_runs_total", "Live-check pipeline runs by result", ["result"])
+LIVE_PARAGRAPHS = Counter(
+    "lawpatrol_live_paragraphs_total", "Paragraphs per live-check run, checked vs reused", ["result"]
+)
+
+MODES = ("fast", "standard", "full")
+
+# (段落文字, mode) -> _run_check 的結果（positions 是段落內的相對位置）
+CheckFn = Callable[[str, str], Awaitable[Dict[str, Any]]]
+# (全文, mode) -> 整次檢測的准入；進不去時丟 Overloaded
+AdmitFn = Callable[[str, str], AsyncContextManager[Any]]
+
+_PARAGRAPH = re.compile(r"[^\n]+")
+
+
+def split_paragraphs(text: str) -> List[Tuple[int, str]]:
+    """回傳 (起始位置, 段落文字)，空白段落略過。"""
+    return [(m.start(), m.group()) for m in _PARAGRAPH.finditer(text) if m.group().strip()]
+
+
+def highlight_items(groups: List[Dict[str, Any]], offset: int) -> List[Dict[str, Any]]:
+    """
+    groups（main.collect_highlight_groups 的格式）攤平成絕對位置的 highlight。
+    原文找不到位置（-1）的畫不出來，即時模式直接略過。
+    """
+    items = []
+    for group in groups:
+        for pos in group["positions"]:
+            if pos.get("start", -1) < 0:
+                continue
+            start, end = pos["start"] + offset, pos["end"] + offset
+            items.append({
+                "id": f"{group['tag']}|{group['trigger_word']}|{start}|{end}",
+                "tag_name": group["tag"],
+                "tag_risk": group["tag_risk"],
+                "trigger_words": group["trigger_word"],
+                "start_index": start,
+                "end_index": end,
+                "reason": group["reason"],
+                "law": group["law"],
+                "cases": group["cases"],
+            })
+    return items
+
+
+class LiveSession:
+    def __init__(
+        self,
+        websocket,
+        check: CheckFn,
+        admit: Optional[AdmitFn] = None,
+        mode: str = LIVE_DEFAULT_MODE,
+    ):
+        self.ws = websocket
+        self.check = check
+        self.admit = admit or (lambda text, mode: nullcontext())
+        self.mode = mode if mode in MODES else "fast"
+        self.user_id: Optional[str] = None
+
+        self.text = ""
+        self.seq = 0
+        self._checked: Optional[Tuple[str, str]] = None  # 上次推送的 (text, mode)
+        self._highlights: Dict[str, Dict[str, Any]] = {}
+        self._paragraphs: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+
+        self._debounce: Optional[asyncio.Task] = None
+        self._run: Optional[asyncio.Task] = None
+        self._send_lock = asyncio.Lock()
+
+    # ---------- 連線 ----------
+    async def serve(self) -> None:
+        from fastapi import WebSocketDisconnect
+
+        LIVE_SESSIONS.inc()
+        log_event("live_session_opened")
+        try:
+            while True:
+                raw = await self.ws.receive_text()
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    await self.send({"type": "error", "status": 400, "detail": "invalid JSON"})
+                    continue
+                await self.handle(message)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._cancel(self._debounce)
+            self._cancel(self._run)
+            LIVE_SESSIONS.dec()
+            log_event("live_session_closed", seq=self.seq)
+
+    async def send(self, payload: Dict[str, Any]) -> None:
+        async with self._send_lock:
+            await self.ws.send_text(json.dumps(payload, ensure_ascii=False))
+
+    @staticmethod
+    def _cancel(task: Optional[asyncio.Task]) -> None:
+        if task is not None and not task.done():
+            task.cancel()
+
+    # ---------- 訊息 ----------
+    async def handle(self, message: Any) -> None:
+        if not isinstance(message, dict):
+            await self.send({"type": "error", "status": 400, "detail": "message must be a JSON object"})
+            return
+        kind = message.get("type")
+        mode = message.get("mode")
+        if kind in ("hello", "mode") and mode is not None and mode not in MODES:
+            await self.send({"type": "error", "status": 400, "detail": f"unknown mode: {mode}"})
+            return
+        if kind == "hello":
+            self.user_id = message.get("user_id") or self.user_id
+            self._set_mode(mode)
+            return
+        if kind == "mode":
+            if self._set_mode(mode):
+                self._schedule()
+            return
+
+        if kind not in ("text", "edit"):
+            await self.send({"type": "error", "status": 400, "detail": f"unknown message type: {kind}"})
+            return
+
+        try:
+            seq = int(message.get("seq") or self.seq + 1)
+        except (TypeError, ValueError):
+            await self.send({"type": "error", "status": 400, "detail": "seq must be an integer"})
+            return
+        if not isinstance(message.get("text") or "", str):
+            await self.send({"type": "error", "seq": seq, "status": 400, "detail": "text must be a string"})
+            return
+        if kind == "text":
+            text = message.get("text") or ""
+        else:
+            start, end = message.get("start"), message.get("end")
+            if not (isinstance(start, int) and isinstance(end, int) and 0 <= start <= end <= len(self.text)):
+                await self.send({"type": "resync", "seq": seq, "detail": "edit out of range"})
+                return
+            text = self.text[:start] + (message.get("text") or "") + self.text[end:]
+
+        if len(text) > LIVE_MAX_TEXT_CHARS:
+            await self.send({"type": "error", "seq": seq, "status": 413, "detail": "text too long"})
+            return
+
+        self.text, self.seq = text, seq
+        # 還在跑的是舊文字，結果已經沒用了
+        if self._run is not None and not self._run.done():
+            self._run.cancel()
+            LIVE_RUNS.inc(result="superseded")
+        self._schedule()
+
+    def _set_mode(self, mode: Optional[str]) -> bool:
+        if mode in MODES and mode != self.mode:
+            self.mode = mode
+            return True
+        return False
+
+    def _schedule(self) -> None:
+        self._cancel(self._debounce)
+        self._debounce = asyncio.create_task(self._debounced())
+
+    async def _debounced(self) -> None:
+        await asyncio.sleep(LIVE_DEBOUNCE_MS / 1000)
+        if (self.text, self.mode) == self._checked:
+            return
+        self._cancel(self._run)
+        self._run = asyncio.create_task(self._check(self.text, self.seq, self.mode))
+
+    # ---------- 檢測 ----------
+    async def _check_paragraph(self, paragraph: str, mode: str, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        key = (paragraph, mode)
+        cached = self._paragraphs.get(key)
+        if cached is not None:
+            self._paragraphs.move_to_end(key)
+            LIVE_PARAGRAPHS.inc(result="reused")
+            return cached
+
+        async with semaphore:
+            result = await self.check(paragraph, mode)
+        LIVE_PARAGRAPHS.inc(result="checked")
+        # 部分結果（超時）不留，下次再跑一次
+        if not result.get("partial"):
+            self._paragraphs[key] = result
+            while len(self._paragraphs) > LIVE_SESSION_CACHE_SIZE:
+                self._paragraphs.popitem(last=False)
+        return result
+
+    async def _check(self, text: str, seq: int, mode: str) -> None:
+        started = time.perf_counter()
+        paragraphs = split_paragraphs(text)
+        semaphore = asyncio.Semaphore(LIVE_MAX_PARALLEL)
+        # 全部段落都在 session 快取裡就不用排隊
+        pending = any((p, mode) not in self._paragraphs for _, p in paragraphs)
+        try:
+            async with (self.admit(text, mode) if pending else nullcontext()):
+                tasks = [
+                    asyncio.ensure_future(self._check_paragraph(p, mode, semaphore))
+                    for _, p in paragraphs
+                ]
+                try:
+                    results = await asyncio.gather(*tasks)
+                except BaseException:
+                    # 一段失敗（或這次檢測被取消）其他段也不用跑了
+                    for task in tasks:
+                        task.cancel()
+                    raise
+        except Overloaded as e:
+            LIVE_RUNS.inc(result="shed")
+            await self.send({
+                "type": "error", "seq": seq, "status": 429,
+                "detail": f"Server busy ({e.reason})", "retry_after": e.retry_after_header,
+            })
+            return
+        except Exception as e:
+            print(f"❌ 即時檢查失敗: {e}")
+            LIVE_RUNS.inc(result="error")
+            await self.send({"type": "error", "seq": seq, "status": 500, "detail": "Internal AI logic error"})
+            return
+
+        highlights: Dict[str, Dict[str, Any]] = {}
+        suggestions = []
+        tag_names: List[str] = []
+        categories: List[str] = []
+        timed_out: List[str] = []
+        for (offset, paragraph), result in zip(paragraphs, results):
+            for item in highlight_items(result["groups"], offset):
+                highlights[item["id"]] = item
+            if result.get("suggestion_id"):
+                suggestions.append({
+                    "start": offset,
+                    "end": offset + len(paragraph),
+                    "suggestion_id": result["suggestion_id"],
+                })
+            tag_names.extend(t for t in result["tag_names"] if t not in tag_names)
+            if result["category"] != "Unknown":
+                categories.append(result["category"])
+            timed_out.extend(s for s in result["timed_out_stages"] if s not in timed_out)
+
+        risk = 0.0
+        if tag_names:
+            try:
+                risk = float(await asyncio.to_thread(calculate_combined_risk, tag_names))
+            except Exception as e:
+                print(f"⚠️ 計算風險分數時發生錯誤: {e}")
+
+        added = [item for hid, item in highlights.items() if hid not in self._highlights]
+        removed = [hid for hid in self._highlights if hid not in highlights]
+        self._highlights = highlights
+        self._checked = (text, mode)
+
+        await self.send({
+            "type": "update",
+            "seq": seq,
+            "mode": mode,
+            "category": max(set(categories), key=categories.count) if categories else "Unknown",
+            "risk": risk,
+            "partial": any(r.get("partial") for r in results),
+            "timed_out_stages": timed_out,
+            "suggestions": suggestions,
+            "added": added,
+            "removed": removed,
+        })
+        LIVE_RUNS.inc(result="completed")
+        log_event(
+            "live_check_completed",
+            seq=seq,
+            paragraphs=len(paragraphs),
+            added=len(added),
+            removed=len(removed),
+            seconds=round(time.perf_counter() - started, 3),
+        )
@@ -1,54 +1,186 @@
 import os
 import json
+import time
 import asyncio
-from typing import List, Dict, Any, Optional
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Dict, Any, Optional, Tuple
 
-import google.generativeai as genai
 from dotenv import load_dotenv
 
+from cache import get_cache, make_key, register_data_namespace
+from metrics import stage, record_fallback, log_event, HEDGED_CALLS
+from partitions import PINECONE_NAMESPACE_LAYOUT
+from pgvector_store import VECTOR_BACKEND
+
 # 引入 Prompt
 from prompts import STEP1_PROMPT_TEMPLATE, STEP3_PROMPT_TEMPLATE, get_formatted_tags_prompt
+from tag_classifier import STEP1_CLASSIFIER_ENABLED, classify_text, lexicon
+import knowledge
 
 # 引入資料庫向量搜尋與 TAG_MAPPING
 try:
-    from database import search_vector_cases, TAG_MAPPING
+    import database
+    from database import search_vector_cases, TAG_MAPPING, get_genai
+    from retrieval_client import retrieval_client
 except ImportError:
     print("⚠️ 警告: 無法引入 database.py，將使用 Mock DB 模式")
+    database = None
     search_vector_cases = None
+    retrieval_client = None
+    get_genai = None
     TAG_MAPPING: Dict[str, str] = {}
 
 # 1. 載入環境變數
 load_dotenv()
 api_key = os.getenv("GOOGLE_API_KEY")
 
-# 2. 設定 Gemini
-if api_key:
-    genai.configure(api_key=api_key)
-else:
+MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash")
+STEP1_CACHE_TTL = float(os.getenv("STEP1_CACHE_TTL", "3600"))
+# 同一段文字 + tag 的檢索結果；案件資料更新時跟著 invalidate_data_caches 一起清
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+register_data_namespace("retrieval")
+
+# 檢測模式：越後面跑越多階段，前面的階段結果都有快取，
+# 同一段文字先 fast 再 full 只會補跑缺的檢索 / Step 3
+#   fast      Step 1（產業、tag、trigger words）就回傳
+#   standard  再加向量檢索（每個 tag 附最相近的案例）
+#   full      再加 Step 3（原因、法條、整段改寫）
+CHECK_MODES = ("fast", "standard", "full")
+
+# Step 1 hedging：超過歷史延遲的這個百分位還沒回來，就再送一個一樣的請求（0 = 關閉）
+STEP1_HEDGE_PERCENTILE = float(os.getenv("STEP1_HEDGE_PERCENTILE", "0.95"))
+STEP1_HEDGE_MIN_SAMPLES = int(os.getenv("STEP1_HEDGE_MIN_SAMPLES", "20"))
+
+if not api_key:
     print("⚠️ 警告: 找不到 GOOGLE_API_KEY")
 
-# 初始化模型 (使用 2.5 Flash 以求速度與準確平衡)
-try:
-    model = genai.GenerativeModel(
-        model_name="gemini-2.5-flash",
-        generation_config={"response_mime_type": "application/json"}
-    )
-except Exception as e:
-    model = None
-    print(f"⚠️ 模型初始化失敗: {e}")
+# 2. Gemini 模型改成第一次用到才建立 (使用 2.5 Flash 以求速度與準確平衡)
+_model = None
+_model_tried = False
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """回傳共用的 GenerativeModel；沒有 API key 或初始化失敗時回傳 None。"""
+    global _model, _model_tried
+
+    if _model_tried:
+        return _model
+
+    with _model_lock:
+        if _model_tried:
+            return _model
+
+        genai = get_genai() if get_genai else None
+        if genai is not None:
+            try:
+                _model = genai.GenerativeModel(
+                    model_name=MODEL_NAME,
+                    generation_config={"response_mime_type": "application/json"}
+                )
+            except Exception as e:
+                _model = None
+                print(f"⚠️ 模型初始化失敗: {e}")
+        _model_tried = True
+
+    return _model
+
+# ==========================================
+# Deadline / Hedging 小工具
+# ==========================================
+_step1_latencies: Deque[float] = deque(maxlen=500)
+
+
+def remaining_seconds(deadline: Optional[float]) -> Optional[float]:
+    """deadline 是 time.monotonic() 的絕對時間；None 代表不限時。"""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+async def run_with_deadline(coro: Awaitable, deadline: Optional[float]):
+    """在 deadline 之前跑完 coro，否則取消它並丟出 asyncio.TimeoutError。"""
+    remaining = remaining_seconds(deadline)
+    if remaining is None:
+        return await coro
+    if remaining <= 0:
+        coro.close()
+        raise asyncio.TimeoutError()
+    return await asyncio.wait_for(coro, remaining)
+
+
+def step1_hedge_delay() -> Optional[float]:
+    """取最近 Step 1 延遲的百分位當 hedge 延遲；樣本不夠或關閉時回傳 None。"""
+    if STEP1_HEDGE_PERCENTILE <= 0 or len(_step1_latencies) < STEP1_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(_step1_latencies)
+    idx = min(len(ordered) - 1, int(len(ordered) * STEP1_HEDGE_PERCENTILE))
+    return ordered[idx]
+
+
+async def hedged(factory: Callable[[], Awaitable], delay: Optional[float], stage_name: str):
+    """
+    先送一個請求；delay 秒內沒回來就再送一個一樣的，先成功的那個勝出，其他的取消。
+    全部都失敗時丟出最後一個錯誤。
+    """
+    if delay is None:
+        return await factory()
+
+    first = asyncio.ensure_future(factory())
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            HEDGED_CALLS.inc(stage=stage_name, result="fired")
+            tasks.append(asyncio.ensure_future(factory()))
+
+        while True:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            failed = None
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        HEDGED_CALLS.inc(stage=stage_name, result="won")
+                    return task.result()
+                failed = task
+            tasks = list(pending)
+            if not tasks:
+                return failed.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
 
 # ==========================================
 # Step 1: 辨識標籤 (Async)
 # ==========================================
-async def identify_tags_async(text: str) -> Dict[str, Any]:
+async def identify_tags_async(text: str, deadline: Optional[float] = None) -> Dict[str, Any]:
     """
     呼叫 Gemini：
     - 判斷產業 (industry)
     - 找出 identified_tags: [{ "tag": "...", "trigger_words": [...] }, ...]
+    超過 deadline 會丟出 asyncio.TimeoutError，由呼叫端決定怎麼回傳部分結果。
     """
+    model = get_model()
     if not model:
+        record_fallback("step1", "no_model")
         return {"industry": "Unknown", "identified_tags": []}
 
+    # 同一段文字 + 同一個模型 / prompt → 直接用快取（跨 worker 共用）
+    cache = get_cache()
+    cache_key = make_key(MODEL_NAME, STEP1_PROMPT_TEMPLATE, text)
+    cached = cache.get("step1", cache_key)
+    if cached is not None:
+        return cached
+
+    # 快速路徑：embedding 原型分類器有把握就不呼叫 LLM（沒把握回 None）
+    if STEP1_CLASSIFIER_ENABLED:
+        fast = await run_with_deadline(asyncio.to_thread(classify_text, text), deadline)
+        if fast is not None:
+            return fast
+
     try:
         # 動態生成 Tag 分類說明字串 (要跟 TAG_MAPPING 一致)
         tags_context = get_formatted_tags_prompt()
@@ -58,12 +190,28 @@ async def identify_tags_async(text: str) -> Dict[str, Any]:
             user_text=text
         )
 
-        response = await model.generate_content_async(prompt)
-        return json.loads(response.text)
+        async def call_step1():
+            started = time.perf_counter()
+            response = await model.generate_content_async(prompt)
+            _step1_latencies.append(time.perf_counter() - started)
+            return json.loads(response.text)
+
+        with stage("step1"):
+            result = await run_with_deadline(
+                hedged(call_step1, step1_hedge_delay(), "step1"), deadline
+            )
+    except asyncio.TimeoutError:
+        raise
     except Exception as e:
         print(f"❌ Step 1 Error: {e}")
+        record_fallback("step1", "llm_error")
         return {"industry": "Unknown", "identified_tags": []}
 
+    cache.set("step1", cache_key, result, ttl=STEP1_CACHE_TTL)
+    # LLM 找到的觸發詞加進 lexicon，分類器之後標位置用
+    lexicon.learn(result, text)
+    return result
+
 # ==========================================
 # Step 2: 向量搜尋 (Async Wrapper)
 # ==========================================
@@ -73,9 +221,23 @@ async def search_db_async(user_text: str, tag: str, industry: Optional[str] = No
     - 多帶一個 industry，讓向量搜尋可以限定產業
     - 若 database 尚未實作，則使用 Mock 資料
     """
-    if search_vector_cases:
-        # 呼叫真正的向量資料庫搜尋 (在 thread pool 執行，避免阻塞 event loop)
-        return await asyncio.to_thread(search_vector_cases, user_text, tag, industry)
+    if retrieval_client:
+        # fast -> standard / full 升級時同一段文字不用再查一次
+        cache = get_cache()
+        # 每次呼叫時才讀 top_k（執行中可以改），查詢跟快取 key 用同一個值
+        top_k = database.VECTOR_TOP_K
+        # 換檢索後端（pinecone / pgvector）時不能拿到另一邊的結果
+        cache_key = make_key(user_text, tag, industry, top_k, VECTOR_BACKEND, PINECONE_NAMESPACE_LAYOUT)
+        cached = cache.get("retrieval", cache_key)
+        if cached is not None:
+            return cached
+
+        # 呼叫真正的向量資料庫搜尋（檢索專用的 executor，有自己的逾時與佇列指標）
+        cases = await retrieval_client.search(user_text, tag, industry, top_k=top_k)
+        # 空結果可能是逾時 / 查詢失敗，不快取
+        if cases:
+            cache.set("retrieval", cache_key, cases, ttl=RETRIEVAL_CACHE_TTL)
+        return cases
     else:
         # Mock 模式 (database.py 尚未完成時用來測試流程)
         await asyncio.sleep(0.1)
@@ -93,18 +255,71 @@ async def search_db_async(user_text: str, tag: str, industry: Optional[str] = No
 # ==========================================
 # Step 3: 生成建議 (Async)
 # ==========================================
+def knowledge_version() -> str:
+    """換 model / Step 3 prompt / KNOWLEDGE_VERSION，知識快取就整批失效。"""
+    return make_key(knowledge.KNOWLEDGE_VERSION, MODEL_NAME, STEP3_PROMPT_TEMPLATE)[:16]
+
+
+def trigger_pairs(step1_result: Dict[str, Any]) -> List[Tuple[str, str]]:
+    return [
+        (item.get("tag"), word)
+        for item in step1_result.get("identified_tags", []) or []
+        if item.get("tag")
+        for word in item.get("trigger_words", []) or []
+        if word
+    ]
+
+
+def order_analysis(results: List[Dict[str, Any]], pairs: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """依 Step 1 的順序排（快取的跟新產生的混在一起時順序才固定）。"""
+    position = {(tag, knowledge.normalize_trigger(word)): i for i, (tag, word) in enumerate(pairs)}
+    return sorted(
+        results,
+        key=lambda a: position.get(
+            (a.get("tag"), knowledge.normalize_trigger(a.get("trigger_word") or "")), len(pairs)
+        ),
+    )
+
+
 async def generate_analysis_async(
     user_text: str,
     step1_result: Dict[str, Any],
-    vector_results: List[Dict[str, Any]]
+    vector_results: List[Dict[str, Any]],
+    deadline: Optional[float] = None,
 ) -> Dict[str, Any]:
     """
     呼叫第二次 Gemini：
     - Input: 原始文案 + Step1 判斷 + 向量查詢結果
-    - Output: analysis_results（每個違規字的原因＋建議＋參考案例）
+    - Output: analysis_results（每個違規字的原因＋法條＋參考案例）
+    知識快取裡已經有的 (tag, trigger word) 不再問；全部都有就不呼叫。
     """
+    industry = step1_result.get("industry")
+    pairs = trigger_pairs(step1_result)
+    version = knowledge_version()
+    known = knowledge.lookup(version, pairs, industry)
+    cached_results = knowledge.known_analysis(known, vector_results)
+    missing = [pair for pair in pairs if pair not in known]
+
+    if pairs and not missing:
+        log_event("step3_skipped", reason="knowledge_cache", pairs=len(pairs))
+        return {"analysis_results": order_analysis(cached_results, pairs)}
+
+    model = get_model()
     if not model:
-        return {"analysis_results": []}
+        record_fallback("step3", "no_model")
+        return {"analysis_results": cached_results}
+
+    # 只問快取沒有的組合，案例也只帶這些 tag 的
+    if known:
+        missing_tags = list(dict.fromkeys(tag for tag, _ in missing))
+        step1_result = {
+            "industry": industry,
+            "identified_tags": [
+                {"tag": tag, "trigger_words": [w for t, w in missing if t == tag]}
+                for tag in missing_tags
+            ],
+        }
+        vector_results = [v for v in vector_results if v.get("tag") in missing_tags]
 
     try:
         vector_results_str = json.dumps(vector_results, ensure_ascii=False)
@@ -116,11 +331,38 @@ async def generate_analysis_async(
             vector_results=vector_results_str
         )
 
-        response = await model.generate_content_async(prompt)
-        return json.loads(response.text)
+        with stage("step3", pairs=len(missing), known=len(known)):
+            response = await run_with_deadline(model.generate_content_async(prompt), deadline)
+            result = json.loads(response.text)
+    except asyncio.TimeoutError:
+        raise
     except Exception as e:
         print(f"❌ Step 3 Error: {e}")
-        return {"analysis_results": []}
+        record_fallback("step3", "llm_error")
+        return {"analysis_results": cached_results}
+
+    fresh = result.get("analysis_results", []) or []
+    knowledge.store(version, fresh, missing, industry)
+    # LLM 偶爾會把沒問的組合也答一遍，以快取版本為準
+    known_keys = {(tag, knowledge.normalize_trigger(word)) for tag, word in known}
+    fresh = [
+        a for a in fresh
+        if (a.get("tag"), knowledge.normalize_trigger(a.get("trigger_word") or "")) not in known_keys
+    ]
+    result["analysis_results"] = order_analysis(fresh + cached_results, pairs)
+    return result
+
+
+def fill_from_knowledge(final_analysis: Dict[str, Any], industry: Optional[str]) -> Dict[str, Any]:
+    """Step 3 來不及跑完時，reason / law 先用知識快取裡有的補上。"""
+    results = final_analysis.get("analysis_results", []) or []
+    pairs = [(a.get("tag"), a.get("trigger_word")) for a in results]
+    known = knowledge.lookup(knowledge_version(), pairs, industry)
+    for item, pair in zip(results, pairs):
+        entry = known.get(pair)
+        if entry and not item.get("reason"):
+            item["reason"], item["law"] = entry["reason"], entry["law"]
+    return final_analysis
 
 # ==========================================
 # Main Logic Orchestrator (給 Role A 呼叫的入口)
@@ -134,11 +376,60 @@ def process_compliance_check(user_text: str) -> Dict[str, Any]:
     return asyncio.run(process_compliance_check_async(user_text))
 
 
-async def process_compliance_check_async(user_text: str) -> Dict[str, Any]:
+def build_partial_analysis(
+    step1_output: Dict[str, Any],
+    vector_search_results: List[Dict[str, Any]],
+    cases_per_tag: Optional[int] = 1,
+) -> Dict[str, Any]:
+    """
+    Step 3 來不及跑完（或 fast / standard 模式不跑）時的部分結果：
+    直接用 Step 1 的 trigger words + 每個 tag 檢索到的前 cases_per_tag 筆案例
+    （None = 全部），reason / law 留空。
+    """
+    top_cases = {
+        item.get("tag"): (item.get("cases") or [])[:cases_per_tag]
+        for item in vector_search_results
+    }
+    analysis_results = []
+    for item in step1_output.get("identified_tags", []):
+        tag = item.get("tag")
+        cases = top_cases.get(tag, [])
+        for word in item.get("trigger_words", []) or []:
+            analysis_results.append({
+                "trigger_word": word,
+                "tag": tag,
+                "reason": "",
+                "law": "",
+                "reference_cases": [
+                    {"product_name": case.get("product_name"), "date": case.get("date", "")}
+                    for case in cases
+                ],
+            })
+    return {"analysis_results": analysis_results}
+
+
+async def process_compliance_check_async(
+    user_text: str,
+    deadline: Optional[float] = None,
+    mode: str = "full",
+) -> Dict[str, Any]:
+    """
+    deadline：time.monotonic() 的絕對時間。任何一個階段超過 deadline 就停在那裡，
+    回傳目前為止的結果，並在 partial / timed_out_stages 標記出來。
+    mode：fast / standard / full（見 CHECK_MODES），決定跑到哪個階段為止。
+    """
     print(f"\n🚀 [AI Logic] 開始分析: {user_text[:20]}...")
+    timed_out_stages: List[str] = []
 
     # 1. Step 1: 找產業 + Tag + Trigger Words
-    step1_output = await identify_tags_async(user_text)
+    # 複製一份再改，避免改到快取裡的物件
+    try:
+        step1_output = dict(await identify_tags_async(user_text, deadline=deadline))
+    except asyncio.TimeoutError:
+        print("⏰ [AI Logic] Step 1 超過 deadline")
+        record_fallback("deadline", "step1")
+        timed_out_stages.append("step1")
+        step1_output = {"industry": "Unknown", "identified_tags": []}
 
     # --- 安全閥：過濾掉「不在 TAG_MAPPING 裡的標籤」 ---
     raw_tags = step1_output.get("identified_tags", [])
@@ -165,17 +456,42 @@ async def process_compliance_check_async(user_text: str) -> Dict[str, Any]:
     tasks = []
     tags_found = step1_output.get("identified_tags", [])
 
+    if mode == "fast":
+        # 只要 trigger words 的位置：不檢索、不跑 Step 3
+        print("✅ [AI Logic] fast 模式完成")
+        return {
+            "step1_output": step1_output,
+            "vector_search_results": [],
+            "final_analysis": build_partial_analysis(step1_output, []),
+            "partial": bool(timed_out_stages),
+            "timed_out_stages": timed_out_stages,
+            "mode": mode,
+        }
+
     for item in tags_found:
         tag = item.get("tag")
         if not tag:
             continue
         # 建立查詢任務，帶入 industry
-        tasks.append(search_db_async(user_text, tag, industry))
+        tasks.append(asyncio.ensure_future(search_db_async(user_text, tag, industry)))
 
+    db_results_list = []
     if tasks:
-        db_results_list = await asyncio.gather(*tasks)
-    else:
-        db_results_list = []
+        try:
+            with stage("retrieval", tags=len(tasks)):
+                done, pending = await asyncio.wait(tasks, timeout=remaining_seconds(deadline))
+        finally:
+            # 被取消（client 斷線）或超時：還沒回來的查詢一律取消
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        if pending:
+            print(f"⏰ [AI Logic] 向量搜尋超過 deadline，{len(pending)} 個 tag 沒有案例")
+            record_fallback("deadline", "retrieval")
+            timed_out_stages.append("retrieval")
+
+        db_results_list = [task.result() if task in done else [] for task in tasks]
 
     # 整理結果格式：[
     #   {"tag": "燃脂瘦身", "cases": [...]},
@@ -191,21 +507,37 @@ async def process_compliance_check_async(user_text: str) -> Dict[str, Any]:
         })
 
     # 3. Step 3: 綜合分析（產生違規原因 + 建議）
-    if not vector_search_results:
+    if mode == "standard":
+        # 案例直接用檢索結果，reason / law 留空
+        final_analysis = build_partial_analysis(step1_output, vector_search_results, cases_per_tag=None)
+    elif not vector_search_results:
+        record_fallback("step3", "no_tags")
         final_analysis = {"analysis_results": []}
     else:
-        final_analysis = await generate_analysis_async(
-            user_text=user_text,
-            step1_result=step1_output,
-            vector_results=vector_search_results
-        )
+        try:
+            final_analysis = await generate_analysis_async(
+                user_text=user_text,
+                step1_result=step1_output,
+                vector_results=vector_search_results,
+                deadline=deadline,
+            )
+        except asyncio.TimeoutError:
+            print("⏰ [AI Logic] Step 3 超過 deadline，回傳部分結果")
+            record_fallback("deadline", "step3")
+            timed_out_stages.append("step3")
+            final_analysis = fill_from_knowledge(
+                build_partial_analysis(step1_output, vector_search_results), industry
+            )
 
     print("✅ [AI Logic] 分析完成")
 
     return {
         "step1_output": step1_output,
         "vector_search_results": vector_search_results,
-        "final_analysis": final_analysis
+        "final_analysis": final_analysis,
+        "partial": bool(timed_out_stages),
+        "timed_out_stages": timed_out_stages,
+        "mode": mode,
     }
 
 
@@ -1,13 +1,32 @@
+import time
+
+# 記錄 import 起點，用來量測冷啟動時間
+_IMPORT_STARTED_AT = time.perf_counter()
+
 import os
+import uuid
+import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
 from typing import List, Dict, Any
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 
 # 風險相關
-from database import get_risk_info, calculate_combined_risk
+from database import (
+    get_risk_info,
+    calculate_combined_risk,
+    get_risk_snapshot,
+    warm_db_pool,
+    warm_vector_backend,
+    check_db_pool_size,
+    VECTOR_BACKEND,
+)
+
+from case_store import get_case_store
 
 # Pydantic Schemas
 from schemas import (
@@ -17,30 +36,155 @@ from schemas import (
     HighlightItem,
     HighlightDetails,
     FinalCase,
+    CheckResponseV2,
+    SuggestionResponse,
+    SuggestionData,
+)
+
+# v2 回傳：快速 JSON 編碼 + br / gzip 協商
+from response_encoding import encoded_json_response
+
+# ✨ 載入 async 版本邏輯（長文先切塊；每塊前面擋一層語意近似快取）
+from logic import get_model
+from retrieval_client import retrieval_client
+
+# 流量錄製（給 benchmarks/replay.py 重播）
+from capture import recorder as capture_recorder
+
+# 過載保護：准入控制 + 每個使用者的公平排隊
+from admission import admission, Overloaded, ADMISSION_ENABLED
+
+# 背景工作（auto_tag / sync）
+from jobs import scheduler, JobAlreadyRunning, JOBS_INTERVAL_SECONDS
+from chunking import chunked_compliance_check
+
+# WebSocket 即時檢查（debounce + 取消過期的檢測）
+from live_session import LiveSession, LIVE_DEFAULT_MODE
+
+# 整段改寫：主流程只給 handle，按了才產生
+from suggestion import (
+    SUGGESTION_DEFERRED,
+    SUGGESTION_TIMEOUT_SECONDS,
+    SuggestionError,
+    get_suggestion,
+    has_suggestion,
+    register_suggestion,
+    stream_suggestion,
 )
 
-# ✨ 載入 async 版本邏輯
-from logic import process_compliance_check_async
+from prompts import get_formatted_tags_prompt
 
 # 找出關鍵字在原文中的位置
 from utils import find_text_indices
 
+# 每次檢測的稽核紀錄（背景批次寫入）
+import audit
+from audit import audit_log
+
+# 單一 request 的 profiling（admin 才能開）
+from profiling import ProfilingMiddleware, folded_text, load_profile, recent_profiles
+
+# 指標 / 結構化 log
+from metrics import (
+    stage,
+    record_fallback,
+    log_event,
+    render_prometheus,
+    request_id_var,
+    REQUESTS_TOTAL,
+)
+
 
 # 1. 載入環境變數 (讀取 .env)
 load_dotenv()
 
-# 2. 初始化 FastAPI
+# 每個檢測請求的預設 / 最大時限；預留一點時間給組裝回傳
+CHECK_DEADLINE_SECONDS = float(os.getenv("CHECK_DEADLINE_SECONDS", "25"))
+CHECK_DEADLINE_MAX_SECONDS = float(os.getenv("CHECK_DEADLINE_MAX_SECONDS", "60"))
+DEADLINE_MARGIN_SECONDS = float(os.getenv("DEADLINE_MARGIN_SECONDS", "0.25"))
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.25"))
+
+# 管理用 endpoint 的 token（X-Admin-Token）；沒設定就整組關閉
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# 2. 啟動預熱：背景平行建立 client / 連線池 / 風險快照，不擋住 "/" 的回應
+WARMUP_STATE: Dict[str, Any] = {
+    "ready": False,
+    "import_seconds": None,
+    "warmup_seconds": None,
+    "components": {},
+}
+
+
+async def _warm_component(name: str, func) -> None:
+    started = time.perf_counter()
+    try:
+        result = await asyncio.to_thread(func)
+        ok = result is not None and result is not False
+        error = None
+    except Exception as e:
+        ok = False
+        error = str(e)
+
+    WARMUP_STATE["components"][name] = {
+        "ok": ok,
+        "seconds": round(time.perf_counter() - started, 3),
+        "error": error,
+    }
+
+
+async def warmup() -> None:
+    started = time.perf_counter()
+
+    await asyncio.gather(
+        _warm_component("db_pool", warm_db_pool),
+        _warm_component("risk_snapshot", get_risk_snapshot),
+        _warm_component("prompt_prefix", get_formatted_tags_prompt),
+        _warm_component("gemini_model", get_model),
+        _warm_component(
+            "pgvector" if VECTOR_BACKEND == "pgvector" else "pinecone_index", warm_vector_backend
+        ),
+    )
+
+    WARMUP_STATE["warmup_seconds"] = round(time.perf_counter() - started, 3)
+    WARMUP_STATE["ready"] = True
+    print(f"🔥 預熱完成，耗時 {WARMUP_STATE['warmup_seconds']}s：{WARMUP_STATE['components']}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 連線池比檢索 worker 還小時，寧可不啟動也不要在負載下默默回空結果
+    check_db_pool_size()
+    warmup_task = asyncio.create_task(warmup())
+    schedule_task = (
+        asyncio.create_task(scheduler.run_forever()) if JOBS_INTERVAL_SECONDS > 0 else None
+    )
+    yield
+    if not warmup_task.done():
+        warmup_task.cancel()
+    if schedule_task is not None:
+        schedule_task.cancel()
+    retrieval_client.shutdown()
+    # 佇列裡還沒寫進 DB 的稽核紀錄，最多等 AUDIT_DRAIN_SECONDS
+    await asyncio.to_thread(audit_log.close)
+
+
+# 3. 初始化 FastAPI
 app = FastAPI(
     title="Ad Compliance Checker API",
     description="檢測食品與醫療廣告違規用語的後端 API",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
-# 3. 設定 CORS (跨來源資源共用)
+# 4. 設定 CORS (跨來源資源共用)
 origins = [
     "*",  # 目前先全部允許，之後上線可以鎖定網域
 ]
 
+# 單一 request 的 profiling（x-profile: 1 + admin token；見 profiling.py）
+app.add_middleware(ProfilingMiddleware, admin_token=ADMIN_TOKEN)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -56,54 +200,85 @@ def read_root():
     return {"status": "running", "message": "Ad Compliance API is ready!"}
 
 
-@app.post("/api/check_compliance", response_model=CheckResponse)
-async def check_compliance(request: CheckRequest):
+@app.get("/ready")
+def read_ready():
     """
-    接收前端文字 -> 跑 LLM + 向量搜尋 -> 計算風險分數 -> 組成前端需要的回傳格式
+    Readiness：process 活著不代表依賴都暖好了。
+    預熱完成且所有元件都成功才回 200，否則回 503（附上各元件狀態與耗時）。
     """
-    user_text = request.selected_text
+    components = WARMUP_STATE["components"]
+    all_ok = WARMUP_STATE["ready"] and all(c["ok"] for c in components.values())
+
+    return JSONResponse(
+        status_code=200 if all_ok else 503,
+        content={
+            "status": "ready" if all_ok else "warming" if not WARMUP_STATE["ready"] else "degraded",
+            **WARMUP_STATE,
+        },
+    )
 
-    if not user_text or not user_text.strip():
-        raise HTTPException(status_code=400, detail="selected_text 不可為空")
 
-    print(f"📩 收到檢測請求，User ID: {request.user_id}")
-    print(f"📝 檢查文字片段: {user_text[:30]}...")
+@app.get("/metrics")
+def read_metrics():
+    """Prometheus 抓取用（每個 worker 各自一份）"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
-    # ---------- 1. 呼叫 AI 主流程 (用 async 版本) ----------
-    try:
-        logic_result: Dict[str, Any] = await process_compliance_check_async(user_text)
-    except Exception as e:
-        print(f"❌ 後端邏輯執行失敗: {e}")
-        raise HTTPException(status_code=500, detail="Internal AI logic error")
 
-    step1_output = logic_result.get("step1_output", {}) or {}
-    vector_search_results = logic_result.get("vector_search_results", []) or []
-    final_analysis = logic_result.get("final_analysis", {}) or {}
+# ==========================================
+# 管理用 endpoint
+# ==========================================
+def require_admin(http_request: Request) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if http_request.headers.get("x-admin-token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
 
-    # ---------- 2. 產業類別 ----------
-    industry = step1_output.get("industry", "Unknown") or "Unknown"
-    category = industry  # 先直接用 industry 當 category
 
-    # ---------- 3. 總風險分數 (方案 B：combined risk) ----------
-    identified_tags = step1_output.get("identified_tags", []) or []
-    # step1_output 裡的每個 tag 物件長得像：{"tag": "...", "trigger_words": [...]}
-    tag_names = [item.get("tag") for item in identified_tags if item.get("tag")]
-
-    risk = 0.0
-    if tag_names:
-        try:
-            # calculate_combined_risk：自己去 DB 查每個 tag 的歷史比例，
-            # 再依照這段文字踩到哪些 tag 組出 0~1 的整體風險
-            risk = float(calculate_combined_risk(tag_names))
-        except Exception as e:
-            print(f"⚠️ 計算風險分數時發生錯誤: {e}")
-            risk = 0.0
-    else:
-        risk = 0.0
+@app.get("/api/admin/jobs")
+def read_jobs(http_request: Request):
+    """背景工作狀態：正在跑的（含進度）與最近幾次的結果"""
+    require_admin(http_request)
+    return scheduler.status()
 
-    print(f"📊 本段文案風險分數 (0~1): {risk}")
 
-    # ---------- 4. 把向量搜尋結果做成 tag -> cases 對照表 ----------
+@app.post("/api/admin/jobs/{name}", status_code=202)
+async def run_job(name: str, http_request: Request):
+    """手動觸發 auto_tag / sync / refresh；已經有工作在跑就回 409"""
+    require_admin(http_request)
+    try:
+        return scheduler.trigger(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {name}")
+    except JobAlreadyRunning:
+        raise HTTPException(status_code=409, detail="Another job is already running")
+
+
+@app.get("/api/admin/profiles")
+def read_profiles(http_request: Request):
+    """這個 worker 最近存下的 request profile"""
+    require_admin(http_request)
+    return {"profiles": recent_profiles()}
+
+
+@app.get("/api/admin/profiles/{profile_id}")
+def read_profile(profile_id: str, http_request: Request, format: str = "json"):
+    """span timeline + 取樣結果；format=folded 回傳 flamegraph 用的 folded stacks"""
+    require_admin(http_request)
+    data = load_profile(profile_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Profile not found or expired")
+    if format == "folded":
+        return PlainTextResponse(folded_text(data))
+    return data
+
+
+# ==========================================
+# 回傳組裝（純 CPU，不碰網路；benchmarks/micro_bench.py 也直接呼叫）
+# ==========================================
+def build_tag_to_cases(
+    vector_search_results: List[Dict[str, Any]],
+) -> Dict[str, List[Dict[str, Any]]]:
+    """把向量搜尋結果做成 tag -> cases 對照表"""
     # vector_search_results: [
     #   {"tag": "燃脂瘦身", "cases": [...]},
     #   {"tag": "治療", "cases": [...]},
@@ -114,8 +289,21 @@ async def check_compliance(request: CheckRequest):
         if not tname:
             continue
         tag_to_cases[tname] = item.get("cases", []) or []
+    return tag_to_cases
+
 
-    # ---------- 5. 組成 highlights ----------
+def collect_highlight_groups(
+    user_text: str,
+    analysis_results: List[Dict[str, Any]],
+    tag_to_cases: Dict[str, List[Dict[str, Any]]],
+    require_cases: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    每個 analysis（tag + trigger word）整理成一組：
+    {tag, tag_risk, trigger_word, reason, law, cases, positions}
+    v1 / v2 的回傳格式都從這裡展開。
+    require_cases=False（fast 模式沒有檢索）時，沒有案例的 tag 也照樣輸出。
+    """
     # final_analysis 預期結構：
     # {
     #   "analysis_results": [
@@ -132,8 +320,7 @@ async def check_compliance(request: CheckRequest):
     #   ],
     #   "suggestion": "整段改寫後文案"
     # }
-    analysis_results = final_analysis.get("analysis_results", []) or []
-    highlights: List[HighlightItem] = []
+    groups: List[Dict[str, Any]] = []
 
     for analysis in analysis_results:
         trigger_word = analysis.get("trigger_word")
@@ -150,6 +337,7 @@ async def check_compliance(request: CheckRequest):
             tag_risk_value = float(get_risk_info(tag))
         except Exception as e:
             print(f"⚠️ 取得單一 tag 風險失敗 ({tag}): {e}")
+            record_fallback("risk", "tag_risk_error", tag=tag)
             tag_risk_value = 0.0
 
         # 5-1. 找這個字在原文的所有位置
@@ -159,11 +347,12 @@ async def check_compliance(request: CheckRequest):
 
         # 5-2. 整理案例（把連結 + explanation 補上）
         cases_for_tag = tag_to_cases.get(tag, [])
-        final_cases: List[FinalCase] = []
+        final_cases: List[Dict[str, Any]] = []
 
         for ref in reference_cases:
             ref_name = ref.get("product_name")
             ref_date = ref.get("date", "") or ""
+            case_id = ""
             link = ""
             explanation = ""
 
@@ -173,52 +362,363 @@ async def check_compliance(request: CheckRequest):
                     if c.get("product_name") == ref_name and (
                         not ref_date or c.get("date") == ref_date
                     ):
+                        case_id = str(c.get("case_id") or "")
                         link = c.get("link", "") or ""
                         explanation = c.get("explanation", "") or ""
                         break
-
-                final_cases.append(
-                    FinalCase(
-                        product_name=ref_name,
-                        date=ref_date,
-                        link=link,
-                        explanation=explanation,
-                    )
-                )
+                else:
+                    # 這次檢索結果裡沒有（例如 LLM 引用了別的 tag 的案例）：查本機 case store
+                    found = get_case_store().find(ref_name, ref_date)
+                    if found is not None:
+                        case_id, entry = found
+                        link = entry.get("link", "") or ""
+                        explanation = entry.get("explanation", "") or ""
+
+                final_cases.append({
+                    "case_id": case_id,
+                    "product_name": ref_name,
+                    "date": ref_date,
+                    "link": link,
+                    "explanation": explanation,
+                })
 
         # 🔴 新規則：如果這個 tag 最後沒有任何案例，就整段刪掉，不輸出給前端
-        if not final_cases:
+        if not final_cases and require_cases:
             print(f"ℹ️ Tag「{tag}」沒有對應案例，略過此 tag 的 highlight")
+            record_fallback("assemble", "no_cases", tag=tag)
             continue
 
+        groups.append({
+            "tag": tag,
+            "tag_risk": tag_risk_value,
+            "trigger_word": trigger_word,
+            "reason": reason,
+            "law": law,
+            "cases": final_cases,
+            "positions": positions,
+        })
+
+    return groups
+
+
+def highlights_from_groups(groups: List[Dict[str, Any]]) -> List[HighlightItem]:
+    """v1 格式：每個出現位置都生一個 highlight item，各自帶一份完整 details。"""
+    highlights: List[HighlightItem] = []
+
+    for group in groups:
         details = HighlightDetails(
-            reason=reason,
-            law=law,
-            cases=final_cases,
+            reason=group["reason"],
+            law=group["law"],
+            cases=[
+                FinalCase(
+                    product_name=c["product_name"],
+                    date=c["date"],
+                    link=c["link"],
+                    explanation=c["explanation"],
+                )
+                for c in group["cases"]
+            ],
         )
 
         # 5-3. 每個出現位置都生一個 highlight item（帶上 tag_name & tag_risk）
-        for pos in positions:
+        for pos in group["positions"]:
             highlights.append(
                 HighlightItem(
-                    tag_name=tag,
-                    tag_risk=tag_risk_value,
-                    trigger_words=trigger_word,
+                    tag_name=group["tag"],
+                    tag_risk=group["tag_risk"],
+                    trigger_words=group["trigger_word"],
                     start_index=pos.get("start", -1),
                     end_index=pos.get("end", -1),
                     details=details,
                 )
             )
 
+    return highlights
+
+
+def assemble_highlights(
+    user_text: str,
+    analysis_results: List[Dict[str, Any]],
+    tag_to_cases: Dict[str, List[Dict[str, Any]]],
+) -> List[HighlightItem]:
+    """v1 highlights：collect_highlight_groups + highlights_from_groups"""
+    return highlights_from_groups(
+        collect_highlight_groups(user_text, analysis_results, tag_to_cases)
+    )
+
+
+def compact_from_groups(groups: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    v2 格式：details / cases 各存一份，highlight 只帶 detail_id + 位置。
+    同一個 trigger word 出現 20 次，案例內容也只送一次。
+    """
+    details: List[Dict[str, Any]] = []
+    cases: Dict[str, Dict[str, Any]] = {}
+    highlights: List[Dict[str, Any]] = []
+
+    for group in groups:
+        detail_id = f"d{len(details)}"
+        case_ids = []
+        for c in group["cases"]:
+            cid = c["case_id"] or f"{c['product_name']}|{c['date']}"
+            if cid not in cases:
+                cases[cid] = {
+                    "product_name": c["product_name"],
+                    "date": c["date"],
+                    "link": c["link"],
+                    "explanation": c["explanation"],
+                }
+            case_ids.append(cid)
+
+        details.append({
+            "id": detail_id,
+            "tag_name": group["tag"],
+            "tag_risk": group["tag_risk"],
+            "trigger_words": group["trigger_word"],
+            "reason": group["reason"],
+            "law": group["law"],
+            "case_ids": case_ids,
+        })
+        for pos in group["positions"]:
+            highlights.append({
+                "detail_id": detail_id,
+                "start_index": pos.get("start", -1),
+                "end_index": pos.get("end", -1),
+            })
+
+    return {"highlights": highlights, "details": details, "cases": cases}
+
+
+# ==========================================
+# 檢測主流程（v1 / v2 共用）
+# ==========================================
+def request_deadline(request: CheckRequest) -> float:
+    """把 timeout_ms（或預設值）換成 time.monotonic() 的絕對 deadline。"""
+    timeout = request.timeout_ms / 1000 if request.timeout_ms else CHECK_DEADLINE_SECONDS
+    timeout = min(timeout, CHECK_DEADLINE_MAX_SECONDS)
+    return time.monotonic() + max(timeout - DEADLINE_MARGIN_SECONDS, 0.0)
+
+
+async def cancel_on_disconnect(http_request: Request, task: asyncio.Task) -> bool:
+    """前端（Google Docs 側邊欄）關掉時取消還在跑的檢測，回傳是否因斷線而取消。"""
+    while not task.done():
+        if await http_request.is_disconnected():
+            task.cancel()
+            return True
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    return False
+
+
+async def run_endpoint(endpoint: str, http_request: Request, coro):
+    """
+    共用外殼：request id、整體計時、狀態碼計數，
+    以及 client 斷線時取消還在跑的 Gemini / Pinecone 工作。
+    """
+    request_id_var.set(uuid.uuid4().hex[:12])
+    status = "500"
+    audit_record = audit.begin(endpoint)
+
+    work = asyncio.create_task(coro)
+    watcher = asyncio.create_task(cancel_on_disconnect(http_request, work))
+    try:
+        with stage("request", endpoint=endpoint):
+            response = await work
+        status = "200"
+        return response
+    except asyncio.CancelledError:
+        if watcher.done() and not watcher.cancelled() and watcher.result():
+            # client 已經離開，工作都已取消；回應不會有人收到
+            status = "499"
+            record_fallback("request", "client_disconnected")
+            raise HTTPException(status_code=499, detail="Client disconnected")
+        raise
+    except HTTPException as e:
+        status = str(e.status_code)
+        raise
+    finally:
+        watcher.cancel()
+        REQUESTS_TOTAL.inc(endpoint=endpoint, status=status)
+        audit.finish(audit_record, status)
+
+
+def admission_key(request: CheckRequest, http_request: Request) -> str:
+    """公平排隊用的使用者 key；沒帶 user_id 就用來源 IP。"""
+    if request.user_id:
+        return request.user_id
+    client = http_request.client
+    return f"ip:{client.host}" if client else "anonymous"
+
+
+async def run_check(request: CheckRequest, deadline: float, user_key: str) -> Dict[str, Any]:
+    """
+    准入控制 -> 跑 LLM + 向量搜尋 -> 計算風險分數 -> 整理 highlight groups。
+    回傳格式無關的中間結果，由各版本 endpoint 自己組回傳。
+    """
+    user_text = request.selected_text
+
+    if not user_text or not user_text.strip():
+        raise HTTPException(status_code=400, detail="selected_text 不可為空")
+
+    print(f"📩 收到檢測請求，User ID: {request.user_id}")
+    print(f"📝 檢查文字片段: {user_text[:30]}...")
+    log_event("request_received", user_id=request.user_id, text_length=len(user_text))
+    audit.note_input(user_text, request.user_id, user_key, request.mode)
+
+    try:
+        return await check_text(user_text, deadline, user_key, request.mode)
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy ({e.reason}), please retry later",
+            headers={"Retry-After": e.retry_after_header},
+        )
+
+
+async def check_text(user_text: str, deadline: float, user_key: str, mode: str = "full") -> Dict[str, Any]:
+    """准入控制 + _run_check；過載時丟 Overloaded（HTTP 轉 429，WebSocket 轉 error 訊息）。"""
+    if not ADMISSION_ENABLED:
+        return await _run_check(user_text, deadline, user_key, mode)
+
+    async with admission.admit(user_key, deadline):
+        return await _run_check(user_text, deadline, user_key, mode)
+
+
+async def _run_check(user_text: str, deadline: float, user_key: str, mode: str = "full") -> Dict[str, Any]:
+
+    # ---------- 1. 呼叫 AI 主流程 (用 async 版本) ----------
+    pipeline_started = time.perf_counter()
+    try:
+        with stage("pipeline"):
+            logic_result: Dict[str, Any] = await chunked_compliance_check(
+                user_text, deadline=deadline, mode=mode
+            )
+    except Exception as e:
+        print(f"❌ 後端邏輯執行失敗: {e}")
+        raise HTTPException(status_code=500, detail="Internal AI logic error")
+
+    # 流量錄製（TRAFFIC_CAPTURE_PATH 有設才會錄）
+    if capture_recorder is not None:
+        capture_recorder.record(
+            user_key,
+            user_text,
+            logic_result,
+            time.perf_counter() - pipeline_started,
+            request_id=request_id_var.get(),
+        )
+
+    step1_output = logic_result.get("step1_output", {}) or {}
+    vector_search_results = logic_result.get("vector_search_results", []) or []
+    final_analysis = logic_result.get("final_analysis", {}) or {}
+
+    # ---------- 2. 產業類別 ----------
+    industry = step1_output.get("industry", "Unknown") or "Unknown"
+    category = industry  # 先直接用 industry 當 category
+
+    # ---------- 3. 總風險分數 (方案 B：combined risk) ----------
+    identified_tags = step1_output.get("identified_tags", []) or []
+    # step1_output 裡的每個 tag 物件長得像：{"tag": "...", "trigger_words": [...]}
+    tag_names = [item.get("tag") for item in identified_tags if item.get("tag")]
+
+    risk = 0.0
+    if tag_names:
+        try:
+            # calculate_combined_risk：自己去 DB 查每個 tag 的歷史比例，
+            # 再依照這段文字踩到哪些 tag 組出 0~1 的整體風險
+            with stage("risk"):
+                risk = float(calculate_combined_risk(tag_names))
+        except Exception as e:
+            print(f"⚠️ 計算風險分數時發生錯誤: {e}")
+            record_fallback("risk", "combined_risk_error")
+            risk = 0.0
+    else:
+        risk = 0.0
+
+    print(f"📊 本段文案風險分數 (0~1): {risk}")
+
+    # ---------- 4. 把向量搜尋結果做成 tag -> cases 對照表 ----------
+    tag_to_cases = build_tag_to_cases(vector_search_results)
+
+    # ---------- 5. 整理 highlight groups ----------
+    analysis_results = final_analysis.get("analysis_results", []) or []
+    with stage("assemble"):
+        groups = collect_highlight_groups(
+            user_text, analysis_results, tag_to_cases, require_cases=mode != "fast"
+        )
+
     # ---------- 6. 整體建議（整句改寫） ----------
+    # Step 3 不再產生改寫，先登記一個 handle；SUGGESTION_DEFERRED=0 才在這裡等。
+    # 只有 full 模式有改寫：fast / standard（包含 live_check 的段落）不能被最慢的生成拖住
     overall_suggestion = final_analysis.get("suggestion", "") or ""
+    suggestion_id = None
+    if not overall_suggestion and mode == "full":
+        suggestion_id = register_suggestion(user_text, analysis_results)
+        if suggestion_id and not SUGGESTION_DEFERRED:
+            try:
+                overall_suggestion = await get_suggestion(suggestion_id, deadline=deadline)
+            except asyncio.TimeoutError:
+                record_fallback("deadline", "suggestion")
+            except SuggestionError:
+                pass
+
+    return {
+        "category": category,
+        "risk": risk,
+        "tag_names": tag_names,
+        "groups": groups,
+        "suggestion": overall_suggestion,
+        "suggestion_id": suggestion_id,
+        "partial": bool(logic_result.get("partial")),
+        "timed_out_stages": logic_result.get("timed_out_stages", []) or [],
+        "mode": mode,
+    }
+
+
+def log_completed(result: Dict[str, Any], highlights: int) -> None:
+    audit.note(
+        category=result["category"],
+        risk=result["risk"],
+        tags=result["tag_names"],
+        highlights=highlights,
+        partial=result["partial"],
+        timed_out_stages=result["timed_out_stages"],
+    )
+    log_event(
+        "request_completed",
+        category=result["category"],
+        risk=result["risk"],
+        tags=result["tag_names"],
+        highlights=highlights,
+        partial=result["partial"],
+        mode=result["mode"],
+    )
+
+
+@app.post("/api/check_compliance", response_model=CheckResponse)
+async def check_compliance(request: CheckRequest, http_request: Request):
+    """
+    接收前端文字 -> 跑 LLM + 向量搜尋 -> 計算風險分數 -> 組成前端需要的回傳格式
+    """
+    return await run_endpoint(
+        "check_compliance", http_request, _check_compliance(request, request_deadline(request), http_request)
+    )
+
+
+async def _check_compliance(request: CheckRequest, deadline: float, http_request: Request) -> CheckResponse:
+    result = await run_check(request, deadline, admission_key(request, http_request))
+
+    with stage("serialize", version="v1"):
+        highlights = highlights_from_groups(result["groups"])
 
     # ---------- 7. 組成最後回傳 ----------
     compliance_data = ComplianceData(
-        category=category,
-        risk=risk,
+        category=result["category"],
+        risk=result["risk"],
         highlights=highlights,
-        suggestion=overall_suggestion,
+        suggestion=result["suggestion"],
+        suggestion_id=result["suggestion_id"],
+        partial=result["partial"],
+        timed_out_stages=result["timed_out_stages"],
+        mode=result["mode"],
     )
 
     response = CheckResponse(
@@ -226,9 +726,152 @@ async def check_compliance(request: CheckRequest):
         data=compliance_data,
     )
 
+    log_completed(result, len(highlights))
     return response
 
 
+@app.post("/api/v2/check_compliance", response_model=CheckResponseV2)
+async def check_compliance_v2(request: CheckRequest, http_request: Request):
+    """
+    v2：highlight 只帶 detail_id + 位置，reason / law / 案例各存一份；
+    用較快的 JSON encoder，並依 Accept-Encoding 做 br / gzip 壓縮。
+    """
+    return await run_endpoint(
+        "check_compliance_v2",
+        http_request,
+        _check_compliance_v2(request, request_deadline(request), http_request),
+    )
+
+
+async def _check_compliance_v2(request: CheckRequest, deadline: float, http_request: Request):
+    result = await run_check(request, deadline, admission_key(request, http_request))
+
+    with stage("serialize", version="v2"):
+        compact = compact_from_groups(result["groups"])
+        payload = {
+            "status": "success",
+            "version": 2,
+            "data": {
+                "category": result["category"],
+                "risk": result["risk"],
+                "suggestion": result["suggestion"],
+                "suggestion_id": result["suggestion_id"],
+                "partial": result["partial"],
+                "timed_out_stages": result["timed_out_stages"],
+                "mode": result["mode"],
+                **compact,
+            },
+        }
+        # 結構由 compact_from_groups 保證，直接編碼、跳過 response_model 驗證
+        response = encoded_json_response(payload, http_request.headers.get("accept-encoding", ""))
+
+    log_completed(result, len(compact["highlights"]))
+    return response
+
+
+# ==========================================
+# 整段改寫（延後產生）
+# ==========================================
+@app.get("/api/suggestion/{suggestion_id}", response_model=SuggestionResponse)
+async def read_suggestion(suggestion_id: str, http_request: Request):
+    """用 check_compliance 回傳的 suggestion_id 取整段改寫；第一次取才呼叫 Gemini，之後走快取"""
+    return await run_endpoint("suggestion", http_request, _read_suggestion(suggestion_id))
+
+
+async def _read_suggestion(suggestion_id: str) -> SuggestionResponse:
+    try:
+        suggestion = await get_suggestion(
+            suggestion_id, deadline=time.monotonic() + SUGGESTION_TIMEOUT_SECONDS
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown or expired suggestion_id")
+    except asyncio.TimeoutError:
+        record_fallback("deadline", "suggestion")
+        raise HTTPException(status_code=504, detail="Suggestion generation timed out")
+    except SuggestionError:
+        raise HTTPException(status_code=500, detail="Suggestion generation failed")
+
+    return SuggestionResponse(
+        status="success",
+        data=SuggestionData(suggestion_id=suggestion_id, suggestion=suggestion),
+    )
+
+
+@app.get("/api/suggestion/{suggestion_id}/stream")
+async def stream_suggestion_text(suggestion_id: str):
+    """同上，但邊產生邊回傳純文字（前端可以一段一段顯示）；中途失敗會以 STREAM_ERROR_MARKER 結尾"""
+    if not has_suggestion(suggestion_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired suggestion_id")
+    return StreamingResponse(
+        stream_suggestion(suggestion_id), media_type="text/plain; charset=utf-8"
+    )
+
+
+# ==========================================
+# WebSocket 即時檢查
+# ==========================================
+@app.websocket("/ws/live_check")
+async def live_check(websocket: WebSocket):
+    """
+    編輯中的即時檢查：client 持續送文字 / 修改，停止輸入一下才檢測，
+    只推送新增 / 消失的 highlight（協定見 live_session.py）。
+    """
+    await websocket.accept()
+    request_id_var.set(uuid.uuid4().hex[:12])
+    client = websocket.client
+    session: LiveSession
+
+    def live_user_key() -> str:
+        return session.user_id or (f"ip:{client.host}" if client else "anonymous")
+
+    @asynccontextmanager
+    async def admit(text: str, mode: str):
+        # 一次檢測（不論幾段）只佔一個准入名額 / 一個 token
+        if not ADMISSION_ENABLED:
+            yield
+            return
+        user_key = live_user_key()
+        deadline = time.monotonic() + CHECK_DEADLINE_SECONDS - DEADLINE_MARGIN_SECONDS
+        try:
+            async with admission.admit(user_key, deadline):
+                yield
+        except Overloaded:
+            # 被擋下的整次檢測記一筆，跟 HTTP 的 429 一樣留稽核紀錄
+            audit_record = audit.begin("live_check")
+            audit.note_input(text, session.user_id, user_key, mode)
+            audit.finish(audit_record, "429")
+            raise
+
+    async def check(text: str, mode: str) -> Dict[str, Any]:
+        user_key = live_user_key()
+        deadline = time.monotonic() + CHECK_DEADLINE_SECONDS - DEADLINE_MARGIN_SECONDS
+        audit_record = audit.begin("live_check")
+        audit.note_input(text, session.user_id, user_key, mode)
+        status = "500"
+        try:
+            # 准入已經在 admit() 以整次檢測為單位做過，這裡直接跑
+            with stage("request", endpoint="live_check"):
+                result = await _run_check(text, deadline, user_key, mode)
+            status = "200"
+            log_completed(result, sum(len(g["positions"]) for g in result["groups"]))
+            return result
+        except asyncio.CancelledError:
+            status = "499"
+            raise
+        finally:
+            audit.finish(audit_record, status)
+
+    session = LiveSession(
+        websocket, check, admit, mode=websocket.query_params.get("mode", LIVE_DEFAULT_MODE)
+    )
+    session.user_id = websocket.query_params.get("user_id")
+    await session.serve()
+
+
+WARMUP_STATE["import_seconds"] = round(time.perf_counter() - _IMPORT_STARTED_AT, 3)
+print(f"⏱️ main 模組載入耗時 {WARMUP_STATE['import_seconds']}s")
+
+
 if __name__ == "__main__":
     # 直接跑：python main.py
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
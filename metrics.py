@@ -0,0 +1,277 @@
+# metrics.py
+# 輕量版 Prometheus 指標 + 結構化 log（不額外依賴 prometheus_client）
+#
+# 用法：
+#   from metrics import stage, record_fallback
+#   with stage("step1"):
+#       ...
+#   record_fallback("step3", "no_vector_results")
+#
+# /metrics 由 main.py 呼叫 render_prometheus() 輸出。
+# 注意：多 worker 部署時每個 worker 各自一份，由 Prometheus 依 instance 分別抓取後再加總。
+
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# ==========================================
+# 1. 結構化 log
+# ==========================================
+logger = logging.getLogger("lawpatrol")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# 目前這個 request 的 id（main.py 在每個 request 開頭設定）
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "request_id", default=None
+)
+
+
+# 目前這個 request 的 profile（profiling.py 開啟時才有值；None 時 stage 只多一次 contextvar 讀取）
+profile_var: contextvars.ContextVar[Optional[Any]] = contextvars.ContextVar(
+    "profile", default=None
+)
+
+
+# 目前這個 request 各 stage 的累計秒數（audit.begin() 設定；同名 stage 加總）
+stage_timings_var: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "stage_timings", default=None
+)
+
+
+def log_event(event: str, **fields) -> None:
+    """輸出一行 JSON log，欄位名稱與 /metrics 的 label 一致，方便做 SLO dashboard。"""
+    payload = {"ts": round(time.time(), 3), "event": event}
+    request_id = request_id_var.get()
+    if request_id:
+        payload["request_id"] = request_id
+    payload.update(fields)
+    logger.info(json.dumps(payload, ensure_ascii=False, default=str))
+
+
+# ==========================================
+# 2. 指標型別
+# ==========================================
+_LabelValues = Tuple[str, ...]
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> _LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[_LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[_LabelValues, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count], sum
+        self._counts: Dict[_LabelValues, List[int]] = {}
+        self._sums: Dict[_LabelValues, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = [(k, list(c), self._sums.get(k, 0.0)) for k, c in self._counts.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for upper, c in zip(self.buckets, counts):
+                cumulative += c
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % upper)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render_prometheus() -> str:
+    """輸出 Prometheus text exposition format (0.0.4)。"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ==========================================
+# 3. 這個服務用到的指標
+# ==========================================
+REQUESTS_TOTAL = Counter(
+    "lawpatrol_requests_total", "HTTP requests by endpoint and status", ["endpoint", "status"]
+)
+STAGE_SECONDS = Histogram(
+    "lawpatrol_stage_seconds", "Latency of each pipeline stage", ["stage"]
+)
+STAGE_ERRORS = Counter(
+    "lawpatrol_stage_errors_total", "Exceptions raised inside a pipeline stage", ["stage"]
+)
+FALLBACKS = Counter(
+    "lawpatrol_fallbacks_total",
+    "Silent fallbacks (empty results, default risk, skipped stages)",
+    ["stage", "reason"],
+)
+CACHE_REQUESTS = Counter(
+    "lawpatrol_cache_requests_total", "Cache lookups by namespace and result", ["namespace", "result"]
+)
+HEDGED_CALLS = Counter(
+    "lawpatrol_hedged_calls_total", "Hedged duplicate calls fired / won", ["stage", "result"]
+)
+IN_FLIGHT = Gauge(
+    "lawpatrol_in_flight", "Requests / stages currently in progress", ["stage"]
+)
+
+
+# ==========================================
+# 4. 小工具
+# ==========================================
+@contextmanager
+def stage(name: str, **fields) -> Iterator[None]:
+    """
+    量測一個階段：histogram + in-flight gauge + 例外計數 + 一行結構化 log。
+    例外會照樣往外丟，由呼叫端原本的 try/except 處理。
+    """
+    profile = profile_var.get()
+    if profile is not None:
+        profile.enter()
+    IN_FLIGHT.inc(stage=name)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        IN_FLIGHT.dec(stage=name)
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        log_event("stage", stage=name, duration_ms=round(elapsed * 1000, 2), status=status, **fields)
+        if profile is not None:
+            profile.add_span(name, started, elapsed, status, fields)
+        timings = stage_timings_var.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def record_span(name: str, started: float, **fields) -> None:
+    """不是用 with stage() 包起來的等待時間（例如排隊），只在 profile 開啟時記到 timeline。"""
+    profile = profile_var.get()
+    if profile is not None:
+        profile.add_span(name, started, time.perf_counter() - started, "ok", fields)
+
+
+def record_fallback(stage_name: str, reason: str, **fields) -> None:
+    FALLBACKS.inc(stage=stage_name, reason=reason)
+    log_event("fallback", stage=stage_name, reason=reason, **fields)
+    profile = profile_var.get()
+    if profile is not None:
+        profile.add_event("fallback", stage=stage_name, reason=reason, **fields)
+
+
+def record_cache(namespace: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(namespace=namespace, result="hit" if hit else "miss")
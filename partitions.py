@@ -0,0 +1,103 @@
+# partitions.py
+# Pinecone 的 namespace 切法（sync 寫入與 database 查詢共用，兩邊一定要一致）。
+#
+# PINECONE_NAMESPACE_LAYOUT：
+#   flat          全部寫在預設 namespace，查詢靠 metadata filter（原本的做法）
+#   industry      每個產業一個 namespace（industry-food ...），另有 global；
+#                 查詢只剩 tag filter，產業 Unknown 時查 global
+#   industry_tag  再往下每個 tag 一個分區（industry-food--tag_slimming），
+#                 查詢完全不用 filter；不在 TAG_MAPPING 的 tag 退回產業層
+#
+# 同一個案件在每個 namespace 都用同一個 id（case_id），
+# sync 用 case_vector_namespaces 表記住寫過哪些 namespace，更新 / 刪除時才清得乾淨。
+# 換 layout 之後要跑一次全量 sync。
+
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PINECONE_NAMESPACE_LAYOUT = os.getenv("PINECONE_NAMESPACE_LAYOUT", "flat")
+
+GLOBAL_NAMESPACE = "global"
+
+# LLM 給的是英文 (Food/Cosmetic/Medicine/Device)
+# DB / Pinecone metadata 存的是中文 (食物/化妝品/藥品/醫療器材)
+EN_TO_ZH_INDUSTRY = {
+    "Food": "食物",
+    "Cosmetic": "化妝品",
+    "Medicine": "藥品",
+    "Device": "醫療器材",
+}
+
+# namespace 名稱只用 ASCII
+INDUSTRY_CODES = {
+    "食物": "food",
+    "化妝品": "cosmetic",
+    "藥品": "medicine",
+    "醫療器材": "device",
+}
+
+
+def to_zh_industry(industry: Optional[str]) -> Optional[str]:
+    if not industry or industry == "Unknown":
+        return None
+    return EN_TO_ZH_INDUSTRY.get(industry, industry)
+
+
+def industry_namespace(industry: Optional[str]) -> str:
+    zh = to_zh_industry(industry)
+    if zh is None:
+        return GLOBAL_NAMESPACE
+    return f"industry-{INDUSTRY_CODES.get(zh, 'other')}"
+
+
+def tag_namespace(base: str, tag_column: str) -> str:
+    return f"{base}--{tag_column}"
+
+
+# ==========================================
+# 寫入：一個案件要出現在哪些 namespace
+# ==========================================
+def write_namespaces(
+    industry: Optional[str],
+    tag_columns: Iterable[str],
+    layout: str = PINECONE_NAMESPACE_LAYOUT,
+) -> List[str]:
+    if layout == "flat":
+        return [""]
+
+    bases = [industry_namespace(industry), GLOBAL_NAMESPACE]
+    if industry_namespace(industry) == GLOBAL_NAMESPACE:
+        bases = [GLOBAL_NAMESPACE]
+
+    namespaces = list(bases)
+    if layout == "industry_tag":
+        for base in bases:
+            namespaces.extend(tag_namespace(base, col) for col in tag_columns)
+    return namespaces
+
+
+# ==========================================
+# 查詢：(tag, industry) → (namespace, metadata filter)
+# ==========================================
+def query_target(
+    tag: str,
+    industry: Optional[str],
+    tag_mapping: Dict[str, str],
+    layout: str = PINECONE_NAMESPACE_LAYOUT,
+) -> Tuple[str, Optional[Dict[str, Any]]]:
+    if layout == "flat":
+        filter_dict: Dict[str, Any] = {"tag_name": {"$in": [tag]}}
+        zh = to_zh_industry(industry)
+        if zh:
+            filter_dict["industry"] = zh
+        return "", filter_dict
+
+    base = industry_namespace(industry)
+    column = tag_mapping.get(tag)
+    if layout == "industry_tag" and column:
+        return tag_namespace(base, column), None
+    return base, {"tag_name": {"$in": [tag]}}
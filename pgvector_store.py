@@ -0,0 +1,231 @@
+# pgvector_store.py
+# 用 Postgres + pgvector 當檢索後端（VECTOR_BACKEND=pgvector）。
+# 小型部署已經有 Postgres，就不必另外養 Pinecone，檢索也少一趟外部網路。
+#
+# - public.case_vectors：每個案件一列（向量 + 回傳要用的欄位 + tag_name[] / industry 篩選欄位）
+# - 向量索引 PGVECTOR_INDEX_TYPE=hnsw（預設）或 ivfflat，距離用 cosine；
+#   sync 寫完資料才建（ensure_index），ivfflat 的分群要有資料才準，資料量變化大時 REINDEX
+# - 篩選條件跟 Pinecone flat layout 一樣：tag_name 包含該 tag；產業已知時限定產業
+# - 寫入由 sync_postgres_pinecone.sync_data 負責（向量來自 case_embeddings，不重新 embed）
+#
+# 注意：檢索跑在 retrieval_client 的 worker 裡，每個查詢借一條 DB 連線；
+# database.py 的 DB_POOL_MAX 預設 RETRIEVAL_MAX_WORKERS + DB_POOL_HEADROOM，設太小時 API 不會啟動。
+
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from psycopg2.extras import RealDictCursor, execute_values
+
+load_dotenv()
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")  # pinecone | pgvector
+PGVECTOR_INDEX_TYPE = os.getenv("PGVECTOR_INDEX_TYPE", "hnsw")  # hnsw | ivfflat
+PGVECTOR_HNSW_M = int(os.getenv("PGVECTOR_HNSW_M", "16"))
+PGVECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("PGVECTOR_HNSW_EF_CONSTRUCTION", "64"))
+# 有 WHERE 篩選時 HNSW 先取 ef_search 個候選再過濾，篩得越嚴這個要越大
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", "100"))
+PGVECTOR_IVF_LISTS = int(os.getenv("PGVECTOR_IVF_LISTS", "100"))
+PGVECTOR_IVF_PROBES = int(os.getenv("PGVECTOR_IVF_PROBES", "10"))
+# 筆數變成建索引時的幾倍（或幾分之一）就重建 ivfflat，分群才跟得上資料
+PGVECTOR_IVF_REBUILD_FACTOR = float(os.getenv("PGVECTOR_IVF_REBUILD_FACTOR", "2"))
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "768"))
+
+CASE_VECTORS_DDL = f"""
+    CREATE EXTENSION IF NOT EXISTS vector;
+    CREATE TABLE IF NOT EXISTS public.case_vectors (
+        case_id      TEXT PRIMARY KEY,
+        embedding    vector({EMBEDDING_DIM}) NOT NULL,
+        industry     TEXT,
+        tag_name     TEXT[] NOT NULL DEFAULT '{{}}',
+        product_name TEXT,
+        explanation  TEXT,
+        law          TEXT,
+        case_date    TEXT,
+        link         TEXT,
+        updated_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS case_vectors_tag_name_idx ON public.case_vectors USING gin (tag_name);
+    CREATE INDEX IF NOT EXISTS case_vectors_industry_idx ON public.case_vectors (industry);
+"""
+
+
+IVF_INDEX_NAME = "case_vectors_embedding_ivfflat"
+HNSW_INDEX_NAME = "case_vectors_embedding_hnsw"
+
+
+def index_ddl(index_type: str = PGVECTOR_INDEX_TYPE) -> str:
+    if index_type == "ivfflat":
+        # ivfflat 要有資料再建，lists 大約取 rows / 1000（小資料量 sqrt(rows)）
+        return f"""
+            CREATE INDEX IF NOT EXISTS {IVF_INDEX_NAME}
+            ON public.case_vectors USING ivfflat (embedding vector_cosine_ops)
+            WITH (lists = {PGVECTOR_IVF_LISTS});
+        """
+    return f"""
+        CREATE INDEX IF NOT EXISTS {HNSW_INDEX_NAME}
+        ON public.case_vectors USING hnsw (embedding vector_cosine_ops)
+        WITH (m = {PGVECTOR_HNSW_M}, ef_construction = {PGVECTOR_HNSW_EF_CONSTRUCTION});
+    """
+
+
+def vector_literal(vector: Sequence[float]) -> str:
+    return "[" + ",".join(f"{float(x):.7g}" for x in vector) + "]"
+
+
+# ==========================================
+# 1. 寫入（sync 用）
+# ==========================================
+def ensure_schema(conn) -> None:
+    """只建表與篩選欄位的索引；向量索引等資料寫進去之後由 ensure_index 建。"""
+    with conn.cursor() as cur:
+        cur.execute(CASE_VECTORS_DDL)
+    conn.commit()
+
+
+def ensure_index(conn, index_type: str = PGVECTOR_INDEX_TYPE) -> str:
+    """
+    sync 寫完資料後呼叫，回傳做了什麼：created / rebuilt / kept / skipped（表是空的）。
+    ivfflat 建立時的筆數記在索引的 COMMENT 裡，之後筆數變化超過
+    PGVECTOR_IVF_REBUILD_FACTOR 倍（包含在空表上建的舊索引）就 REINDEX。
+    """
+    name = IVF_INDEX_NAME if index_type == "ivfflat" else HNSW_INDEX_NAME
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM public.case_vectors")
+        rows = cur.fetchone()[0]
+        cur.execute(
+            "SELECT to_regclass(%s) IS NOT NULL, obj_description(to_regclass(%s), 'pg_class')",
+            (f"public.{name}", f"public.{name}"),
+        )
+        exists, comment = cur.fetchone()
+
+        if rows == 0 and index_type == "ivfflat":
+            conn.rollback()
+            return "skipped"
+        if not exists:
+            cur.execute(index_ddl(index_type))
+            action = "created"
+        elif index_type != "ivfflat":
+            # HNSW 邊寫邊維護，不需要重建
+            conn.rollback()
+            return "kept"
+        else:
+            built_rows = int(comment.split("=", 1)[1]) if comment and comment.startswith("rows=") else 0
+            factor = PGVECTOR_IVF_REBUILD_FACTOR
+            if built_rows > 0 and built_rows / factor < rows < built_rows * factor:
+                conn.rollback()
+                return "kept"
+            cur.execute(f"REINDEX INDEX public.{name}")
+            action = "rebuilt"
+
+        if index_type == "ivfflat":
+            cur.execute(f"COMMENT ON INDEX public.{name} IS %s", (f"rows={rows}",))
+    conn.commit()
+    return action
+
+
+def upsert_vectors(conn, batch: Sequence[Tuple[str, List[float], Dict[str, Any]]]) -> None:
+    """batch: [(case_id, embedding, metadata), ...]；metadata 跟 Pinecone 寫入的一樣。"""
+    if not batch:
+        return
+    rows = [
+        (
+            case_id,
+            vector_literal(vector),
+            meta.get("industry"),
+            list(meta.get("tag_name") or []),
+            meta.get("product_name"),
+            meta.get("explanation"),
+            meta.get("law"),
+            meta.get("date"),
+            meta.get("link"),
+        )
+        for case_id, vector, meta in batch
+    ]
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO public.case_vectors
+                (case_id, embedding, industry, tag_name, product_name, explanation, law, case_date, link)
+            VALUES %s
+            ON CONFLICT (case_id) DO UPDATE
+               SET embedding = EXCLUDED.embedding,
+                   industry = EXCLUDED.industry,
+                   tag_name = EXCLUDED.tag_name,
+                   product_name = EXCLUDED.product_name,
+                   explanation = EXCLUDED.explanation,
+                   law = EXCLUDED.law,
+                   case_date = EXCLUDED.case_date,
+                   link = EXCLUDED.link,
+                   updated_at = now()
+            """,
+            rows,
+            template="(%s, %s::vector, %s, %s, %s, %s, %s, %s, %s)",
+        )
+    conn.commit()
+
+
+def prune_vectors(conn, has_tag_sql: str, ids: Optional[Sequence[str]] = None) -> int:
+    """刪掉已刪除 / 不再有任何 tag 的案件，回傳刪了幾筆。"""
+    query = f"""
+        DELETE FROM public.case_vectors c
+        WHERE NOT EXISTS (
+            SELECT 1 FROM public.violation_cases v
+            WHERE v.id::text = c.case_id AND ({has_tag_sql})
+        )
+        {"AND c.case_id = ANY(%s)" if ids is not None else ""}
+    """
+    with conn.cursor() as cur:
+        cur.execute(query, ([str(i) for i in ids],) if ids is not None else None)
+        deleted = cur.rowcount
+    conn.commit()
+    return deleted
+
+
+# ==========================================
+# 2. 查詢（database.search_vector_cases 用）
+# ==========================================
+def search(
+    conn,
+    embedding: Sequence[float],
+    tag: str,
+    industry: Optional[str],
+    top_k: int,
+    timeout: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """industry 是中文產業（None = 不限產業）；回傳的 score 是 cosine similarity。"""
+    query_vector = vector_literal(embedding)
+    conditions = ["tag_name @> ARRAY[%s]::text[]"]
+    params: List[Any] = [query_vector, tag]
+    if industry:
+        conditions.append("industry = %s")
+        params.append(industry)
+    params.extend([query_vector, top_k])
+
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # SET LOCAL 只影響這個 transaction，連線還回連線池時會 rollback
+        if timeout:
+            cur.execute("SET LOCAL statement_timeout = %s", (int(timeout * 1000),))
+        if PGVECTOR_INDEX_TYPE == "ivfflat":
+            cur.execute("SET LOCAL ivfflat.probes = %s", (PGVECTOR_IVF_PROBES,))
+        else:
+            cur.execute("SET LOCAL hnsw.ef_search = %s", (PGVECTOR_EF_SEARCH,))
+        cur.execute(
+            f"""
+            SELECT case_id, product_name, explanation, law, case_date, link,
+                   1 - (embedding <=> %s::vector) AS score
+            FROM public.case_vectors
+            WHERE {" AND ".join(conditions)}
+            ORDER BY embedding <=> %s::vector
+            LIMIT %s
+            """,
+            params,
+        )
+        return cur.fetchall()
+
+
+def check_ready(conn) -> bool:
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('public.case_vectors') IS NOT NULL")
+        return bool(cur.fetchone()[0])
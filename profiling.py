@@ -0,0 +1,254 @@
+# profiling.py
+# 單一 request 的 profiling：某份文件特別慢的時候，看時間花在哪裡
+# （等 Gemini、卡在 psycopg2、排隊等 worker thread，還是 Pydantic 組回傳）。
+#
+# 開法（要管理者 token，跟 /api/admin/* 一樣）：
+#   curl -H "x-admin-token: $ADMIN_TOKEN" -H "x-profile: 1" .../api/check_compliance
+#   或 query string 加 ?profile=1
+# 回應多一個 x-profile-id header，結果存在快取（namespace "profile"，PROFILE_TTL 秒），用
+#   GET /api/admin/profiles/{id}                 JSON：span timeline + 取樣統計
+#   GET /api/admin/profiles/{id}?format=folded   folded stacks（flamegraph.pl / speedscope 可直接讀）
+#
+# 內容：
+# - span timeline：metrics.stage() / record_span() 在 profile 開啟時順便記下起訖時間、thread、status
+# - 取樣：背景 thread 每 PROFILE_SAMPLE_INTERVAL_MS 抓一次 event loop thread 與
+#   這個 request 用過的 worker thread 的 stack。loop 停在 select 代表在等網路（Gemini / Pinecone）
+# 同一時間只有一個 request 會被取樣（其他的只記 span），取樣會拖慢整個 process，只在排查時開。
+#
+# 沒開的 request：ASGI middleware 只看一下 header / query string 就直接放行。
+
+import os
+import sys
+import time
+import uuid
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from dotenv import load_dotenv
+
+from cache import get_cache
+from metrics import log_event, profile_var, request_id_var
+
+load_dotenv()
+
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_MAX_SAMPLES = int(os.getenv("PROFILE_MAX_SAMPLES", "20000"))
+PROFILE_MAX_DEPTH = int(os.getenv("PROFILE_MAX_DEPTH", "64"))
+PROFILE_TTL = float(os.getenv("PROFILE_TTL", "3600"))
+
+# 這個 worker 最近存過的 profile（列表用；內容在快取裡）
+_recent: Deque[Dict[str, Any]] = deque(maxlen=50)
+_sampler_lock = threading.Lock()
+
+
+# ==========================================
+# 1. 單一 request 的紀錄
+# ==========================================
+class RequestProfile:
+    def __init__(self, path: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.path = path
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.request_id: Optional[str] = None
+        self.spans: List[Dict[str, Any]] = []
+        self.events: List[Dict[str, Any]] = []
+        self.threads = {threading.get_ident()}
+        self._lock = threading.Lock()
+
+    def enter(self) -> None:
+        """stage() 開始時呼叫：記住哪些 thread 在幫這個 request 做事，取樣時一起看。"""
+        self.threads.add(threading.get_ident())
+        if self.request_id is None:
+            self.request_id = request_id_var.get()
+
+    def add_span(self, name: str, started: float, elapsed: float, status: str, fields: Dict[str, Any]) -> None:
+        span = {
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 2),
+            "duration_ms": round(elapsed * 1000, 2),
+            "status": status,
+            "thread": threading.current_thread().name,
+        }
+        if fields:
+            span["fields"] = {k: str(v) for k, v in fields.items()}
+        with self._lock:
+            self.spans.append(span)
+
+    def add_event(self, kind: str, **fields) -> None:
+        with self._lock:
+            self.events.append({
+                "kind": kind,
+                "at_ms": round((time.perf_counter() - self.started) * 1000, 2),
+                **{k: str(v) for k, v in fields.items()},
+            })
+
+
+# ==========================================
+# 2. 取樣
+# ==========================================
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _folded(frame) -> str:
+    labels = []
+    while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, profile: RequestProfile, interval: float = PROFILE_SAMPLE_INTERVAL_MS / 1000):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.profile = profile
+        self.interval = interval
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._names: Dict[int, str] = {}
+
+    def _thread_name(self, ident: int) -> str:
+        if ident not in self._names:
+            self._names = {t.ident: t.name for t in threading.enumerate()}
+        return self._names.get(ident, str(ident))
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval) and self.samples < PROFILE_MAX_SAMPLES:
+            frames = sys._current_frames()
+            for ident in list(self.profile.threads):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                key = (self._thread_name(ident), _folded(frame))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join(timeout=1.0)
+
+    def result(self) -> Dict[str, Any]:
+        stacks = sorted(self.counts.items(), key=lambda kv: -kv[1])
+        return {
+            "interval_ms": round(self.interval * 1000, 2),
+            "samples": self.samples,
+            "stacks": [{"thread": thread, "stack": stack, "count": count} for (thread, stack), count in stacks],
+        }
+
+
+# ==========================================
+# 3. 存取
+# ==========================================
+def save_profile(profile: RequestProfile, status: Optional[int], sampling: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    total_ms = round((time.perf_counter() - profile.started) * 1000, 2)
+    data = {
+        "id": profile.id,
+        "request_id": profile.request_id,
+        "path": profile.path,
+        "status": status,
+        "started_at": profile.started_at,
+        "total_ms": total_ms,
+        "spans": sorted(profile.spans, key=lambda s: s["start_ms"]),
+        "events": profile.events,
+        "sampling": sampling,
+    }
+    get_cache().set("profile", profile.id, data, ttl=PROFILE_TTL)
+    _recent.append({"id": profile.id, "path": profile.path, "total_ms": total_ms, "started_at": profile.started_at})
+    log_event(
+        "profile_saved",
+        profile_id=profile.id,
+        path=profile.path,
+        total_ms=total_ms,
+        samples=sampling["samples"] if sampling else 0,
+    )
+    return data
+
+
+def load_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    return get_cache().get("profile", profile_id)
+
+
+def recent_profiles() -> List[Dict[str, Any]]:
+    return list(reversed(_recent))
+
+
+def folded_text(data: Dict[str, Any]) -> str:
+    """一行一個 stack：`thread;frame;frame count`。"""
+    sampling = data.get("sampling") or {}
+    return "".join(
+        f"{item['thread']};{item['stack']} {item['count']}\n" for item in sampling.get("stacks", [])
+    )
+
+
+# ==========================================
+# 4. ASGI middleware
+# ==========================================
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers") or []:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def wants_profile(scope) -> bool:
+    flag = _header(scope, b"x-profile")
+    if flag is None:
+        query = scope.get("query_string") or b""
+        if b"profile=" not in query:
+            return False
+        flag = (parse_qs(query.decode("latin-1")).get("profile") or [""])[0]
+    return flag.lower() in ("1", "true", "yes")
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, admin_token: Optional[str] = None):
+        self.app = app
+        self.admin_token = admin_token
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        from fastapi.responses import JSONResponse
+
+        if not self.admin_token:
+            await JSONResponse({"detail": "Admin endpoints are disabled"}, status_code=403)(scope, receive, send)
+            return
+        if _header(scope, b"x-admin-token") != self.admin_token:
+            await JSONResponse({"detail": "Invalid admin token"}, status_code=401)(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope.get("path", ""))
+        sampler = StackSampler(profile) if _sampler_lock.acquire(blocking=False) else None
+        if sampler is None:
+            profile.add_event("sampler_busy")
+        else:
+            sampler.start()
+        status: Dict[str, Optional[int]] = {"code": None}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message.get("status")
+                message = dict(message)
+                message["headers"] = list(message.get("headers") or []) + [
+                    (b"x-profile-id", profile.id.encode("ascii"))
+                ]
+            await send(message)
+
+        token = profile_var.set(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile_var.reset(token)
+            sampling = None
+            if sampler is not None:
+                sampler.stop()
+                _sampler_lock.release()
+                sampling = sampler.result()
+            save_profile(profile, status["code"], sampling)
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 TAG_CATEGORIES = {
     "提及醫療與治療行為": [
         "治療", "症狀緩解", "預防", "痊癒", "消腫",
@@ -16,6 +18,7 @@ TAG_CATEGORIES = {
     ]
 }
 
+@lru_cache(maxsize=1)
 def get_formatted_tags_prompt():
     """將 Tag 分類轉為 Prompt 字串"""
     prompt_text = ""
@@ -69,10 +72,9 @@ Output JSON 範例：
 如果沒有發現違規，identified_tags 請回傳 []。
 """
 
-# --- Step 3: 綜合分析與建議（精簡版，suggestion 直接給改寫句子） ---
-# --- Step 3: 綜合分析與建議（精簡版，全句 suggestion） ---
+# --- Step 3: 綜合分析（只產生原因 / 法條 / 參考案例；整段改寫拆到 SUGGESTION_PROMPT_TEMPLATE） ---
 STEP3_PROMPT_TEMPLATE = """
-你是一名廣告法規顧問，請根據下列資訊產生違規原因、可能觸犯的法律，以及「整句改寫後文案」，並以 JSON 回覆。
+你是一名廣告法規顧問，請根據下列資訊產生違規原因與可能觸犯的法律，並以 JSON 回覆。
 
 任務：
 - 對每一個違規詞 trigger_word：
@@ -80,10 +82,6 @@ STEP3_PROMPT_TEMPLATE = """
   - law：請盡量用簡短文字指出可能觸犯的法律依據（例如：「食品安全衛生管理法第28條」、「藥事法第68條」等），若無法確定條號，可寫成「食品安全衛生管理法相關規定」之類的描述。
   - reference_cases：儘量從提供的裁罰案例中挑選 1–2 則最相關的案例放入， 每筆只需包含 product_name 與 date。
 
-- 此外，請回傳一個整體的 suggestion：
-  - suggestion：請將「整段原始文案」改寫成一個合法且保守的版本。
-  - 內容要是可以直接貼回廣告的完整句子，不要再出現「建議改為…」「可以修改成…」等指令語氣。
-
 Input：
 1. User Original Text: {user_text}
 2. Identified Tags & Words: {step1_result}
@@ -104,8 +102,22 @@ Output JSON 範例：
         }}
       ]
     }}
-  ],
-  "suggestion": "本產品含膳食纖維與多種營養成分，有助維持正常代謝與健康體態。"
+  ]
 }}
 """
 
+# --- 整段改寫（使用者按了才產生，見 suggestion.py） ---
+SUGGESTION_PROMPT_TEMPLATE = """
+你是一名廣告法規顧問。改寫任務：請將下面的原始文案改寫成一個合法且保守的版本。
+
+規則：
+- 避開下列違規詞與其隱含的療效 / 誇大宣稱。
+- 內容要是可以直接貼回廣告的完整句子，不要再出現「建議改為…」「可以修改成…」等指令語氣。
+- 只輸出改寫後的文案本身，不要加標題、引號或 JSON。
+
+原始文案：
+{user_text}
+
+違規詞與原因：
+{violations}
+"""
@@ -0,0 +1,78 @@
+# response_encoding.py
+# v2 回傳用的 JSON 編碼與壓縮協商：
+# - 有裝 orjson 就用 orjson（比標準 json 快很多），沒有就退回 json
+# - 依 Accept-Encoding 選 br（有裝 brotli 時）或 gzip；太小的 payload 不壓
+
+import os
+import gzip
+import json
+from typing import Any, List, Optional
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # 選用套件
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # 選用套件
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+
+def dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _qvalue(params: List[str]) -> float:
+    """Accept-Encoding 某一項的 q 值；沒寫是 1，寫錯當成 0（不敢用）。"""
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value.strip())
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """從 Accept-Encoding 挑一個我們支援的壓縮方式（br 優先）；q<=0 代表客戶端拒收。"""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        if coding and _qvalue(params) > 0:
+            accepted.add(coding)
+    if "br" in accepted and brotli is not None:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def encoded_json_response(payload: Any, accept_encoding: str = "", status_code: int = 200) -> Response:
+    body = dumps(payload)
+    headers = {"Vary": "Accept-Encoding"}
+
+    encoding = negotiate_encoding(accept_encoding) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding == "br":
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+        headers["Content-Encoding"] = "br"
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+
+    return Response(
+        content=body,
+        status_code=status_code,
+        media_type="application/json",
+        headers=headers,
+    )
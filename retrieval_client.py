@@ -0,0 +1,136 @@
+# retrieval_client.py
+# 向量檢索專用的執行層：不再跟整個 app 共用 asyncio.to_thread 的 default executor。
+# - 自己的 bounded ThreadPoolExecutor（RETRIEVAL_MAX_WORKERS），容量可以單獨調
+# - 每次呼叫都有明確逾時（RETRIEVAL_TIMEOUT_SECONDS）：
+#   傳給 Pinecone 當 HTTP timeout，async 這層再加一點緩衝當保險
+# - 佇列深度 / 執行中數量 / 排隊時間 / 呼叫耗時都有指標
+#
+# Pinecone 那邊的 keep-alive 連線池大小由 database.PINECONE_POOL_SIZE 控制。
+
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from database import search_vector_cases
+from pgvector_store import VECTOR_BACKEND
+from metrics import Gauge, Histogram, record_fallback, record_span
+
+load_dotenv()
+
+RETRIEVAL_MAX_WORKERS = int(os.getenv("RETRIEVAL_MAX_WORKERS", "16"))
+RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv("RETRIEVAL_TIMEOUT_SECONDS", "3"))
+# async 層的逾時比 HTTP timeout 多一點，讓 SDK 有機會自己先丟錯
+RETRIEVAL_TIMEOUT_GRACE_SECONDS = 0.5
+
+RETRIEVAL_QUEUE_DEPTH = Gauge(
+    "lawpatrol_retrieval_queue_depth", "Retrieval calls waiting for an executor thread"
+)
+RETRIEVAL_IN_FLIGHT = Gauge(
+    "lawpatrol_retrieval_in_flight", "Retrieval calls running on the executor"
+)
+RETRIEVAL_QUEUE_SECONDS = Histogram(
+    "lawpatrol_retrieval_queue_seconds",
+    "Time a retrieval call waited for an executor thread",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+RETRIEVAL_CALL_SECONDS = Histogram(
+    "lawpatrol_retrieval_call_seconds",
+    "Retrieval call latency including queueing",
+    ["result"],
+)
+
+
+class RetrievalClient:
+    def __init__(
+        self,
+        max_workers: int = RETRIEVAL_MAX_WORKERS,
+        timeout: float = RETRIEVAL_TIMEOUT_SECONDS,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="retrieval"
+                    )
+        return self._executor
+
+    def _run(
+        self,
+        call: Dict[str, Any],
+        user_text: str,
+        tag: str,
+        industry: Optional[str],
+        top_k: Optional[int],
+    ):
+        with self._state_lock:
+            if call["state"] == "abandoned":
+                # 呼叫端已經逾時 / 取消，不用再打 Pinecone
+                return []
+            call["state"] = "running"
+            RETRIEVAL_QUEUE_DEPTH.dec()
+        RETRIEVAL_QUEUE_SECONDS.observe(time.perf_counter() - call["queued_at"])
+        record_span("retrieval_queue", call["queued_at"], tag=tag)
+        RETRIEVAL_IN_FLIGHT.inc()
+        try:
+            return search_vector_cases(user_text, tag, industry, top_k=top_k, timeout=self.timeout)
+        finally:
+            RETRIEVAL_IN_FLIGHT.dec()
+
+    async def search(
+        self,
+        user_text: str,
+        tag: str,
+        industry: Optional[str] = None,
+        top_k: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        queued_at = time.perf_counter()
+        call = {"state": "queued", "queued_at": queued_at}
+        RETRIEVAL_QUEUE_DEPTH.inc()
+        # run_in_executor 不會帶 contextvars；複製一份，worker 裡的 log / profile 才對得到 request
+        context = contextvars.copy_context()
+        future = loop.run_in_executor(
+            self._get_executor(), context.run, self._run, call, user_text, tag, industry, top_k
+        )
+
+        result = "ok"
+        try:
+            return await asyncio.wait_for(
+                future, timeout=self.timeout + RETRIEVAL_TIMEOUT_GRACE_SECONDS
+            )
+        except asyncio.TimeoutError:
+            result = "timeout"
+            record_fallback(VECTOR_BACKEND, "timeout", tag=tag)
+            return []
+        except asyncio.CancelledError:
+            result = "cancelled"
+            raise
+        finally:
+            with self._state_lock:
+                if call["state"] == "queued":
+                    call["state"] = "abandoned"
+                    RETRIEVAL_QUEUE_DEPTH.dec()
+            RETRIEVAL_CALL_SECONDS.observe(time.perf_counter() - queued_at, result=result)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                # 還在排隊的查詢直接丟掉；跑到一半的等 HTTP timeout 自己結束
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+retrieval_client = RetrievalClient()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Union
+from typing import Dict, List, Literal, Optional, Union
 
 # ==========================================
 # 1. 前端 -> 後端 (Request)
@@ -7,6 +7,13 @@ from typing import List, Optional, Union
 class CheckRequest(BaseModel):
     selected_text: str = Field(..., description="使用者在 Google Docs 選取的文字")
     user_id: Optional[str] = Field(None, description="使用者 ID，用於 Log")
+    timeout_ms: Optional[int] = Field(
+        None, gt=0, description="這次檢測最多等多久（毫秒），超過就回傳部分結果"
+    )
+    mode: Literal["fast", "standard", "full"] = Field(
+        "full",
+        description="fast：只跑 Step 1（tag + 位置 + 風險）；standard：再加案例；full：再加原因 / 法條 / 改寫",
+    )
 
 
 # ==========================================
@@ -85,9 +92,74 @@ class ComplianceData(BaseModel):
     category: str
     risk: float  # 例如 0.8 (對應 80%)
     highlights: List[HighlightItem]
-    suggestion: str        # 新增：整段文案的改寫建議
+    suggestion: str        # 新增：整段文案的改寫建議（延後產生時為空字串，改用 suggestion_id 取）
+    suggestion_id: Optional[str] = None  # GET /api/suggestion/{suggestion_id} 取整段改寫
+    partial: bool = False  # 有階段超過 deadline，結果不完整
+    timed_out_stages: List[str] = []  # 超時的階段：step1 / retrieval / step3
+    mode: str = "full"     # 實際跑的檢測模式：fast / standard / full
 
 
 class CheckResponse(BaseModel):
     status: str
     data: ComplianceData
+
+
+# ==========================================
+# 4. 後端 -> 前端 (v2 精簡格式)
+#    highlight 只帶 detail_id + 位置；reason / law / 案例各存一份，用 ID 參照
+# ==========================================
+
+class CaseV2(BaseModel):
+    product_name: str
+    date: str
+    link: str
+    explanation: str
+
+
+class HighlightDetailV2(BaseModel):
+    id: str                # 例如 "d0"
+    tag_name: str
+    tag_risk: float
+    trigger_words: str
+    reason: str
+    law: str
+    case_ids: List[str]    # 對應 ComplianceDataV2.cases 的 key
+
+
+class HighlightItemV2(BaseModel):
+    detail_id: str
+    start_index: int
+    end_index: int
+
+
+class ComplianceDataV2(BaseModel):
+    category: str
+    risk: float
+    suggestion: str
+    suggestion_id: Optional[str] = None
+    partial: bool = False
+    timed_out_stages: List[str] = []
+    mode: str = "full"
+    highlights: List[HighlightItemV2]
+    details: List[HighlightDetailV2]
+    cases: Dict[str, CaseV2]
+
+
+class CheckResponseV2(BaseModel):
+    status: str
+    version: int = 2
+    data: ComplianceDataV2
+
+
+# ==========================================
+# 5. 整段改寫（延後產生）
+# ==========================================
+
+class SuggestionData(BaseModel):
+    suggestion_id: str
+    suggestion: str
+
+
+class SuggestionResponse(BaseModel):
+    status: str
+    data: SuggestionData
@@ -0,0 +1,289 @@
+# semantic_cache.py
+# 語意近似快取：擋在 process_compliance_check_async 前面。
+#
+# 行銷文案大量套模板，只差產品名或數字。新文字如果：
+#   1) 跟某筆舊分析的 embedding cosine >= 門檻，且
+#   2) 出現的「候選 trigger words」（lexicon 裡出現在文字中的詞）完全一樣
+# 就直接沿用舊分析的 tags / reason / law / 案例，main.py 會再用 find_text_indices
+# 對新文字重算位置。整段改寫 suggestion 是針對舊文字寫的，不沿用。
+#
+# 候選 trigger words 的集合同時也是索引 key：只跟同一組 key 的項目算 cosine，
+# 不用掃整個快取。命中後依 SEMANTIC_CACHE_VERIFY_RATE 抽樣在背景重跑完整流程，
+# 比對 tag 是否一致，用來估算 false reuse 比例（不一致的項目會被踢掉）。
+
+import os
+import math
+import time
+import random
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from cache import data_version, register_invalidation_hook
+from database import embed_text
+from admission import admission
+from logic import process_compliance_check_async, run_with_deadline
+from metrics import Counter, Gauge, log_event, record_cache
+
+load_dotenv()
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_VERIFY_RATE = float(os.getenv("SEMANTIC_CACHE_VERIFY_RATE", "0.05"))
+# 背景驗證最多跑幾秒；它不經過准入控制，所以系統忙的時候直接不驗
+SEMANTIC_CACHE_VERIFY_SECONDS = float(os.getenv("SEMANTIC_CACHE_VERIFY_SECONDS", "20"))
+
+SEMANTIC_VERIFICATIONS = Counter(
+    "lawpatrol_semantic_cache_verifications_total",
+    "Background re-checks of semantic cache hits",
+    ["result"],
+)
+SEMANTIC_ENTRIES = Gauge("lawpatrol_semantic_cache_entries", "Entries in the semantic cache")
+
+
+def _normalize(vector: List[float]) -> Optional[List[float]]:
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        return None
+    return [v / norm for v in vector]
+
+
+def _tag_signature(result: Dict[str, Any]) -> Set[Tuple[str, str]]:
+    step1 = result.get("step1_output", {}) or {}
+    return {
+        (item.get("tag"), word)
+        for item in step1.get("identified_tags", []) or []
+        for word in item.get("trigger_words", []) or []
+    }
+
+
+_ANY_VERSION = object()
+
+
+class SemanticCache:
+    """單一 worker 內、有上限的 LRU 語意快取。"""
+
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl: float = SEMANTIC_CACHE_TTL,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._by_key: Dict[FrozenSet[str], Set[int]] = {}
+        # trigger word -> 有幾筆項目用到它；項目被踢掉時跟著減，歸零就移出 lexicon
+        self._lexicon: Dict[str, int] = {}
+        self._next_id = 0
+        # 項目是在哪個資料版本下算出來的；別的 worker 跑完 sync 換了戳記就整個清掉
+        self._data_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, version: Optional[str]) -> None:
+        """呼叫端要先拿著 self._lock。"""
+        if version != self._data_version:
+            self._clear()
+            self._data_version = version
+
+    # ---------- 候選 trigger words ----------
+    def candidate_words(self, text: str) -> FrozenSet[str]:
+        return frozenset(w for w in self._lexicon if w in text)
+
+    # ---------- 查詢 ----------
+    def lookup(self, text: str, embedding: List[float]) -> Optional[Tuple[int, Dict[str, Any], float]]:
+        vector = _normalize(embedding)
+        if vector is None:
+            return None
+
+        # 在鎖外面讀：戳記換了會跑 invalidation hook（包括 self.clear）
+        version = data_version()
+        now = time.time()
+        with self._lock:
+            self._check_version(version)
+            key = self.candidate_words(text)
+            best: Optional[Tuple[int, Dict[str, Any], float]] = None
+            for entry_id in list(self._by_key.get(key, ())):
+                entry = self._entries[entry_id]
+                if entry["expires_at"] < now:
+                    self._remove(entry_id)
+                    continue
+                similarity = sum(a * b for a, b in zip(vector, entry["vector"]))
+                if similarity >= self.threshold and (best is None or similarity > best[2]):
+                    best = (entry_id, entry, similarity)
+
+            if best is not None:
+                self._entries.move_to_end(best[0])
+            return best
+
+    # ---------- 寫入 ----------
+    def store(
+        self,
+        text: str,
+        embedding: List[float],
+        result: Dict[str, Any],
+        computed_version: Any = _ANY_VERSION,
+    ) -> None:
+        """computed_version：開始算 result 時的資料版本；算到一半資料換了就不存。"""
+        vector = _normalize(embedding)
+        if vector is None:
+            return
+
+        version = data_version()
+        if computed_version is not _ANY_VERSION and computed_version != version:
+            return
+        with self._lock:
+            self._check_version(version)
+            # 新的 trigger words 加進 lexicon，之後的文字都會用來算候選集合
+            new_words = {word for _, word in _tag_signature(result) if word}
+            for word in new_words:
+                self._lexicon.setdefault(word, 0)
+
+            key = self.candidate_words(text)
+            words = key | new_words
+            for word in words:
+                self._lexicon[word] += 1
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "key": key,
+                "words": words,
+                "vector": vector,
+                "result": result,
+                "expires_at": time.time() + self.ttl,
+            }
+            self._by_key.setdefault(key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+            SEMANTIC_ENTRIES.set(len(self._entries))
+
+    def evict(self, entry_id: int) -> None:
+        with self._lock:
+            self._remove(entry_id)
+            SEMANTIC_ENTRIES.set(len(self._entries))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._by_key.clear()
+        self._lexicon.clear()
+        SEMANTIC_ENTRIES.set(0)
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        ids = self._by_key.get(entry["key"])
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_key[entry["key"]]
+        for word in entry["words"]:
+            left = self._lexicon.get(word, 0) - 1
+            if left > 0:
+                self._lexicon[word] = left
+            else:
+                self._lexicon.pop(word, None)
+
+
+semantic_cache = SemanticCache()
+
+# 案例資料更新後，快取裡的檢索結果就不準了（其他 worker 靠資料版本戳記，見 _check_version）
+register_invalidation_hook(semantic_cache.clear)
+
+_verify_tasks: Set[asyncio.Task] = set()
+
+
+async def _verify_hit(entry_id: int, user_text: str, reused: Dict[str, Any]) -> None:
+    """背景重跑完整流程，比對 (tag, trigger word) 是否一致。"""
+    try:
+        fresh = await process_compliance_check_async(
+            user_text, deadline=time.monotonic() + SEMANTIC_CACHE_VERIFY_SECONDS
+        )
+    except Exception as e:
+        print(f"⚠️ 語意快取驗證失敗: {e}")
+        return
+
+    if fresh.get("partial"):
+        return
+
+    if _tag_signature(fresh) == _tag_signature(reused):
+        SEMANTIC_VERIFICATIONS.inc(result="agree")
+    else:
+        SEMANTIC_VERIFICATIONS.inc(result="false_reuse")
+        log_event(
+            "semantic_cache_false_reuse",
+            reused=sorted(_tag_signature(reused)),
+            fresh=sorted(_tag_signature(fresh)),
+        )
+        semantic_cache.evict(entry_id)
+
+
+async def cached_compliance_check(
+    user_text: str,
+    deadline: Optional[float] = None,
+    mode: str = "full",
+) -> Dict[str, Any]:
+    """
+    process_compliance_check_async 的快取版本（SEMANTIC_CACHE_ENABLED=1 時生效）。
+    query embedding 走 database.embed_text，之後向量搜尋會直接命中 embedding 快取。
+    只有 full 模式走語意快取：fast / standard 本來就便宜，各階段也有自己的快取。
+    """
+    if not SEMANTIC_CACHE_ENABLED or mode != "full":
+        return await process_compliance_check_async(user_text, deadline=deadline, mode=mode)
+
+    try:
+        embedding = await run_with_deadline(asyncio.to_thread(embed_text, user_text), deadline)
+    except asyncio.TimeoutError:
+        # 查快取本身不能吃掉整個 request 的時限；直接走正常流程（它會自己處理超時）
+        embedding = None
+    if embedding is None:
+        return await process_compliance_check_async(user_text, deadline=deadline)
+
+    hit = semantic_cache.lookup(user_text, embedding)
+    record_cache("semantic", hit is not None)
+
+    if hit is not None:
+        entry_id, entry, similarity = hit
+        cached = entry["result"]
+        log_event("semantic_cache_hit", similarity=round(similarity, 4))
+
+        reused = {
+            "step1_output": cached["step1_output"],
+            "vector_search_results": cached["vector_search_results"],
+            # 整段改寫是針對舊文字寫的，不能直接套到新文字
+            "final_analysis": {**cached["final_analysis"], "suggestion": ""},
+            "partial": False,
+            "timed_out_stages": [],
+            "semantic_cache_hit": True,
+        }
+
+        if (
+            SEMANTIC_CACHE_VERIFY_RATE > 0
+            and not admission.busy
+            and random.random() < SEMANTIC_CACHE_VERIFY_RATE
+        ):
+            task = asyncio.create_task(_verify_hit(entry_id, user_text, reused))
+            _verify_tasks.add(task)
+            task.add_done_callback(_verify_tasks.discard)
+
+        return reused
+
+    version = data_version()
+    result = await process_compliance_check_async(user_text, deadline=deadline)
+
+    # 只存完整結果；部分結果（超時）不能拿來給別人用
+    if not result.get("partial"):
+        semantic_cache.store(user_text, embedding, result, computed_version=version)
+    return result
@@ -0,0 +1,193 @@
+# suggestion.py
+# 整段改寫（suggestion）從 Step 3 拆出來：它是 Step 3 裡最長的輸出，解碼時間佔大半，
+# 但很多使用者根本不會點開看。
+#
+# - 主流程只回傳 suggestion_id（register_suggestion），改寫要的原文 + 違規詞原因先存進快取
+# - 前端要看時打 /api/suggestion/{id}（或 /stream 邊產生邊顯示）才真的呼叫 Gemini
+# - id 由「原文 + 分析內容 + model / prompt」算出來，同一段文字同一份分析只會產生一次
+#
+# SUGGESTION_DEFERRED=0 時 main.py 會在主流程裡直接等改寫（舊行為，延遲較高）。
+
+import os
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from cache import get_cache, make_key
+from logic import MODEL_NAME, get_model, remaining_seconds
+from metrics import log_event, record_fallback, stage
+from prompts import SUGGESTION_PROMPT_TEMPLATE
+
+load_dotenv()
+
+SUGGESTION_DEFERRED = os.getenv("SUGGESTION_DEFERRED", "1") == "1"
+# 原文 + 分析要留多久給使用者點「看改寫」
+SUGGESTION_INPUT_TTL = float(os.getenv("SUGGESTION_INPUT_TTL", "3600"))
+SUGGESTION_CACHE_TTL = float(os.getenv("SUGGESTION_CACHE_TTL", "86400"))
+SUGGESTION_TIMEOUT_SECONDS = float(os.getenv("SUGGESTION_TIMEOUT_SECONDS", "20"))
+
+# 改寫是純文字，不要用主 model 的 JSON 輸出設定
+PLAIN_TEXT_CONFIG = {"response_mime_type": "text/plain"}
+
+# 串流時 200 header 已經送出，中途失敗只能在內容裡標記；前端看到這行就顯示「改寫失敗，請重試」
+STREAM_ERROR_MARKER = "\n[[SUGGESTION_ERROR]]\n"
+
+# 同一個 id 同時被點很多次：只呼叫一次 Gemini
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+class SuggestionError(Exception):
+    pass
+
+
+# ==========================================
+# 1. 主流程：登記改寫需要的輸入，回傳 handle
+# ==========================================
+def _violations(analysis_results: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    return [
+        {
+            "tag": a.get("tag") or "",
+            "trigger_word": a.get("trigger_word") or "",
+            "reason": a.get("reason") or "",
+        }
+        for a in analysis_results
+        if a.get("trigger_word")
+    ]
+
+
+def register_suggestion(user_text: str, analysis_results: List[Dict[str, Any]]) -> Optional[str]:
+    """沒有違規詞就沒有東西要改寫，回傳 None。"""
+    violations = _violations(analysis_results)
+    if not violations:
+        return None
+
+    suggestion_id = make_key(MODEL_NAME, SUGGESTION_PROMPT_TEMPLATE, user_text, violations)[:32]
+    get_cache().set(
+        "suggestion_input",
+        suggestion_id,
+        {"text": user_text, "violations": violations},
+        ttl=SUGGESTION_INPUT_TTL,
+    )
+    return suggestion_id
+
+
+def _load_input(suggestion_id: str) -> Dict[str, Any]:
+    entry = get_cache().get("suggestion_input", suggestion_id)
+    if entry is None:
+        raise KeyError(suggestion_id)
+    return entry
+
+
+def has_suggestion(suggestion_id: str) -> bool:
+    cache = get_cache()
+    return (
+        cache.get("suggestion", suggestion_id) is not None
+        or cache.get("suggestion_input", suggestion_id) is not None
+    )
+
+
+def build_prompt(entry: Dict[str, Any]) -> str:
+    lines = [
+        f"- 「{v['trigger_word']}」（{v['tag']}）：{v['reason'] or '可能涉及誇大或醫療效能宣稱'}"
+        for v in entry["violations"]
+    ]
+    return SUGGESTION_PROMPT_TEMPLATE.format(user_text=entry["text"], violations="\n".join(lines))
+
+
+# ==========================================
+# 2. 產生改寫
+# ==========================================
+async def _generate(suggestion_id: str, entry: Dict[str, Any]) -> str:
+    model = get_model()
+    if not model:
+        record_fallback("suggestion", "no_model")
+        raise SuggestionError("model unavailable")
+
+    try:
+        with stage("suggestion"):
+            response = await model.generate_content_async(
+                build_prompt(entry), generation_config=PLAIN_TEXT_CONFIG
+            )
+        suggestion = (response.text or "").strip()
+    except Exception as e:
+        print(f"❌ Suggestion Error: {e}")
+        record_fallback("suggestion", "llm_error")
+        raise SuggestionError(str(e)) from e
+
+    get_cache().set("suggestion", suggestion_id, suggestion, ttl=SUGGESTION_CACHE_TTL)
+    return suggestion
+
+
+async def get_suggestion(suggestion_id: str, deadline: Optional[float] = None) -> str:
+    """
+    有快取直接回；沒有就產生（同一個 id 共用一個進行中的呼叫）。
+    id 不存在或已過期丟 KeyError，產生失敗丟 SuggestionError，超過 deadline 丟 asyncio.TimeoutError。
+    """
+    cached = get_cache().get("suggestion", suggestion_id)
+    if cached is not None:
+        return cached
+
+    task = _inflight.get(suggestion_id)
+    if task is None:
+        entry = _load_input(suggestion_id)
+        task = asyncio.create_task(_generate(suggestion_id, entry))
+        _inflight[suggestion_id] = task
+        task.add_done_callback(lambda _: _inflight.pop(suggestion_id, None))
+
+    # 呼叫端逾時 / 斷線不取消產生中的改寫，其他人（或重試）還用得到
+    return await asyncio.wait_for(asyncio.shield(task), remaining_seconds(deadline))
+
+
+async def stream_suggestion(suggestion_id: str) -> AsyncIterator[str]:
+    """
+    邊產生邊吐字。已有快取或別人正在產生時，等結果一次吐完。
+    只有完整串完才寫進快取（client 中途離開的半段不存）。
+    失敗時不丟例外（header 已經送出），吐 STREAM_ERROR_MARKER 後結束。
+    """
+    cached = get_cache().get("suggestion", suggestion_id)
+    if cached is not None:
+        yield cached
+        return
+
+    if suggestion_id in _inflight:
+        try:
+            yield await asyncio.shield(_inflight[suggestion_id])
+        except Exception:
+            # 產生那一邊已經記過 fallback / log
+            yield STREAM_ERROR_MARKER
+        return
+
+    try:
+        entry = _load_input(suggestion_id)
+    except KeyError:
+        # 路由檢查過 has_suggestion 之後才過期
+        record_fallback("suggestion", "expired", stream=True)
+        yield STREAM_ERROR_MARKER
+        return
+    model = get_model()
+    if not model:
+        record_fallback("suggestion", "no_model", stream=True)
+        yield STREAM_ERROR_MARKER
+        return
+
+    parts: List[str] = []
+    try:
+        with stage("suggestion", stream=True):
+            response = await model.generate_content_async(
+                build_prompt(entry), generation_config=PLAIN_TEXT_CONFIG, stream=True
+            )
+            async for chunk in response:
+                text = chunk.text or ""
+                if text:
+                    parts.append(text)
+                    yield text
+    except Exception as e:
+        print(f"❌ Suggestion Stream Error: {e}")
+        record_fallback("suggestion", "llm_error", stream=True)
+        yield STREAM_ERROR_MARKER
+        return
+
+    suggestion = "".join(parts).strip()
+    get_cache().set("suggestion", suggestion_id, suggestion, ttl=SUGGESTION_CACHE_TTL)
+    log_event("suggestion_streamed", chars=len(suggestion))
@@ -4,19 +4,37 @@ import os
 import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from pinecone import Pinecone
-import google.generativeai as genai
 from dotenv import load_dotenv
 
+import case_embeddings
+import case_store
+import pgvector_store
+from cache import invalidate_data_caches
+from database import EMBEDDING_MODEL
+from partitions import PINECONE_NAMESPACE_LAYOUT, write_namespaces
+from pgvector_store import VECTOR_BACKEND
+
 # 1. 載入環境變數
 load_dotenv()
 
-# 2. 設定 API
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+# 2. 設定 API（Pinecone / Gemini 在 sync_data() 真的要跑時才初始化）
 index_name = os.getenv("PINECONE_INDEX_NAME", "ad-compliance")
-index = pc.Index(index_name)
+
+
+def get_genai():
+    """只有 case_embeddings 裡沒有（或已過期）的案件要 embed 時才會呼叫。"""
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    return genai
+
+
+def get_index():
+    """VECTOR_BACKEND=pgvector 時用不到 Pinecone。"""
+    from pinecone import Pinecone
+
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    return pc.Index(index_name)
 
 # ==========================================
 # 設定：SQL 欄位轉 Tag 名稱的對照邏輯
@@ -91,117 +109,331 @@ def get_db_connection():
 
 
 # ==========================================
-# 2. 核心同步邏輯：只上傳「有 Tag」的案例
+# 2. 單筆資料 → Pinecone metadata（純 CPU，micro benchmark 也會用）
+# ==========================================
+def build_tags_list(row) -> list:
+    """把 =1 的 tag 欄位轉成中文 Tag，加上 violation_type，去重。"""
+    tags_list = []
+
+    for col, tag_names in SQL_TO_TAG_MAP.items():
+        if row.get(col) == 1:
+            tags_list.extend(tag_names)
+
+    # 保留原本 violation_type 作為補充 Tag
+    if row.get("violation_type"):
+        tags_list.append(row["violation_type"])
+
+    # 去重
+    return list(set(tags_list))
+
+
+def build_case_metadata(row, tags_list: list) -> dict:
+    return {
+        "product_name": row.get("product_name") or "未知產品",
+        "explanation": row["case_explanation"],
+        "law": row.get("violation_law") or "",
+        "date": str(row.get("case_date") or ""),
+        "link": row.get("source_link") or "",
+        "industry": row.get("industry") or "Food",
+        "tag_name": tags_list,
+    }
+
+
+def tag_columns_of(row) -> list:
+    return [col for col in SQL_TO_TAG_MAP if row.get(col) == 1]
+
+
+# ==========================================
+# 3. namespace 紀錄：每個案件寫進過哪些 namespace（更新 / 刪除時要清舊的）
+# ==========================================
+MANIFEST_DDL = """
+    CREATE TABLE IF NOT EXISTS public.case_vector_namespaces (
+        case_id   TEXT NOT NULL,
+        namespace TEXT NOT NULL,
+        PRIMARY KEY (case_id, namespace)
+    );
+"""
+
+
+def load_namespaces(conn, case_ids: list) -> dict:
+    """case_id -> 之前寫過的 namespace 集合；沒有紀錄的視為舊的 flat 寫法（預設 namespace）。"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT case_id, namespace FROM public.case_vector_namespaces WHERE case_id = ANY(%s)",
+            (case_ids,),
+        )
+        found = {}
+        for case_id, namespace in cur.fetchall():
+            found.setdefault(case_id, set()).add(namespace)
+    return {cid: found.get(cid, {""}) for cid in case_ids}
+
+
+def save_namespaces(conn, entries: dict) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM public.case_vector_namespaces WHERE case_id = ANY(%s)",
+            (list(entries),),
+        )
+        for case_id, namespaces in entries.items():
+            for namespace in namespaces:
+                cur.execute(
+                    "INSERT INTO public.case_vector_namespaces (case_id, namespace) VALUES (%s, %s)",
+                    (case_id, namespace),
+                )
+    conn.commit()
+
+
+def delete_vectors(index, by_namespace: dict) -> None:
+    for namespace, ids in by_namespace.items():
+        if ids:
+            index.delete(ids=list(ids), namespace=namespace)
+
+
+def upsert_partitioned(index, conn, batch: list) -> None:
+    """
+    batch: [(case_id, vector, metadata, namespaces), ...]
+    先刪掉案件已經不屬於的 namespace 裡的舊向量，再依 namespace 分組 upsert。
+    """
+    previous = load_namespaces(conn, [item[0] for item in batch])
+
+    stale = {}
+    grouped = {}
+    for case_id, vector, metadata, namespaces in batch:
+        for namespace in previous[case_id] - set(namespaces):
+            stale.setdefault(namespace, []).append(case_id)
+        for namespace in namespaces:
+            # VECTOR_PAYLOAD=ids：只留篩選欄位，內容改由 case store 提供
+            grouped.setdefault(namespace, []).append(
+                (case_id, vector, case_store.strip_metadata(metadata))
+            )
+
+    delete_vectors(index, stale)
+    for namespace, vectors in grouped.items():
+        index.upsert(vectors=vectors, namespace=namespace)
+
+    save_namespaces(conn, {item[0]: item[3] for item in batch})
+
+
+def has_tag_sql(alias: str = "v") -> str:
+    return " OR ".join(f"{alias}.{col} = 1" for col in SQL_TO_TAG_MAP)
+
+
+def prune_partitions(conn, index, ids=None) -> int:
+    """
+    案件被刪掉、或 Tag 全被清成 0（不再符合同步條件）：把它在所有 namespace 的向量刪掉。
+    ids 有給就只檢查這些案件。回傳刪掉幾個案件。
+    """
+    has_tag = has_tag_sql()
+    query = f"""
+        SELECT m.case_id, m.namespace
+        FROM public.case_vector_namespaces m
+        LEFT JOIN public.violation_cases v ON v.id::text = m.case_id
+        WHERE (v.id IS NULL OR NOT ({has_tag}))
+        {"AND m.case_id = ANY(%s)" if ids is not None else ""}
+    """
+    with conn.cursor() as cur:
+        cur.execute(query, ([str(i) for i in ids],) if ids is not None else None)
+        rows = cur.fetchall()
+
+    by_namespace = {}
+    for case_id, namespace in rows:
+        by_namespace.setdefault(namespace, []).append(case_id)
+    delete_vectors(index, by_namespace)
+
+    case_ids = sorted({case_id for case_id, _ in rows})
+    if case_ids:
+        save_namespaces(conn, {cid: [] for cid in case_ids})
+        print(f"🗑️ 從 Pinecone 移除 {len(case_ids)} 筆已刪除 / 不再有 Tag 的案件")
+    return len(case_ids)
+
+
+def build_sync_query(ids=None) -> str:
+    """有任一個 tag = 1 的案例；ids 有給就只抓這些（參數是 (list(ids),)），否則加上 LIMIT。"""
+    tag_columns_sql = ", ".join(SQL_TO_TAG_MAP.keys())
+    where_clause = " OR ".join([f"{col} = 1" for col in SQL_TO_TAG_MAP.keys()])
+    return f"""
+        SELECT id,
+               product_name,
+               case_explaination AS case_explanation,
+               violation_law,
+               case_date,
+               source_link,
+               industry,
+               violation_type,
+               {tag_columns_sql}
+        FROM public.violation_cases
+        WHERE ({where_clause})
+        {"AND id = ANY(%s)" if ids is not None else ""}
+        ORDER BY id
+        {"" if ids is not None else "LIMIT 242"}   -- 🔧 全量同步想同步更多就改這裡
+    """
+
+
+def rebuild_case_store(conn=None) -> dict:
+    """
+    從 violation_cases 重建本機 case store（所有有 Tag 的案件，不受 sync 的 LIMIT 影響）。
+    conn 沒給就自己開一條。回傳 {"version", "count", "path"}。
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("無法連線到 PostgreSQL")
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(f"""
+                SELECT {case_store.CASE_COLUMNS_SQL}
+                FROM public.violation_cases v
+                WHERE ({has_tag_sql()})
+            """)
+            cases = {str(row["id"]): case_store.entry_from_row(row) for row in cursor.fetchall()}
+    finally:
+        if own_conn:
+            conn.close()
+
+    result = case_store.write_store(cases)
+    print(f"📚 案件資料檔已重建：{result['count']} 筆（version={result['version']}）")
+    return result
+
+
+# ==========================================
+# 4. 核心同步邏輯：只上傳「有 Tag」的案例
 # ==========================================
-def sync_data():
+def sync_data(ids=None, progress=None) -> dict:
+    """
+    ids：只同步這些案件（例如剛被 auto_tag 更新的）；None 表示照舊全量同步。
+    progress(done, total, message)：給 API 的排程器回報進度用，可省略。
+    寫到哪裡依 VECTOR_BACKEND 決定：Pinecone（namespace 依 PINECONE_NAMESPACE_LAYOUT，見 partitions.py）
+    或 pgvector（public.case_vectors，見 pgvector_store.py）。
+    向量先查 case_embeddings，內容 / model 沒變的不重新 embed。
+    最後重建本機 case store（VECTOR_PAYLOAD=ids 時檢索靠它補案件內容）。
+    pgvector 的向量索引在寫完、刪完之後才建 / 重建（見 pgvector_store.ensure_index）。
+    回傳 {"found", "upserted", "skipped", "pruned", "embedded", "reused", "case_store_version",
+    "vector_index"}（vector_index 只有 pgvector 會填）。
+    """
+    summary = {
+        "found": 0, "upserted": 0, "skipped": 0, "pruned": 0,
+        "embedded": 0, "reused": 0, "case_store_version": None, "vector_index": None,
+    }
+    if ids is not None and not ids:
+        return summary
+
+    use_pgvector = VECTOR_BACKEND == "pgvector"
+    index = None if use_pgvector else get_index()
+
     conn = get_db_connection()
     if not conn:
-        return
+        raise RuntimeError("無法連線到 PostgreSQL")
+
+    target = "pgvector" if use_pgvector else f"Pinecone（layout={PINECONE_NAMESPACE_LAYOUT}）"
+    print(f"🚀 開始從 PostgreSQL 同步資料到 {target}...")
 
-    print("🚀 開始從 PostgreSQL 同步資料到 Pinecone...")
+    def flush(batch):
+        if use_pgvector:
+            pgvector_store.upsert_vectors(conn, [(cid, vec, meta) for cid, vec, meta, _ in batch])
+        else:
+            upsert_partitioned(index, conn, batch)
 
     try:
+        with conn.cursor() as cur:
+            cur.execute(MANIFEST_DDL)
+        conn.commit()
+        case_embeddings.ensure_schema(conn)
+        if use_pgvector:
+            pgvector_store.ensure_schema(conn)
+
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
 
-            # 1️⃣ 準備 Tag 欄位 SQL & WHERE 條件
-            tag_columns_sql = ", ".join(SQL_TO_TAG_MAP.keys())
-            where_clause = " OR ".join([f"{col} = 1" for col in SQL_TO_TAG_MAP.keys()])
-
-            # 2️⃣ 查詢：只抓「有任一個 tag = 1」的案例，並加上 LIMIT
-            query = f"""
-                SELECT id,
-                       product_name,
-                       case_explaination AS case_explanation,
-                       violation_law,
-                       case_date,
-                       source_link,
-                       industry,
-                       violation_type,
-                       {tag_columns_sql}
-                FROM public.violation_cases
-                WHERE {where_clause}
-                ORDER BY id
-                LIMIT 242;   -- 🔧 想同步更多就改這裡
-            """
+            # 1️⃣ 2️⃣ 查詢：只抓「有任一個 tag = 1」的案例
+            query = build_sync_query(ids)
 
             print("\n🔍 即將執行 SQL：")
             print(query)
 
-            cursor.execute(query)
+            cursor.execute(query, (list(ids),) if ids is not None else None)
             rows = cursor.fetchall()
+            summary["found"] = len(rows)
 
             print(f"\n📊 共找到 {len(rows)} 筆「有 Tag 的資料」，開始處理...\n")
 
-            # 3️⃣ 批次上傳到 Pinecone
+            # 3️⃣ 文字 → 向量：case_embeddings 有的直接用，其餘分批呼叫 Gemini
+            to_embed = []
+            for row in rows:
+                text_to_embed = row["case_explanation"]
+                if not text_to_embed or not text_to_embed.strip():
+                    print(f"⚠️ 跳過 ID {row['id']}（說明為空）")
+                    summary["skipped"] += 1
+                    continue
+                to_embed.append((str(row["id"]), text_to_embed))
+
+            vectors, embed_stats = case_embeddings.embed_cases(
+                conn, get_genai, to_embed, EMBEDDING_MODEL, progress=progress
+            )
+            summary["embedded"] = embed_stats["embedded"]
+            summary["reused"] = embed_stats["reused"]
+            summary["skipped"] += embed_stats["failed"]
+            print(f"🧮 向量：重用 {embed_stats['reused']} 筆，新 embed {embed_stats['embedded']} 筆，失敗 {embed_stats['failed']} 筆")
+
+            # 4️⃣ 批次上傳
             batch_vectors = []
             batch_size = 50
 
             for i, row in enumerate(rows):
                 case_id = str(row["id"])
-                text_to_embed = row["case_explanation"]
-
-                if not text_to_embed or not text_to_embed.strip():
-                    print(f"⚠️ 跳過 ID {case_id}（說明為空）")
+                vector = vectors.get(case_id)
+                if vector is None:
                     continue
 
-                # 4️⃣ 整理 tags_list：把 =1 的欄位轉成中文 Tag
-                tags_list = []
-
-                for col, tag_names in SQL_TO_TAG_MAP.items():
-                    if row.get(col) == 1:
-                        tags_list.extend(tag_names)
-
-                # 保留原本 violation_type 作為補充 Tag
-                if row.get("violation_type"):
-                    tags_list.append(row["violation_type"])
-
-                # 去重
-                tags_list = list(set(tags_list))
-
-                # 5️⃣ 文字 → 向量（Gemini embedding）
-                try:
-                    embedding_resp = genai.embed_content(
-                        model="models/text-embedding-004",
-                        content=text_to_embed,
-                        task_type="retrieval_document"
-                    )
-                    vector = embedding_resp["embedding"]
-                except Exception as e:
-                    print(f"❌ ID {case_id} 向量化失敗：{e}")
-                    continue
+                # 5️⃣ 整理 tags_list：把 =1 的欄位轉成中文 Tag
+                tags_list = build_tags_list(row)
 
-                # 6️⃣ metadata 準備進 Pinecone
-                metadata = {
-                    "product_name": row.get("product_name") or "未知產品",
-                    "explanation": text_to_embed,
-                    "law": row.get("violation_law") or "",
-                    "date": str(row.get("case_date") or ""),
-                    "link": row.get("source_link") or "",
-                    "industry": row.get("industry") or "Food",
-                    "tag_name": tags_list,
-                }
+                # 6️⃣ metadata（Pinecone / pgvector 共用）
+                metadata = build_case_metadata(row, tags_list)
 
-                batch_vectors.append((case_id, vector, metadata))
+                namespaces = write_namespaces(row.get("industry"), tag_columns_of(row))
+                batch_vectors.append((case_id, vector, metadata, namespaces))
 
                 print(f"✅ 已處理 {i+1}/{len(rows)} → {metadata['product_name']} | tags={tags_list}")
 
                 # 每 50 筆上傳一次
                 if len(batch_vectors) >= batch_size:
-                    index.upsert(vectors=batch_vectors)
-                    print(f"📤 上傳 {len(batch_vectors)} 筆到 Pinecone")
+                    flush(batch_vectors)
+                    print(f"📤 上傳 {len(batch_vectors)} 筆到 {target}")
+                    summary["upserted"] += len(batch_vectors)
                     batch_vectors = []
-                    time.sleep(1)
+                    if not use_pgvector:
+                        time.sleep(1)
+
+                if progress:
+                    progress(i + 1, len(rows), f"synced id={case_id}")
 
             # 上傳剩下的
             if batch_vectors:
-                index.upsert(vectors=batch_vectors)
+                flush(batch_vectors)
                 print(f"📤 最後上傳 {len(batch_vectors)} 筆")
+                summary["upserted"] += len(batch_vectors)
+
+        # 7️⃣ 已刪除 / Tag 被清空的案件，從所有 namespace（或 case_vectors）移除
+        if use_pgvector:
+            summary["pruned"] = pgvector_store.prune_vectors(conn, has_tag_sql(), ids)
+            summary["vector_index"] = pgvector_store.ensure_index(conn)
+            print(f"🧭 pgvector 向量索引：{summary['vector_index']}")
+        else:
+            summary["pruned"] = prune_partitions(conn, index, ids)
+
+        # 8️⃣ 案件內容可能改了（或有新案件），case store 整批重建
+        summary["case_store_version"] = rebuild_case_store(conn)["version"]
 
     except Exception as e:
         print(f"❌ 同步過程錯誤：{e}")
+        raise
     finally:
         conn.close()
-        print("\n🏁 Pinecone 同步作業完成")
+        # 讓 API（共用快取後端）知道資料已經變了
+        invalidate_data_caches()
+        print(f"\n🏁 {target} 同步作業完成")
+
+    return summary
 
 if __name__ == "__main__":
     sync_data()
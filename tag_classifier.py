@@ -0,0 +1,455 @@
+# tag_classifier.py
+# Step 1 的低延遲替代：用 embedding 原型向量（per-tag / per-industry prototype）分類。
+#
+# - 建模（離線）：violation_cases 裡有 Tag 的案件 → 案情說明做 embedding →
+#   每個 tag 的正例平均成一個原型向量，產業也一樣；存成 JSON（TAG_CLASSIFIER_PATH）
+# - 線上：query embedding（database.embed_text，向量搜尋本來就要算、會命中快取）
+#   跟每個原型算 cosine：>= ACCEPT 算有、< REJECT 算沒有，中間帶就是「不確定」
+# - trigger words：用 lexicon 在原文找實際出現的詞（種子 = tag 名稱 + SEED_TRIGGERS，
+#   之後每次 LLM Step 1 的結果都會把 trigger words 學進來，存在共用快取）
+# - 有任何 tag 落在不確定帶、沒有原型的 tag 在原文出現觸發詞、
+#   或判定有的 tag 在原文找不到詞 → 回傳 None，交給 LLM
+#
+# 0/1 tag 欄位本身就是 auto_tag_cases 用同一個 Step 1 prompt 標的，
+# 所以離線評估直接拿 holdout 案件的欄位當 LLM 標註：
+#   python tag_classifier.py build
+#   python tag_classifier.py eval --holdout 0.2
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from psycopg2.extras import RealDictCursor
+
+from cache import get_cache
+from database import (
+    TAG_MAPPING,
+    EMBEDDING_MODEL,
+    embed_text,
+    get_genai,
+    get_db_connection,
+    release_db_connection,
+)
+from metrics import Counter, stage
+
+load_dotenv()
+
+STEP1_CLASSIFIER_ENABLED = os.getenv("STEP1_CLASSIFIER_ENABLED", "0") == "1"
+TAG_CLASSIFIER_PATH = os.getenv(
+    "TAG_CLASSIFIER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tag_classifier.json")
+)
+TAG_CLASSIFIER_ACCEPT = float(os.getenv("TAG_CLASSIFIER_ACCEPT", "0.80"))
+TAG_CLASSIFIER_REJECT = float(os.getenv("TAG_CLASSIFIER_REJECT", "0.65"))
+# 最少幾個正例才建原型；沒有原型的 tag 只要原文出現它的觸發詞，就交給 LLM
+TAG_CLASSIFIER_MIN_EXAMPLES = int(os.getenv("TAG_CLASSIFIER_MIN_EXAMPLES", "5"))
+
+STEP1_CLASSIFIER = Counter(
+    "lawpatrol_step1_classifier_total",
+    "Fast tag classifier outcomes (accepted or handed to the LLM)",
+    ["result"],
+)
+
+ZH_TO_EN_INDUSTRY = {"食物": "Food", "化妝品": "Cosmetic", "藥品": "Medicine", "醫療器材": "Device"}
+
+# 常見違規用語的種子詞（LLM 學到的詞會再加上去）
+SEED_TRIGGERS: Dict[str, List[str]] = {
+    "治療": ["治療", "治癒", "療效"],
+    "症狀緩解": ["緩解", "改善症狀", "舒緩"],
+    "預防": ["預防", "防止"],
+    "痊癒": ["痊癒", "根治", "斷根"],
+    "消腫": ["消腫", "消水腫"],
+    "燃脂瘦身": ["燃脂", "甩油", "瘦身", "減肥", "爆瘦", "窈窕"],
+    "排毒解酒": ["排毒", "解酒", "代謝毒素"],
+    "再生抗老": ["抗老", "回春", "再生", "凍齡"],
+    "拉提緊緻": ["拉提", "緊緻"],
+    "生髮育髮": ["生髮", "育髮", "防掉髮"],
+    "豐胸": ["豐胸", "美胸"],
+    "長高發育": ["長高", "轉骨"],
+    "睡眠情緒": ["助眠", "好眠", "紓壓"],
+    "免疫體質": ["提升免疫", "增強免疫", "免疫力", "改善體質"],
+    "唯一第一": ["唯一", "第一", "最有效"],
+    "完全永久": ["完全", "永久", "百分之百"],
+    "奇蹟神效": ["奇蹟", "神效", "神奇"],
+    "保證承諾": ["保證", "無效退費"],
+    "立即速效": ["立即見效", "馬上見效", "速效", "立刻"],
+    "臨床實驗": ["臨床實驗", "臨床證實", "臨床"],
+    "醫師專家": ["醫師推薦", "醫師", "專家推薦"],
+    "見證推薦": ["見證", "親身體驗"],
+    "癌症": ["抗癌", "癌症", "腫瘤"],
+    "三高心血管": ["降血壓", "降血糖", "降血脂", "三高", "心血管"],
+    "發炎": ["消炎", "抗發炎", "發炎"],
+}
+
+
+# ==========================================
+# 1. 向量工具（純 Python，原型只有幾十個，不需要 numpy）
+# ==========================================
+def normalize(vector: List[float]) -> Optional[List[float]]:
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        return None
+    return [v / norm for v in vector]
+
+
+def mean_vector(vectors: List[List[float]]) -> Optional[List[float]]:
+    if not vectors:
+        return None
+    dim = len(vectors[0])
+    total = [0.0] * dim
+    for vec in vectors:
+        for i, v in enumerate(vec):
+            total[i] += v
+    return normalize([v / len(vectors) for v in total])
+
+
+def dot(a: List[float], b: List[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+# ==========================================
+# 2. trigger word lexicon
+# ==========================================
+class TriggerLexicon:
+    """tag -> 觸發詞集合；LLM 學到的詞存在共用快取（namespace "lexicon"），跨 worker / 重啟都在。"""
+
+    def __init__(self):
+        self._words: Dict[str, Set[str]] = {tag: set(SEED_TRIGGERS.get(tag, [])) | {tag} for tag in TAG_MAPPING}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            learned = get_cache().get("lexicon", "learned") or {}
+            for tag, words in learned.items():
+                self._words.setdefault(tag, set()).update(words)
+            self._loaded = True
+
+    def learn(self, step1_result: Dict[str, Any], text: str) -> None:
+        self._load()
+        added = False
+        with self._lock:
+            for item in step1_result.get("identified_tags", []) or []:
+                tag = item.get("tag")
+                if tag not in TAG_MAPPING:
+                    continue
+                for word in item.get("trigger_words", []) or []:
+                    # 太短的詞（單字）誤判率太高
+                    if word and len(word) >= 2 and word in text and word not in self._words[tag]:
+                        self._words[tag].add(word)
+                        added = True
+            if added:
+                learned = {tag: sorted(words) for tag, words in self._words.items()}
+        if added:
+            get_cache().set("lexicon", "learned", learned)
+
+    def find(self, text: str, tag: str) -> List[str]:
+        """原文裡實際出現的觸發詞；長詞優先，被長詞包住的短詞不重複列。"""
+        self._load()
+        found: List[str] = []
+        for word in sorted(self._words.get(tag, ()), key=len, reverse=True):
+            if word in text and not any(word in longer for longer in found):
+                found.append(word)
+        return found
+
+
+lexicon = TriggerLexicon()
+
+
+# ==========================================
+# 3. 分類器
+# ==========================================
+class PrototypeClassifier:
+    def __init__(self, model: Dict[str, Any], accept: float = TAG_CLASSIFIER_ACCEPT, reject: float = TAG_CLASSIFIER_REJECT):
+        self.tag_prototypes: Dict[str, List[float]] = model["tags"]
+        self.industry_prototypes: Dict[str, List[float]] = model["industries"]
+        self.meta = model.get("meta", {})
+        self.accept = accept
+        self.reject = reject
+
+    def scores(self, embedding: List[float]) -> Tuple[Dict[str, float], Dict[str, float]]:
+        query = normalize(embedding) or embedding
+        tag_scores = {tag: dot(query, proto) for tag, proto in self.tag_prototypes.items()}
+        industry_scores = {ind: dot(query, proto) for ind, proto in self.industry_prototypes.items()}
+        return tag_scores, industry_scores
+
+    def decide(self, text: str, tag_scores: Dict[str, float]) -> Tuple[List[str], bool]:
+        """
+        回傳 (判定有的 tags, 是否不確定)。
+        不確定：有 tag 落在 reject~accept 之間，或某個 tag 在原文找得到觸發詞、卻沒判定有
+        （分數低於 accept，或根本沒有原型）。只有觸發詞全都對到 positives 才算有把握，
+        不然文案裡明明有「治療」「保證」也會被當成沒問題。
+        """
+        positives = [t for t, s in tag_scores.items() if s >= self.accept]
+        uncertain = any(self.reject <= s < self.accept for s in tag_scores.values())
+        if not uncertain:
+            uncertain = any(
+                lexicon.find(text, tag) for tag in TAG_MAPPING if tag not in positives
+            )
+        return positives, uncertain
+
+    def verdict(self, text: str, tag_scores: Dict[str, float]) -> Tuple[Optional[List[Dict[str, Any]]], str]:
+        """
+        線上 classify() 與離線 evaluate() 共用的判定：
+        回傳 (identified_tags, result)，result 是 accepted / uncertain / no_span，
+        只有 accepted 時 identified_tags 不是 None。
+        """
+        positives, uncertain = self.decide(text, tag_scores)
+        if uncertain:
+            return None, "uncertain"
+
+        identified = []
+        for tag in sorted(positives, key=lambda t: tag_scores[t], reverse=True):
+            words = lexicon.find(text, tag)
+            if not words:
+                # 有把握是這個 tag，但標不出位置 → 前端沒東西可以畫線，交給 LLM
+                return None, "no_span"
+            identified.append({"tag": tag, "trigger_words": words})
+        return identified, "accepted"
+
+    def classify(self, text: str, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """有把握就回傳 Step 1 格式的結果，沒把握回傳 None。"""
+        tag_scores, industry_scores = self.scores(embedding)
+        identified, result = self.verdict(text, tag_scores)
+        if identified is None:
+            STEP1_CLASSIFIER.inc(result=result)
+            return None
+
+        industry = max(industry_scores, key=industry_scores.get) if industry_scores else "Unknown"
+        STEP1_CLASSIFIER.inc(result="accepted")
+        return {
+            "industry": ZH_TO_EN_INDUSTRY.get(industry, industry),
+            "identified_tags": identified,
+            "source": "classifier",
+        }
+
+
+_classifier: Optional[PrototypeClassifier] = None
+_classifier_tried = False
+_classifier_lock = threading.Lock()
+
+
+def get_classifier() -> Optional[PrototypeClassifier]:
+    global _classifier, _classifier_tried
+    if _classifier_tried:
+        return _classifier
+    with _classifier_lock:
+        if not _classifier_tried:
+            try:
+                with open(TAG_CLASSIFIER_PATH, encoding="utf-8") as f:
+                    _classifier = PrototypeClassifier(json.load(f))
+                print(f"🧭 已載入 tag 分類器：{TAG_CLASSIFIER_PATH}")
+            except FileNotFoundError:
+                print(f"⚠️ 找不到 tag 分類器 {TAG_CLASSIFIER_PATH}，Step 1 一律走 LLM")
+            except Exception as e:
+                print(f"⚠️ 載入 tag 分類器失敗：{e}")
+            _classifier_tried = True
+    return _classifier
+
+
+def classify_text(text: str) -> Optional[Dict[str, Any]]:
+    """logic.identify_tags_async 用（在 thread 裡跑）：沒模型 / 沒 embedding / 沒把握都回 None。"""
+    classifier = get_classifier()
+    if classifier is None:
+        STEP1_CLASSIFIER.inc(result="unavailable")
+        return None
+    embedding = embed_text(text)
+    if embedding is None:
+        STEP1_CLASSIFIER.inc(result="unavailable")
+        return None
+    with stage("step1_classifier"):
+        return classifier.classify(text, embedding)
+
+
+# ==========================================
+# 4. 離線：建模 & 評估
+# ==========================================
+def load_labeled_cases() -> List[Dict[str, Any]]:
+    columns = list(TAG_MAPPING.values())
+    has_tag = " OR ".join(f"{col} = 1" for col in columns)
+    conn = get_db_connection()
+    if conn is None:
+        raise RuntimeError("無法連線到 PostgreSQL")
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"""
+                SELECT id, case_explaination, industry, {", ".join(columns)}
+                FROM public.violation_cases
+                WHERE ({has_tag}) AND case_explaination IS NOT NULL
+                ORDER BY id
+            """)
+            rows = cur.fetchall()
+    finally:
+        release_db_connection(conn)
+
+    column_to_tag = {col: tag for tag, col in TAG_MAPPING.items()}
+    cases = []
+    for row in rows:
+        if not (row.get("case_explaination") or "").strip():
+            continue
+        cases.append({
+            "id": row["id"],
+            "text": row["case_explaination"],
+            "industry": row.get("industry"),
+            "tags": {column_to_tag[col] for col in columns if row.get(col) == 1},
+        })
+    return cases
+
+
+def embed_documents(
+    texts: List[str],
+    batch_size: int = 100,
+    task_type: str = "retrieval_document",
+) -> List[List[float]]:
+    genai = get_genai()
+    if genai is None:
+        raise RuntimeError("GOOGLE_API_KEY 未設定")
+    vectors: List[List[float]] = []
+    for start in range(0, len(texts), batch_size):
+        resp = genai.embed_content(
+            model=EMBEDDING_MODEL,
+            content=texts[start:start + batch_size],
+            task_type=task_type,
+        )
+        vectors.extend(resp["embedding"])
+        print(f"  embedding {min(start + batch_size, len(texts))}/{len(texts)}")
+    return vectors
+
+
+def build_model(cases: List[Dict[str, Any]], vectors: List[List[float]]) -> Dict[str, Any]:
+    by_tag: Dict[str, List[List[float]]] = {}
+    by_industry: Dict[str, List[List[float]]] = {}
+    for case, vector in zip(cases, vectors):
+        for tag in case["tags"]:
+            by_tag.setdefault(tag, []).append(vector)
+        if case["industry"]:
+            by_industry.setdefault(case["industry"], []).append(vector)
+
+    tags = {
+        tag: mean_vector(vecs)
+        for tag, vecs in by_tag.items()
+        if len(vecs) >= TAG_CLASSIFIER_MIN_EXAMPLES
+    }
+    industries = {ind: mean_vector(vecs) for ind, vecs in by_industry.items()}
+    return {
+        "tags": {k: v for k, v in tags.items() if v},
+        "industries": {k: v for k, v in industries.items() if v},
+        "meta": {
+            "embedding_model": EMBEDDING_MODEL,
+            "cases": len(cases),
+            "examples_per_tag": {tag: len(vecs) for tag, vecs in by_tag.items()},
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+    }
+
+
+def split_holdout(cases: List[Dict[str, Any]], holdout: float, seed: int) -> Tuple[list, list]:
+    shuffled = list(cases)
+    random.Random(seed).shuffle(shuffled)
+    n_test = int(len(shuffled) * holdout)
+    return shuffled[n_test:], shuffled[:n_test]
+
+
+def evaluate(model: Dict[str, Any], test_cases, test_vectors, accept: float, reject: float) -> Dict[str, Any]:
+    classifier = PrototypeClassifier(model, accept=accept, reject=reject)
+    tp = fp = fn = 0
+    exact = confident = 0
+    per_tag: Dict[str, List[int]] = {}
+    started = time.perf_counter()
+
+    for case, vector in zip(test_cases, test_vectors):
+        tag_scores, _ = classifier.scores(vector)
+        # 跟線上同一個判定（含 no_span），數字才對得上實際部署的 coverage / 準確度
+        identified, _ = classifier.verdict(case["text"], tag_scores)
+        if identified is None:
+            continue
+        confident += 1
+        predicted_set, truth = {item["tag"] for item in identified}, case["tags"]
+        exact += predicted_set == truth
+        for tag in predicted_set | truth:
+            counts = per_tag.setdefault(tag, [0, 0, 0])
+            if tag in predicted_set and tag in truth:
+                tp += 1
+                counts[0] += 1
+            elif tag in predicted_set:
+                fp += 1
+                counts[1] += 1
+            else:
+                fn += 1
+                counts[2] += 1
+
+    elapsed = time.perf_counter() - started
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return {
+        "accept": accept,
+        "reject": reject,
+        "coverage": round(confident / len(test_cases), 3) if test_cases else 0.0,
+        "exact_match": round(exact / confident, 3) if confident else 0.0,
+        "precision": round(precision, 3),
+        "recall": round(recall, 3),
+        "f1": round(2 * precision * recall / (precision + recall), 3) if precision + recall else 0.0,
+        "classify_ms_per_text": round(elapsed / max(len(test_cases), 1) * 1000, 3),
+        "per_tag": {t: {"tp": c[0], "fp": c[1], "fn": c[2]} for t, c in sorted(per_tag.items())},
+    }
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Embedding prototype tag classifier (fast Step 1)")
+    sub = p.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="用全部有 Tag 的案件建模並存檔")
+    b.add_argument("--output", default=TAG_CLASSIFIER_PATH)
+    e = sub.add_parser("eval", help="holdout 評估（案件的 0/1 tag 欄位 = LLM 標註）")
+    e.add_argument("--holdout", type=float, default=0.2)
+    e.add_argument("--seed", type=int, default=42)
+    e.add_argument("--accept", type=float, nargs="*", default=[0.7, 0.75, 0.8, 0.85])
+    e.add_argument("--band", type=float, default=0.15, help="reject = accept - band")
+    e.add_argument("--output", help="評估結果存成 JSON")
+    args = p.parse_args(argv)
+
+    cases = load_labeled_cases()
+    print(f"📚 共 {len(cases)} 筆有 Tag 的案件")
+
+    if args.command == "build":
+        vectors = embed_documents([c["text"] for c in cases])
+        model = build_model(cases, vectors)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(model, f, ensure_ascii=False)
+        print(f"💾 已存到 {args.output}（{len(model['tags'])} 個 tag 原型）")
+        return 0
+
+    train, test = split_holdout(cases, args.holdout, args.seed)
+    # 原型照 build 用 retrieval_document；holdout 要跟線上 embed_text 一樣用 retrieval_query，
+    # 挑出來的 accept / reject 門檻才能直接搬到線上
+    model = build_model(train, embed_documents([c["text"] for c in train]))
+    test_vectors = embed_documents([c["text"] for c in test], task_type="retrieval_query")
+
+    results = []
+    for accept in args.accept:
+        r = evaluate(model, test, test_vectors, accept, accept - args.band)
+        results.append(r)
+        print(
+            f"  accept={accept:.2f} reject={accept - args.band:.2f} | coverage={r['coverage']:.3f} "
+            f"exact={r['exact_match']:.3f} P={r['precision']:.3f} R={r['recall']:.3f} "
+            f"F1={r['f1']:.3f} | {r['classify_ms_per_text']}ms/text"
+        )
+    print("ℹ️ coverage = 不用呼叫 LLM 的比例；其餘照舊走 Step 1 LLM（見 lawpatrol_stage_seconds{stage=\"step1\"}）")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"train": len(train), "test": len(test), "results": results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())